@@ -91,7 +91,7 @@ function commit() {
       clean();
       resolve('saved');
     };
-    xhr.send(binary);
+    utils.sendCompressed(xhr, binary);
   });
 }
 
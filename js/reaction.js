@@ -35,6 +35,7 @@ const stirring = goog.require('ord.stirring');
 const temperature = goog.require('ord.temperature');
 const uploads = goog.require('ord.uploads');
 const utils = goog.require('ord.utils');
+const validation = goog.require('ord.validation');
 const workups = goog.require('ord.workups');
 
 const Dataset = goog.require('proto.ord.Dataset');
@@ -147,9 +148,17 @@ async function validateReaction() {
   const node = $('#sections');
   const validateNode = $('#reaction_validate');
   const reaction = unloadReaction();
-  utils.validate(reaction, 'Reaction', node, validateNode);
-  // Trigger all submessages to validate.
-  $('.validate:visible:not(#reaction_validate)').trigger('click');
+  const updated = await validation.validate(reaction);
+  if (updated === null) {
+    utils.validate(reaction, 'Reaction', node, validateNode);
+    // Trigger all submessages to validate.
+    $('.validate:visible:not(#reaction_validate)').trigger('click');
+  } else {
+    // Nested sections that the channel does not update validate themselves.
+    $('.validate:visible:not(#reaction_validate)')
+        .not(updated)
+        .trigger('click');
+  }
   // Render reaction as an HTML block.
   await renderReaction(reaction);
 }
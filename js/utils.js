@@ -76,11 +76,13 @@ exports = {
   ready,
   readMetric,
   removeSlowly,
+  sendCompressed,
   setupObserver,
   setOptionalBool,
   setSelector,
   setTextFromFile,
   showOptionalSection,
+  showValidation,
   toggleAutosave,
   toggleValidateMessage,
   undoSlowly,
@@ -103,6 +105,8 @@ exports.session = session;
 
 const FLOAT_PATTERN = /^-?(?:\d+|\d+\.\d*|\d*\.\d+)(?:[eE]-?\d+)?$/;
 const INTEGER_PATTERN = /^-?\d+$/;
+// Request bodies smaller than this many bytes are sent uncompressed.
+const COMPRESS_MIN_SIZE = 1024;
 
 /**
  * Sets the `ready` value to true.
@@ -446,59 +450,68 @@ function validate(message, messageTypeString, node, validateNode) {
   const xhr = new XMLHttpRequest();
   xhr.open('POST', '/dataset/proto/validate/' + messageTypeString);
   const binary = message.serializeBinary();
-  if (!validateNode) {
-    validateNode = $('.validate', node).first();
-  }
+  const target = validateNode || $('.validate', node).first();
   xhr.responseType = 'json';
   xhr.onload = function() {
     const validationOutput = xhr.response;
-    const errors = validationOutput.errors;
-    const warnings = validationOutput.warnings;
-    // Add client-side validation errors.
-    node.find('.invalid').each(function() {
-      const invalidName = $(this).attr('class').split(' ')[0];
-      errors.push('Value for ' + invalidName + ' is invalid');
-    });
-    const statusNode = $('.validate_status', validateNode);
-    const messageNode = $('.validate_message', validateNode);
-    if (errors.length) {
-      statusNode.show();
-      statusNode.text(' ' + errors.length);
-      messageNode.show();
-      messageNode.html('<ul></ul>');
-      for (let index = 0; index < errors.length; index++) {
-        const error = errors[index];
-        const errorNode = $('<li></li>');
-        errorNode.text(error);
-        $('ul', messageNode).append(errorNode);
-      }
-    } else {
-      statusNode.hide();
-      messageNode.html('');
-      messageNode.hide();
-    }
-    const warningStatusNode = $('.validate_warning_status', validateNode);
-    const warningMessageNode = $('.validate_warning_message', validateNode);
-    if (warnings.length) {
-      warningStatusNode.show();
-      warningStatusNode.text(' ' + warnings.length);
-      warningMessageNode.show();
-      warningMessageNode.html('<ul></ul>');
-      for (let index = 0; index < warnings.length; index++) {
-        const warning = warnings[index];
-        const warningNode = $('<li></li>');
-        warningNode.text(warning);
-        $('ul', warningMessageNode).append(warningNode);
-      }
-    } else {
-      warningStatusNode.hide();
-      warningMessageNode.html('');
-      warningMessageNode.hide();
-    }
+    showValidation(
+        validationOutput.errors, validationOutput.warnings, node, target);
   };
   xhr.send(binary);
 }
 
+/**
+ * Displays validation output, adding client-side errors of the node.
+ * @param {!Array<string>} errors
+ * @param {!Array<string>} warnings
+ * @param {!jQuery} node Root node of the validated message.
+ * @param {!jQuery} validateNode Target node for validation results.
+ */
+function showValidation(errors, warnings, node, validateNode) {
+  errors = errors.slice();
+  // Add client-side validation errors.
+  node.find('.invalid').each(function() {
+    const invalidName = $(this).attr('class').split(' ')[0];
+    errors.push('Value for ' + invalidName + ' is invalid');
+  });
+  const statusNode = $('.validate_status', validateNode);
+  const messageNode = $('.validate_message', validateNode);
+  if (errors.length) {
+    statusNode.show();
+    statusNode.text(' ' + errors.length);
+    messageNode.show();
+    messageNode.html('<ul></ul>');
+    for (let index = 0; index < errors.length; index++) {
+      const error = errors[index];
+      const errorNode = $('<li></li>');
+      errorNode.text(error);
+      $('ul', messageNode).append(errorNode);
+    }
+  } else {
+    statusNode.hide();
+    messageNode.html('');
+    messageNode.hide();
+  }
+  const warningStatusNode = $('.validate_warning_status', validateNode);
+  const warningMessageNode = $('.validate_warning_message', validateNode);
+  if (warnings.length) {
+    warningStatusNode.show();
+    warningStatusNode.text(' ' + warnings.length);
+    warningMessageNode.show();
+    warningMessageNode.html('<ul></ul>');
+    for (let index = 0; index < warnings.length; index++) {
+      const warning = warnings[index];
+      const warningNode = $('<li></li>');
+      warningNode.text(warning);
+      $('ul', warningMessageNode).append(warningNode);
+    }
+  } else {
+    warningStatusNode.hide();
+    warningMessageNode.html('');
+    warningMessageNode.hide();
+  }
+}
+
 /**
  * Toggles the visibility of the 'validate' button for a given node.
  * @param {!jQuery} target
@@ -545,7 +558,36 @@ function putDataset(fileName, dataset) {
   xhr.open('POST', '/dataset/proto/write/' + fileName);
   const binary = dataset.serializeBinary();
   xhr.onload = clean;
-  xhr.send(binary);
+  sendCompressed(xhr, binary);
+}
+
+/**
+ * Sends a request body with gzip Content-Encoding if the browser supports
+ * CompressionStream, or as is otherwise. Responses need no such help: the
+ * browser sends Accept-Encoding and decompresses them itself.
+ * @param {!XMLHttpRequest} xhr An opened request.
+ * @param {!Uint8Array} binary The body.
+ * @return {!Promise}
+ */
+async function sendCompressed(xhr, binary) {
+  // Accessed by name because the compiler externs predate these APIs.
+  const CompressionStream = goog.global['CompressionStream'];
+  if (!CompressionStream || binary.length < COMPRESS_MIN_SIZE) {
+    xhr.send(binary);
+    return;
+  }
+  let compressed;
+  try {
+    const blob = /** @type {?} */ (new Blob([binary]));
+    const stream = blob.stream().pipeThrough(new CompressionStream('gzip'));
+    compressed = await new Response(stream).arrayBuffer();
+  } catch (error) {
+    console.log('compression failed', error);
+    xhr.send(binary);
+    return;
+  }
+  xhr.setRequestHeader('Content-Encoding', 'gzip');
+  xhr.send(compressed);
 }
 
 /**
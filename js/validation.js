@@ -0,0 +1,252 @@
+/**
+ * Copyright 2020 Open Reaction Database Project Authors
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+/**
+ * Incremental reaction validation over a WebSocket.
+ *
+ * The server keeps the last Reaction sent on the connection (see
+ * py/incremental_validation.py). Each validation sends only the top-level
+ * parts of the Reaction that changed since the last one, keyed by field path,
+ * and the server answers with the outputs that changed. The channel exists
+ * only when the editor is served by py/async_serve.py; otherwise validate()
+ * resolves to null and callers fall back to utils.validate().
+ */
+
+goog.module('ord.validation');
+goog.module.declareLegacyNamespace();
+
+const base64 = goog.require('goog.crypt.base64');
+
+const utils = goog.require('ord.utils');
+
+const Reaction = goog.require('proto.ord.Reaction');
+
+exports = {
+  validate,
+};
+
+// Validation results for these paths are shown in these sections.
+const SECTIONS = {
+  'setup': '#section_setup',
+  'conditions': '#section_conditions',
+  'conditions.temperature': '#section_conditions_temperature',
+  'conditions.pressure': '#section_conditions_pressure',
+  'conditions.stirring': '#section_conditions_stirring',
+  'conditions.illumination': '#section_conditions_illumination',
+  'conditions.electrochemistry': '#section_conditions_electro',
+  'conditions.flow': '#section_conditions_flow',
+  'notes': '#section_notes',
+  'provenance': '#section_provenance',
+};
+
+// Repeated Reaction fields and the classes of their sections.
+const REPEATED_SECTIONS = {
+  'identifiers': '.reaction_identifier',
+  'observations': '.observation',
+  'workups': '.workup',
+  'outcomes': '.outcome',
+};
+
+const channel = {
+  socket: null,        // Open WebSocket, or null.
+  unavailable: false,  // Whether the server lacks the endpoint.
+  sent: new Map(),     // Maps paths to the base64 parts last sent.
+  reactionId: null,    // reaction_id of the last Reaction sent.
+  results: new Map(),  // Maps paths to their last outputs.
+  nextId: 0,           // ID of the next request.
+  pending: new Map(),  // Maps request IDs to resolve functions.
+};
+
+/**
+ * Opens the channel if necessary.
+ * @return {!Promise<?WebSocket>} The socket, or null if unavailable.
+ */
+function connect() {
+  if (channel.unavailable) {
+    return Promise.resolve(null);
+  }
+  if (channel.socket !== null) {
+    return Promise.resolve(channel.socket);
+  }
+  return new Promise(resolve => {
+    const scheme = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
+    const socket = new WebSocket(
+        scheme + window.location.host + '/dataset/proto/validate/socket');
+    socket.onopen = () => {
+      channel.socket = socket;
+      resolve(socket);
+    };
+    socket.onerror = () => {
+      if (channel.socket === null) {
+        channel.unavailable = true;
+        resolve(null);
+      }
+    };
+    socket.onclose = event => {
+      if (event.code === 1009) {
+        // The Reaction is too large for the channel; validate it by POST.
+        channel.unavailable = true;
+      }
+      // The server state is gone; the next request sends everything.
+      channel.socket = null;
+      channel.sent = new Map();
+      channel.results = new Map();
+      channel.pending.forEach(callback => callback(null));
+      channel.pending.clear();
+    };
+    socket.onmessage = event => {
+      const data = /** @type {string} */ (event.data);
+      const reply = /** @type {!Object} */ (JSON.parse(data));
+      const callback = channel.pending.get(reply['id']);
+      if (callback) {
+        channel.pending.delete(reply['id']);
+        callback(reply);
+      }
+    };
+  });
+}
+
+/**
+ * Splits a Reaction into its top-level submessages, keyed by field path.
+ * @param {!Reaction} reaction
+ * @return {!Map<string, string>} Base64 serialized submessages.
+ */
+function splitReaction(reaction) {
+  const parts = new Map();
+  const add = (path, message) => {
+    if (message) {
+      parts.set(path, base64.encodeByteArray(message.serializeBinary()));
+    }
+  };
+  reaction.getIdentifiersList().forEach(
+      (message, index) => add('identifiers[' + index + ']', message));
+  reaction.getInputsMap().forEach(
+      (message, key) => add('inputs["' + key + '"]', message));
+  add('setup', reaction.getSetup());
+  add('conditions', reaction.getConditions());
+  add('notes', reaction.getNotes());
+  reaction.getObservationsList().forEach(
+      (message, index) => add('observations[' + index + ']', message));
+  reaction.getWorkupsList().forEach(
+      (message, index) => add('workups[' + index + ']', message));
+  reaction.getOutcomesList().forEach(
+      (message, index) => add('outcomes[' + index + ']', message));
+  add('provenance', reaction.getProvenance());
+  return parts;
+}
+
+/**
+ * Finds the form sections that display the outputs for each path.
+ * @param {!Reaction} reaction The Reaction unloaded from the form.
+ * @return {!Map<string, !jQuery>}
+ */
+function findSections(reaction) {
+  const sections = new Map();
+  sections.set('', $('#sections'));
+  for (const path in SECTIONS) {
+    sections.set(path, $(SECTIONS[path]));
+  }
+  $('#inputs > div.input').each((index, node) => {
+    node = $(node);
+    if (!utils.isTemplateOrUndoBuffer(node)) {
+      sections.set('inputs["' + $('.input_name', node).text() + '"]', node);
+    }
+  });
+  const lengths = {
+    'identifiers': reaction.getIdentifiersList().length,
+    'observations': reaction.getObservationsList().length,
+    'workups': reaction.getWorkupsList().length,
+    'outcomes': reaction.getOutcomesList().length,
+  };
+  for (const field in REPEATED_SECTIONS) {
+    const nodes = $(REPEATED_SECTIONS[field]).filter((index, node) => {
+      return !utils.isTemplateOrUndoBuffer($(node));
+    });
+    // Empty sections are not unloaded, so positions only correspond when
+    // there are none.
+    if (nodes.length === lengths[field]) {
+      nodes.each((index, node) => {
+        sections.set(field + '[' + index + ']', $(node));
+      });
+    }
+  }
+  return sections;
+}
+
+/**
+ * Validates a Reaction through the channel and shows the results.
+ * @param {!Reaction} reaction The Reaction unloaded from the form.
+ * @return {!Promise<?Array<!Element>>} The validate nodes that the channel
+ *     keeps up to date, or null if the channel is unavailable.
+ */
+async function validate(reaction) {
+  const socket = await connect();
+  if (socket === null) {
+    return null;
+  }
+  const parts = splitReaction(reaction);
+  const updates = {};
+  if (!channel.sent.size || reaction.getReactionId() !== channel.reactionId) {
+    updates[''] = base64.encodeByteArray(reaction.serializeBinary());
+  } else {
+    parts.forEach((data, path) => {
+      if (channel.sent.get(path) !== data) {
+        updates[path] = data;
+      }
+    });
+    channel.sent.forEach((data, path) => {
+      if (!parts.has(path)) {
+        updates[path] = null;
+      }
+    });
+  }
+  channel.sent = parts;
+  channel.reactionId = reaction.getReactionId();
+  const id = channel.nextId++;
+  const reply = /** @type {?Object} */ (await new Promise(resolve => {
+    channel.pending.set(id, resolve);
+    socket.send(JSON.stringify({'id': id, 'updates': updates}));
+  }));
+  if (reply === null || reply['error']) {
+    channel.sent = new Map();
+    channel.results = new Map();
+    return null;
+  }
+  const results = reply['results'];
+  for (const path in results) {
+    if (results[path] === null) {
+      channel.results.delete(path);
+    } else {
+      channel.results.set(path, results[path]);
+    }
+  }
+  // Sections are redrawn from all outputs, since they may have been re-created
+  // or gained client-side errors since the outputs last changed.
+  const validateNodes = [];
+  findSections(reaction).forEach((node, path) => {
+    const validateNode =
+        path ? $('.validate', node).first() : $('#reaction_validate');
+    validateNode.each((index, element) => {
+      validateNodes.push(element);
+    });
+    const result = channel.results.get(path);
+    if (result) {
+      utils.showValidation(
+          result['errors'], result['warnings'], node, validateNode);
+    }
+  });
+  return validateNodes;
+}
@@ -0,0 +1,310 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Admission control for expensive endpoints.
+
+Each endpoint in ENDPOINT_CLASSES belongs to a class with a Limit:
+
+    rate, burst: a token bucket per client and class; a client may make burst
+        requests at once and rate requests per second after that.
+    concurrency: requests of the class a client may have in flight, or None
+        for no limit.
+
+In addition, a client may have at most USER_CONCURRENCY requests of classes with
+a concurrency limit in flight, and the process at most CONCURRENCY requests of
+any class. Requests over a client's limits get 429 and requests over the process
+limit get 503, both with Retry-After, before the database is touched.
+Rejections are counted in editor_admission_rejections.
+
+Clients are identified by their access token cookie, or by address if they have
+none. Endpoints in UNAUTHENTICATED_CLASSES never check the cookie, so their
+clients are always identified by address. The editor runs behind a load
+balancer, so the address is taken from the X-Forwarded-For entry added by the
+last of PROXY_HOPS proxies (see init_app()). Limits apply per server process, so
+a gunicorn deployment admits up to its worker count times as much. The ASGI
+mode (async_serve.py) applies the same limits to the endpoints it serves.
+
+Limits are configured through the environment: ORD_EDITOR_ADMISSION_<CLASS>
+(e.g. ORD_EDITOR_ADMISSION_ENUMERATE=0.1,2,1) overrides "rate,burst,concurrency"
+for a class, ORD_EDITOR_ADMISSION_CONCURRENCY and
+ORD_EDITOR_ADMISSION_USER_CONCURRENCY the totals, and ORD_EDITOR_ADMISSION=0
+disables admission control. ORD_EDITOR_PROXY_HOPS sets PROXY_HOPS, or 0 to
+use the peer address when nothing proxies the editor.
+"""
+
+import collections
+import math
+import os
+import threading
+import time
+
+import flask
+import werkzeug.middleware.proxy_fix
+
+import metrics
+
+Limit = collections.namedtuple('Limit', ['rate', 'burst', 'concurrency'])
+
+# Default limits by endpoint class.
+DEFAULT_LIMITS = {
+    'enumerate': Limit(rate=0.2, burst=5, concurrency=1),
+    'upload': Limit(rate=5, burst=30, concurrency=2),
+    'validate': Limit(rate=20, burst=100, concurrency=8),
+    'render': Limit(rate=50, burst=200, concurrency=8),
+    'resolve': Limit(rate=2, burst=20, concurrency=4),
+}
+
+# Maps Flask endpoints to their classes; other endpoints are not limited.
+ENDPOINT_CLASSES = {
+    'enumerate_dataset': 'enumerate',
+    'preview_enumeration': 'enumerate',
+    'upload_dataset': 'upload',
+    'edit_reactions': 'upload',
+    'validate_reaction': 'validate',
+    'render_reaction': 'render',
+    'render_compound': 'render',
+    'get_molfile': 'render',
+    'canonicalize_smiles': 'render',
+    'resolve_input': 'resolve',
+    'resolve_compound': 'resolve',
+}
+
+# Classes whose endpoints do not authenticate the user; see serve.init_user().
+UNAUTHENTICATED_CLASSES = frozenset(['validate', 'render', 'resolve'])
+
+ENABLED = os.getenv('ORD_EDITOR_ADMISSION', '1') == '1'
+CONCURRENCY = int(os.getenv('ORD_EDITOR_ADMISSION_CONCURRENCY', '32'))
+USER_CONCURRENCY = int(os.getenv('ORD_EDITOR_ADMISSION_USER_CONCURRENCY', '12'))
+# Idle clients are forgotten once this many are tracked.
+MAX_CLIENTS = 10000
+# Proxies in front of the editor whose X-Forwarded-For entries are trusted.
+PROXY_HOPS = int(os.getenv('ORD_EDITOR_PROXY_HOPS', '1'))
+
+
+def read_limits(environ=None):
+    """Returns DEFAULT_LIMITS updated from the environment.
+
+    An empty concurrency (e.g. "10,100,") means no concurrency limit.
+    """
+    environ = os.environ if environ is None else environ
+    limits = dict(DEFAULT_LIMITS)
+    for name in limits:
+        value = environ.get(f'ORD_EDITOR_ADMISSION_{name.upper()}')
+        if value:
+            rate, burst, concurrency = value.split(',')
+            limits[name] = Limit(float(rate), float(burst),
+                                 int(concurrency) if concurrency else None)
+    return limits
+
+
+class TokenBucket:
+    """Allows burst events at once and rate events per second thereafter."""
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        """Takes a token; returns 0, or the seconds until one is available."""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        if self.rate <= 0:
+            return math.inf
+        return (1 - self.tokens) / self.rate
+
+    def put(self):
+        """Returns a token taken by a request that was not admitted."""
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class Controller:  # pylint: disable=too-many-instance-attributes
+    """Tracks token buckets and in-flight requests for one process."""
+
+    def __init__(self,
+                 limits,
+                 concurrency,
+                 user_concurrency,
+                 clock=time.monotonic):
+        self.limits = limits
+        self.concurrency = concurrency
+        self.user_concurrency = user_concurrency
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._buckets = {}  # Maps (class, client) to TokenBucket.
+        self._active = collections.Counter()  # Maps (class, client) to count.
+        self._user_active = collections.Counter()  # Maps client to count.
+        self._total = 0
+
+    def admit(self, endpoint_class, client):
+        """Admits a request or says why not.
+
+        Args:
+            endpoint_class: String key of limits.
+            client: Hashable client identifier.
+
+        Returns:
+            None if the request is admitted, in which case release() must be
+            called when it finishes. Otherwise a (status, reason, retry after
+            seconds) tuple.
+        """
+        limit = self.limits[endpoint_class]
+        key = (endpoint_class, client)
+        with self._lock:
+            now = self.clock()
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= MAX_CLIENTS:
+                    self._forget_idle(now)
+                bucket = TokenBucket(limit.rate, limit.burst, now)
+                self._buckets[key] = bucket
+            wait = bucket.take(now)
+            if wait:
+                return 429, 'rate', wait
+            limited = limit.concurrency is not None
+            if limited and self._active[key] >= limit.concurrency:
+                bucket.put()
+                return 429, 'concurrency', 1
+            if limited and self._user_active[client] >= self.user_concurrency:
+                bucket.put()
+                return 429, 'user_concurrency', 1
+            if self._total >= self.concurrency:
+                bucket.put()
+                return 503, 'server_concurrency', 1
+            if limited:
+                self._active[key] += 1
+                self._user_active[client] += 1
+            self._total += 1
+        return None
+
+    def release(self, endpoint_class, client):
+        """Records the end of an admitted request."""
+        key = (endpoint_class, client)
+        with self._lock:
+            if self.limits[endpoint_class].concurrency is not None:
+                self._active[key] -= 1
+                if not self._active[key]:
+                    del self._active[key]
+                self._user_active[client] -= 1
+                if not self._user_active[client]:
+                    del self._user_active[client]
+            self._total -= 1
+
+    def _forget_idle(self, now):
+        for key, bucket in list(self._buckets.items()):
+            if key not in self._active and bucket.is_full(now):
+                del self._buckets[key]
+
+
+_controller = Controller(read_limits(), CONCURRENCY, USER_CONCURRENCY)
+
+
+def client_key(endpoint_class):
+    """Identifies the client of the current request."""
+    access_token = flask.request.cookies.get('Access-Token')
+    if access_token and endpoint_class not in UNAUTHENTICATED_CLASSES:
+        return access_token
+    return flask.request.remote_addr or ''
+
+
+def forwarded_address(forwarded_for, address):
+    """Returns a client address as ProxyFix would, for servers without it.
+
+    Args:
+        forwarded_for: X-Forwarded-For header value, or None.
+        address: String address of the peer.
+
+    Returns:
+        The entry added by the last of PROXY_HOPS proxies, or address if there
+        are fewer entries.
+    """
+    values = (forwarded_for or '').split(',')
+    if PROXY_HOPS and forwarded_for and len(values) >= PROXY_HOPS:
+        return values[-PROXY_HOPS].strip()
+    return address
+
+
+def admit(endpoint_class, client):
+    """Admits a request, for servers that do not use init_app().
+
+    Args:
+        endpoint_class: String key of DEFAULT_LIMITS.
+        client: Hashable client identifier.
+
+    Returns:
+        None if the request is admitted, in which case release() must be
+        called when it finishes. Otherwise a (status, message, Retry-After
+        header value) tuple for the rejection.
+    """
+    rejection = _controller.admit(endpoint_class, client)
+    if rejection is None:
+        return None
+    status, reason, retry_after = rejection
+    metrics.ADMISSION_REJECTIONS.labels(endpoint_class, reason).inc()
+    return (status,
+            f'too many {endpoint_class} requests ({reason}); try again later',
+            str(max(1, math.ceil(min(retry_after, 3600)))))
+
+
+def release(endpoint_class, client):
+    """Records the end of a request admitted by admit()."""
+    _controller.release(endpoint_class, client)
+
+
+def _admit():
+    endpoint_class = ENDPOINT_CLASSES.get(flask.request.endpoint)
+    if endpoint_class is None or not ENABLED:
+        return None
+    client = client_key(endpoint_class)
+    rejection = admit(endpoint_class, client)
+    if rejection is None:
+        flask.g.admission = (endpoint_class, client)
+        return None
+    status, message, retry_after = rejection
+    response = flask.make_response(message, status)
+    response.headers['Retry-After'] = retry_after
+    return response
+
+
+def _release(exception):
+    del exception  # Unused.
+    admission = flask.g.pop('admission', None)
+    if admission is not None:
+        release(*admission)
+
+
+def init_app(app):
+    """Registers admission hooks on a Flask app.
+
+    Call this before registering hooks that open database connections, so
+    rejected requests never open one. Also wraps the app in ProxyFix, so
+    request.remote_addr is the client's address rather than the load
+    balancer's; see PROXY_HOPS.
+    """
+    if PROXY_HOPS:
+        app.wsgi_app = werkzeug.middleware.proxy_fix.ProxyFix(app.wsgi_app,
+                                                              x_for=PROXY_HOPS)
+    app.before_request(_admit)
+    app.teardown_request(_release)
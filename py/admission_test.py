@@ -0,0 +1,183 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for editor.py.admission."""
+
+from unittest import mock
+
+from absl.testing import absltest
+import flask
+
+import admission  # pylint: disable=import-error
+
+
+class FakeClock:
+    """A clock that only moves when the test sets now."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ControllerTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock()
+        limits = {
+            'a': admission.Limit(rate=1, burst=2, concurrency=2),
+            'b': admission.Limit(rate=10, burst=10, concurrency=5),
+            'c': admission.Limit(rate=10, burst=10, concurrency=None),
+        }
+        self.controller = admission.Controller(limits,
+                                               concurrency=4,
+                                               user_concurrency=3,
+                                               clock=self.clock)
+
+    def test_rate(self):
+        self.assertIsNone(self.controller.admit('a', 'x'))
+        self.controller.release('a', 'x')
+        self.assertIsNone(self.controller.admit('a', 'x'))
+        self.controller.release('a', 'x')
+        self.assertEqual(self.controller.admit('a', 'x'), (429, 'rate', 1))
+        # Other clients have their own buckets.
+        self.assertIsNone(self.controller.admit('a', 'y'))
+        self.clock.now = 0.5
+        status, reason, wait = self.controller.admit('a', 'x')
+        self.assertEqual((status, reason), (429, 'rate'))
+        self.assertAlmostEqual(wait, 0.5)
+        self.clock.now = 1.0
+        self.assertIsNone(self.controller.admit('a', 'x'))
+
+    def test_concurrency(self):
+        self.assertIsNone(self.controller.admit('a', 'x'))
+        self.assertIsNone(self.controller.admit('a', 'x'))
+        self.clock.now = 10
+        self.assertEqual(self.controller.admit('a', 'x'),
+                         (429, 'concurrency', 1))
+        self.assertIsNone(self.controller.admit('b', 'x'))
+        self.assertEqual(self.controller.admit('b', 'x'),
+                         (429, 'user_concurrency', 1))
+        self.assertIsNone(self.controller.admit('b', 'y'))
+        self.assertEqual(self.controller.admit('b', 'z'),
+                         (503, 'server_concurrency', 1))
+        self.controller.release('a', 'x')
+        self.assertIsNone(self.controller.admit('b', 'z'))
+
+    def test_unlimited_concurrency(self):
+        for _ in range(4):
+            self.assertIsNone(self.controller.admit('c', 'x'))
+        # Only the process limit applies.
+        self.assertEqual(self.controller.admit('c', 'x'),
+                         (503, 'server_concurrency', 1))
+        self.controller.release('c', 'x')
+        # Requests without a concurrency limit do not count for the client.
+        self.assertIsNone(self.controller.admit('b', 'x'))
+
+    def test_rejection_keeps_token(self):
+        self.assertIsNone(self.controller.admit('a', 'x'))
+        self.assertIsNone(self.controller.admit('a', 'x'))
+        self.clock.now = 2
+        for _ in range(5):
+            self.assertEqual(self.controller.admit('a', 'x'),
+                             (429, 'concurrency', 1))
+        self.controller.release('a', 'x')
+        self.assertIsNone(self.controller.admit('a', 'x'))
+
+    def test_forget_idle(self):
+        with mock.patch.object(admission, 'MAX_CLIENTS', 2):
+            self.assertIsNone(self.controller.admit('a', 'x'))
+            self.controller.release('a', 'x')
+            self.assertIsNone(self.controller.admit('a', 'y'))
+            self.clock.now = 10
+            self.assertIsNone(self.controller.admit('a', 'z'))
+        self.assertCountEqual(
+            self.controller._buckets,  # pylint: disable=protected-access
+            [('a', 'y'), ('a', 'z')])
+
+    def test_read_limits(self):
+        limits = admission.read_limits(
+            {'ORD_EDITOR_ADMISSION_ENUMERATE': '0.5,1,1'})
+        self.assertEqual(limits['enumerate'], admission.Limit(0.5, 1, 1))
+        self.assertEqual(limits['render'], admission.DEFAULT_LIMITS['render'])
+        limits = admission.read_limits({'ORD_EDITOR_ADMISSION_UPLOAD': '1,2,'})
+        self.assertEqual(limits['upload'], admission.Limit(1, 2, None))
+
+
+class InitAppTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock()
+        controller = admission.Controller(
+            {'render': admission.Limit(rate=1, burst=1, concurrency=1)},
+            concurrency=10,
+            user_concurrency=10,
+            clock=self.clock)
+        self.enter_context(
+            mock.patch.object(admission, '_controller', controller))
+        self.enter_context(
+            mock.patch.object(admission, 'ENDPOINT_CLASSES',
+                              {'render_compound': 'render'}))
+        app = flask.Flask(__name__)
+        admission.init_app(app)
+        app.add_url_rule('/render', 'render_compound', lambda: 'ok')
+        app.add_url_rule('/other', 'other', lambda: 'ok')
+        self.client = app.test_client()
+
+    def test_reject(self):
+        self.assertEqual(self.client.get('/render').status_code, 200)
+        response = self.client.get('/render')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(self.client.get('/other').status_code, 200)
+        self.clock.now = 1
+        self.assertEqual(self.client.get('/render').status_code, 200)
+
+    def test_unauthenticated_by_address(self):
+        self.assertEqual(self.client.get('/render').status_code, 200)
+        self.client.set_cookie('localhost', 'Access-Token', 'random')
+        self.assertEqual(self.client.get('/render').status_code, 429)
+
+    def test_forwarded_for(self):
+        for address, status in [('10.0.0.1', 200), ('10.0.0.2', 200),
+                                ('10.0.0.2', 429), ('10.0.0.3, 10.0.0.2', 429)]:
+            response = self.client.get('/render',
+                                       headers={'X-Forwarded-For': address})
+            self.assertEqual(response.status_code, status, address)
+
+    def test_forwarded_address(self):
+        self.assertEqual(admission.forwarded_address(None, 'peer'), 'peer')
+        self.assertEqual(
+            admission.forwarded_address('spoofed, 10.0.0.1', 'peer'),
+            '10.0.0.1')
+        with mock.patch.object(admission, 'PROXY_HOPS', 2):
+            self.assertEqual(
+                admission.forwarded_address('10.0.0.1, 10.0.0.2', 'peer'),
+                '10.0.0.1')
+            self.assertEqual(admission.forwarded_address('10.0.0.1', 'peer'),
+                             'peer')
+        with mock.patch.object(admission, 'PROXY_HOPS', 0):
+            self.assertEqual(admission.forwarded_address('10.0.0.1', 'peer'),
+                             'peer')
+
+    def test_disabled(self):
+        with mock.patch.object(admission, 'ENABLED', False):
+            for _ in range(3):
+                self.assertEqual(self.client.get('/render').status_code, 200)
+
+
+if __name__ == '__main__':
+    absltest.main()
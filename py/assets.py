@@ -0,0 +1,195 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Static asset serving for the editor.
+
+Each directory of assets is indexed once per process. Every file is hashed, and
+compressible files get gzip (and brotli, if installed) variants that are kept
+in memory. Uncompressed bodies are streamed from disk through the WSGI file
+wrapper, which lets gunicorn use sendfile(). URLs built with url() carry the
+content hash, so browsers may cache them indefinitely.
+"""
+
+import collections
+import gzip
+import hashlib
+import io
+import mimetypes
+import os
+
+import flask
+import werkzeug.security
+import werkzeug.wsgi
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Files larger than this are never precompressed.
+MAX_COMPRESS_SIZE = 32 * 1024 * 1024
+# Mimetype prefixes that are worth compressing.
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json',
+                'application/xml', 'image/svg+xml')
+# Cache-Control for URLs that name a specific content hash.
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Cache-Control for all other URLs; clients revalidate with the ETag.
+REVALIDATE = 'public, no-cache'
+
+Asset = collections.namedtuple(
+    'Asset', ['path', 'mtime', 'size', 'mimetype', 'digest', 'encodings'])
+
+
+def load_asset(path):
+    """Reads, hashes, and precompresses a single file.
+
+    Args:
+        path: Filesystem path of the asset.
+
+    Returns:
+        Asset tuple. The encodings field maps Content-Encoding names to
+        compressed bodies.
+    """
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    digest = hashlib.sha256(data).hexdigest()[:20]
+    encodings = {}
+    if len(data) <= MAX_COMPRESS_SIZE and mimetype.startswith(COMPRESSIBLE):
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=9,
+                           mtime=0) as f:
+            f.write(data)
+        encodings['gzip'] = buffer.getvalue()
+        if brotli is not None:
+            encodings['br'] = brotli.compress(data)
+        encodings = {
+            name: body
+            for name, body in encodings.items()
+            if len(body) < len(data)
+        }
+    return Asset(path=path,
+                 mtime=stat.st_mtime,
+                 size=stat.st_size,
+                 mimetype=mimetype,
+                 digest=digest,
+                 encodings=encodings)
+
+
+class AssetTable:
+    """The files under one directory, keyed by path relative to it."""
+
+    def __init__(self, root, check_mtime=False):
+        """Indexes every file under root.
+
+        Args:
+            root: Directory to serve. It need not exist yet.
+            check_mtime: If True, stat files on every lookup and reload any
+                that changed. Intended for development.
+        """
+        self.root = os.path.abspath(root)
+        self.check_mtime = check_mtime
+        self._assets = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, self.root)
+                self._assets[name] = load_asset(path)
+
+    def get(self, name):
+        """Returns the Asset for a relative path, or None if there is none."""
+        asset = self._assets.get(name)
+        if asset is not None and not self.check_mtime:
+            return asset
+        # Files that appear after startup (e.g. from "make") are picked up too.
+        path = werkzeug.security.safe_join(self.root, name)
+        if path is None:
+            return None
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        if asset is None or asset.mtime != mtime:
+            if not os.path.isfile(path):
+                return None
+            asset = load_asset(path)
+            self._assets[name] = asset
+        return asset
+
+
+def url(table, prefix, name):
+    """Returns a cache-busting URL for an asset.
+
+    Args:
+        table: AssetTable containing the asset.
+        prefix: URL path prefix for the table, e.g. "/css".
+        name: Asset path relative to the table root.
+
+    Returns:
+        The URL, with the content hash in the query string when known.
+    """
+    asset = table.get(name)
+    if asset is None:
+        return f'{prefix}/{name}'
+    return f'{prefix}/{name}?v={asset.digest}'
+
+
+def send(table, name):
+    """Builds a response for an asset in the current request context.
+
+    Chooses the best precompressed encoding the client accepts, answers
+    conditional requests with 304, and marks hash-versioned URLs immutable.
+
+    Args:
+        table: AssetTable containing the asset.
+        name: Asset path relative to the table root.
+
+    Returns:
+        A flask.Response.
+    """
+    asset = table.get(name)
+    if asset is None:
+        flask.abort(404)
+    request = flask.request
+    encoding = None
+    for candidate in ('br', 'gzip'):
+        if (candidate in asset.encodings and
+                request.accept_encodings[candidate] > 0):
+            encoding = candidate
+            break
+    etag = asset.digest if encoding is None else f'{asset.digest}-{encoding}'
+    if request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+    elif encoding is None:
+        try:
+            # Closed by the response; see werkzeug.wsgi.FileWrapper.
+            handle = open(asset.path, 'rb')  # pylint: disable=consider-using-with
+        except OSError:
+            flask.abort(404)
+        body = werkzeug.wsgi.wrap_file(request.environ, handle)
+        response = flask.Response(body,
+                                  mimetype=asset.mimetype,
+                                  direct_passthrough=True)
+        response.content_length = asset.size
+    else:
+        response = flask.Response(asset.encodings[encoding],
+                                  mimetype=asset.mimetype)
+        response.content_encoding = encoding
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    if request.args.get('v') == asset.digest:
+        response.headers['Cache-Control'] = IMMUTABLE
+    else:
+        response.headers['Cache-Control'] = REVALIDATE
+    return response
@@ -0,0 +1,585 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""ASGI serving mode for the editor.
+
+The endpoints that mostly wait on other web services (name resolution, GitHub
+OAuth, and review imports) are handled here on an asyncio event loop with a
+pooled async HTTP client, so a slow resolver does not occupy a worker. Name
+resolution reuses ord_schema.resolvers with that client as its transport (see
+run_resolver()). Every other request is passed to the Flask app in serve.py.
+
+The reaction editor's incremental validation channel (a WebSocket at
+/dataset/proto/validate/socket; see validation_socket()) is only available in
+this mode.
+
+To serve in this mode:
+
+    $ gunicorn async_serve:app --pythonpath py \\
+        --worker-class uvicorn.workers.UvicornWorker --bind 0.0.0.0:5000
+"""
+
+import asyncio
+import base64
+import binascii
+import concurrent.futures
+import email.message
+import functools
+import http.cookies
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import urllib.response
+
+from asgiref.wsgi import WsgiToAsgi
+import flask
+import httpx
+
+from ord_schema import resolvers
+
+import admission
+import compression
+import compute
+import incremental_validation
+import metrics
+import reviews
+import serve
+import sessions
+
+logger = logging.getLogger(__name__)
+
+# Upstream services; tests point these at a local stub server.
+GITHUB_URL = 'https://github.com'
+GITHUB_API_URL = 'https://api.github.com'
+
+# Seconds allowed for each upstream request.
+TIMEOUT = float(os.getenv('ORD_EDITOR_UPSTREAM_TIMEOUT', '10'))
+# Maximum simultaneous upstream requests per worker.
+MAX_UPSTREAM = int(os.getenv('ORD_EDITOR_MAX_UPSTREAM', '20'))
+# Limits on each validation_socket() message: its size in bytes and the number
+# of updates it may carry.
+MAX_SOCKET_MESSAGE = int(
+    os.getenv('ORD_EDITOR_MAX_SOCKET_MESSAGE', str(8 << 20)))
+MAX_SOCKET_UPDATES = int(os.getenv('ORD_EDITOR_MAX_SOCKET_UPDATES', '1000'))
+
+# URL prefixes of the services that ord_schema.resolvers calls, mapped to
+# replacements; tests point them at a local stub server.
+RESOLVER_URLS = {}
+
+# The client and semaphore belong to the event loop that created them.
+_upstream = {}
+
+
+def _get_upstream():
+    """Returns (client, semaphore) for the running event loop."""
+    loop = asyncio.get_running_loop()
+    if _upstream.get('loop') is not loop:
+        _upstream.clear()
+        _upstream.update({
+            'loop':
+                loop,
+            'client':
+                httpx.AsyncClient(timeout=httpx.Timeout(TIMEOUT),
+                                  follow_redirects=True,
+                                  limits=httpx.Limits(
+                                      max_connections=MAX_UPSTREAM,
+                                      max_keepalive_connections=MAX_UPSTREAM)),
+            'semaphore':
+                asyncio.Semaphore(MAX_UPSTREAM),
+        })
+    return _upstream['client'], _upstream['semaphore']
+
+
+async def close_upstream():
+    """Closes the pooled client, e.g. at shutdown."""
+    client = _upstream.pop('client', None)
+    _upstream.clear()
+    if client is not None:
+        await client.aclose()
+
+
+async def fetch(method, url, **kwargs):
+    """Sends an upstream request within the concurrency limit.
+
+    Redirects are followed, as by requests; GitHub answers raw_url with a
+    redirect to raw.githubusercontent.com, for example.
+
+    Returns:
+        httpx.Response with a successful status.
+
+    Raises:
+        httpx.HTTPError: The request failed, timed out, or returned an error
+            status.
+    """
+    client, semaphore = _get_upstream()
+    async with semaphore:
+        response = await client.request(method, url, **kwargs)
+    response.raise_for_status()
+    return response
+
+
+class _UpstreamHandler(urllib.request.BaseHandler):
+    """Sends the urllib requests of ord_schema.resolvers with fetch().
+
+    Only requests from threads started by run_resolver() are handled; other
+    requests fall through to the standard urllib handlers.
+    """
+
+    def default_open(self, request):
+        """Returns the response to a resolver request, or None."""
+        loop = getattr(_resolver_thread, 'loop', None)
+        if loop is None:
+            return None
+        url = request.full_url
+        for prefix, replacement in RESOLVER_URLS.items():
+            if url.startswith(prefix):
+                url = replacement + url[len(prefix):]
+        future = asyncio.run_coroutine_threadsafe(
+            fetch(request.get_method(), url, content=request.data), loop)
+        try:
+            response = future.result()
+        except httpx.HTTPStatusError as error:
+            raise urllib.error.HTTPError(request.full_url,
+                                         error.response.status_code, str(error),
+                                         None, None) from error
+        except httpx.HTTPError as error:
+            # The resolvers move on to the next service only on HTTPError.
+            raise urllib.error.HTTPError(request.full_url, 504, repr(error),
+                                         None, None) from error
+        headers = email.message.Message()
+        for key, value in response.headers.items():
+            headers[key] = value
+        result = urllib.response.addinfourl(io.BytesIO(response.content),
+                                            headers, str(response.url),
+                                            response.status_code)
+        result.msg = response.reason_phrase  # Read by HTTPErrorProcessor.
+        return result
+
+
+urllib.request.install_opener(urllib.request.build_opener(_UpstreamHandler))
+
+# Threads that run ord_schema.resolvers; see run_resolver().
+_resolver_pool = concurrent.futures.ThreadPoolExecutor(MAX_UPSTREAM)
+_resolver_thread = threading.local()
+
+
+def _call_resolver(loop, function, *args):
+    _resolver_thread.loop = loop
+    try:
+        return function(*args)
+    finally:
+        _resolver_thread.loop = None
+
+
+async def run_resolver(function, *args):
+    """Runs an ord_schema.resolvers function in a thread.
+
+    The parsing and the order of the name resolvers are the library's; only
+    the transport differs. Its requests go through fetch() on the event loop,
+    with the pooled client, the concurrency limit, and TIMEOUT.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _resolver_pool, functools.partial(_call_resolver, loop, function,
+                                          *args))
+
+
+class Request:
+    """The parts of an ASGI HTTP request that handlers need."""
+
+    def __init__(self, scope, body):
+        self.method = scope.get('method', 'GET')
+        self.path = scope['path']
+        self.body = body
+        self.args = dict(
+            urllib.parse.parse_qsl(scope.get('query_string', b'').decode()))
+        self.headers = {
+            key.decode().lower(): value.decode()
+            for key, value in scope.get('headers', [])
+        }
+        cookies = http.cookies.SimpleCookie(self.headers.get('cookie', ''))
+        self.cookies = {key: morsel.value for key, morsel in cookies.items()}
+        peer = (scope.get('client') or ('',))[0]
+        self.client = admission.forwarded_address(
+            self.headers.get('x-forwarded-for'), peer)
+
+
+class Response:
+    """A complete HTTP response."""
+
+    def __init__(self, body=b'', status=200, content_type='text/html'):
+        if isinstance(body, str):
+            body = body.encode()
+        self.body = body
+        self.status = status
+        self.headers = [(b'content-type', content_type.encode())]
+
+    async def send(self, send):
+        """Sends the response with the ASGI send callable."""
+        headers = self.headers + [
+            (b'content-length', str(len(self.body)).encode()),
+            (b'cache-control', b'public, max-age=0'),
+        ]
+        await send({
+            'type': 'http.response.start',
+            'status': self.status,
+            'headers': headers,
+        })
+        await send({'type': 'http.response.body', 'body': self.body})
+
+
+def redirect(location, access_token=None):
+    """Returns a 302 response, optionally setting the access token cookie."""
+    response = Response(status=302)
+    response.headers.append((b'location', location.encode()))
+    if access_token is not None:
+        response.headers.append(
+            (b'set-cookie', f'Access-Token={access_token}; '
+             f'Max-Age={sessions.LOGIN_TTL}; Path=/'.encode()))
+    return response
+
+
+def _call_with_db(function, *args):
+    with serve.app.app_context():
+        flask.g.db = serve.connect()
+        try:
+            return function(*args)
+        finally:
+            flask.g.db.close()
+
+
+async def run_with_db(function, *args):
+    """Runs a serve.py helper that uses flask.g.db in a worker thread."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, functools.partial(_call_with_db, function, *args))
+
+
+async def resolve_input(request):
+    """Resolve an input string to a ReactionInput message."""
+    try:
+        reaction_input = await run_resolver(resolvers.resolve_input,
+                                            request.body.decode())
+    except (ValueError, KeyError) as error:
+        return Response(str(error), status=409)
+    return Response(reaction_input.SerializeToString(deterministic=True),
+                    content_type='application/protobuf')
+
+
+async def resolve_compound(request, identifier_type):
+    """Resolve a compound name to a SMILES string."""
+    if not request.body:
+        return Response()
+    try:
+        smiles, resolver = await run_resolver(resolvers.name_resolve,
+                                              identifier_type,
+                                              request.body.decode())
+    except ValueError:
+        return Response()
+    # pylint: disable-next=protected-access
+    body = json.dumps([serve._canonicalize_smiles(smiles), resolver])
+    return Response(body, content_type='application/json')
+
+
+async def sync_reviews(request):
+    """Import all current pull requests into the datasets table.
+
+    Pull requests, their files, and the file contents (in the pull request and
+    on its base branch) are all fetched concurrently.
+    """
+    session = None
+    access_token = request.cookies.get('Access-Token')
+    if access_token is not None:
+        session = await run_with_db(serve.get_session, access_token)
+    if session is None or session[0] != serve.REVIEWER:
+        return redirect('/')
+    headers = {'Accept': 'application/vnd.github.v3+json'}
+
+    async def get_pages(url):
+        items = []
+        page = 1
+        while True:
+            response = await fetch('GET',
+                                   url,
+                                   headers=headers,
+                                   params={
+                                       'per_page': 100,
+                                       'page': page
+                                   })
+            batch = response.json()
+            items.extend(batch)
+            if len(batch) < 100:
+                return items
+            page += 1
+
+    async def get_reviews(pr):
+        files = await get_pages(
+            f'{GITHUB_API_URL}/repos/{reviews.REVIEW_REPO}/pulls/'
+            f'{pr["number"]}/files')
+        files = [
+            remote for remote in files
+            if remote['filename'].endswith(('.pb', '.pbtxt'))
+        ]
+        responses = await asyncio.gather(
+            *(fetch('GET', remote['raw_url']) for remote in files))
+        bases = await asyncio.gather(*(get_base(pr, remote) for remote in files)
+                                    )
+        return [(pr['number'], pr['title'], remote['filename'],
+                 reviews.parse_file(remote['filename'], response.content), base)
+                for remote, response, base in zip(files, responses, bases)]
+
+    async def get_base(pr, remote):
+        if remote['status'] == 'added':
+            return None
+        try:
+            response = await fetch(
+                'GET', reviews.base_url(pr['base']['ref'], remote['filename']))
+        except httpx.HTTPStatusError:
+            return None
+        return reviews.parse_file(remote['filename'], response.content)
+
+    pulls = await get_pages(
+        f'{GITHUB_API_URL}/repos/{reviews.REVIEW_REPO}/pulls')
+    submissions = []
+    for batch in await asyncio.gather(*map(get_reviews, pulls)):
+        submissions.extend(batch)
+    await run_with_db(serve.store_reviews, submissions)
+    return redirect('/review')
+
+
+async def github_callback(request):
+    """Grant an access token via GitHub OAuth; see serve.github_callback."""
+    response = await fetch('POST',
+                           f'{GITHUB_URL}/login/oauth/access_token',
+                           data={
+                               'client_id': serve.GH_CLIENT_ID,
+                               'client_secret': serve.GH_CLIENT_SECRET,
+                               'code': request.args.get('code'),
+                           },
+                           headers={'Accept': 'application/json'})
+    github_token = response.json().get('access_token')
+    if github_token is None:
+        return redirect('/login')
+    response = await fetch('GET',
+                           f'{GITHUB_API_URL}/user',
+                           headers={
+                               'Accept': 'application/json',
+                               'Authorization': f'token {github_token}',
+                           })
+    try:
+        user_id = await run_with_db(serve.login_github_user,
+                                    response.json()['login'],
+                                    request.cookies.get('Access-Token'))
+    except ValueError as error:
+        return Response(str(error), status=409)
+    access_token = await run_with_db(serve.create_login, user_id)
+    return redirect('/', access_token=access_token)
+
+
+def _validate_updates(session, updates):
+    session.update(updates)
+    with metrics.VALIDATION_SECONDS.time():
+        results = session.validate(
+            functools.partial(compute.run, compute.check_messages))
+    metrics.VALIDATION_MESSAGES.observe(session.num_checked)
+    return results
+
+
+async def _admit_validation(session, updates, client):
+    """Runs _validate_updates() as a 'validate' request; see admission.py.
+
+    Returns:
+        Dict with the "results", or an "error" if the request is rejected.
+    """
+    if admission.ENABLED:
+        rejection = admission.admit('validate', client)
+        if rejection is not None:
+            return {'error': rejection[1]}
+    try:
+        results = await asyncio.get_running_loop().run_in_executor(
+            None, _validate_updates, session, updates)
+    finally:
+        if admission.ENABLED:
+            admission.release('validate', client)
+    return {'results': results}
+
+
+async def validation_socket(scope, receive, send):
+    """Validates a Reaction incrementally as the editor changes it.
+
+    The client sends JSON text messages like
+
+        {"id": 3, "updates": {"setup": "<base64>", "workups[1]": null}}
+
+    where the updates are path-keyed serialized submessages as described in
+    incremental_validation.py; the first message should set the whole
+    Reaction with the path "". Each message gets a reply with the same ID and
+    the outputs that changed:
+
+        {"id": 3, "results": {"": {"errors": [...], "warnings": [...]},
+                              "workups[1]": null, ...}}
+
+    or {"id": 3, "error": "..."}. The connection owns the validation state,
+    so a reconnecting client must send the whole Reaction again.
+
+    Each message is admitted as a 'validate' request (see admission.py) and
+    may carry at most MAX_SOCKET_UPDATES updates. The connection is closed
+    with code 1009 after a message larger than MAX_SOCKET_MESSAGE bytes.
+    """
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    await send({'type': 'websocket.accept'})
+    session = incremental_validation.Session()
+    client = Request(scope, b'').client
+    while True:
+        message = await receive()
+        if message['type'] == 'websocket.disconnect':
+            return
+        text = message.get('text') or message.get('bytes') or ''
+        if len(text) > MAX_SOCKET_MESSAGE:
+            await send({'type': 'websocket.close', 'code': 1009})
+            return
+        reply = {'id': None}
+        try:
+            request = json.loads(text)
+            reply['id'] = request.get('id')
+            if len(request['updates']) > MAX_SOCKET_UPDATES:
+                raise ValueError(f'more than {MAX_SOCKET_UPDATES} updates')
+            updates = {
+                path: None if data is None else base64.b64decode(data)
+                for path, data in request['updates'].items()
+            }
+            reply.update(await _admit_validation(session, updates, client))
+        except (AttributeError, KeyError, TypeError, ValueError,
+                binascii.Error) as error:
+            reply['error'] = f'invalid request: {error}'
+        except compute.Busy:
+            metrics.COMPUTE_FAILURES.labels('validate', 'busy').inc()
+            reply['error'] = 'busy'
+        except concurrent.futures.TimeoutError:
+            metrics.COMPUTE_FAILURES.labels('validate', 'timeout').inc()
+            reply['error'] = 'timeout'
+        except compute.BrokenProcessPool:
+            metrics.COMPUTE_FAILURES.labels('validate', 'crash').inc()
+            reply['error'] = 'validate failed'
+        await send({'type': 'websocket.send', 'text': json.dumps(reply)})
+
+
+# (method, path pattern, handler) for the endpoints served on the event loop.
+ROUTES = [
+    ('POST', re.compile('/resolve/input'), resolve_input),
+    ('POST', re.compile('/resolve/(?P<identifier_type>[^/]+)'),
+     resolve_compound),
+    ('GET', re.compile('/review/sync'), sync_reviews),
+    ('GET', re.compile('/github-callback'), github_callback),
+]
+
+# (path pattern, handler) for WebSocket endpoints.
+WEBSOCKET_ROUTES = [
+    (re.compile('/dataset/proto/validate/socket'), validation_socket),
+]
+
+_wsgi = WsgiToAsgi(serve.app)
+
+
+async def _read_body(receive):
+    """Returns the request body, or None if it exceeds compression.MAX_SIZE."""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > compression.MAX_SIZE:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+async def _respond(handler, request, kwargs):
+    """Runs a route handler under admission control; see admission.py."""
+    endpoint_class = admission.ENDPOINT_CLASSES.get(handler.__name__)
+    if not admission.ENABLED:
+        endpoint_class = None
+    client = request.client
+    if endpoint_class not in admission.UNAUTHENTICATED_CLASSES:
+        client = request.cookies.get('Access-Token') or client
+    if endpoint_class is not None:
+        rejection = admission.admit(endpoint_class, client)
+        if rejection is not None:
+            status, message, retry_after = rejection
+            response = Response(message, status=status)
+            response.headers.append((b'retry-after', retry_after.encode()))
+            return response
+    try:
+        return await handler(request, **kwargs)
+    except httpx.HTTPError as error:
+        logger.warning('%s upstream error: %r', handler.__name__, error)
+        return Response('upstream service unavailable', status=502)
+    finally:
+        if endpoint_class is not None:
+            admission.release(endpoint_class, client)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_upstream()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """The ASGI application."""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] == 'websocket':
+        for pattern, handler in WEBSOCKET_ROUTES:
+            if pattern.fullmatch(scope['path']):
+                await handler(scope, receive, send)
+                return
+        await send({'type': 'websocket.close'})
+        return
+    if scope['type'] == 'http':
+        for method, pattern, handler in ROUTES:
+            match = pattern.fullmatch(scope['path'])
+            if match is None or scope['method'] != method:
+                continue
+            start = time.perf_counter()
+            body = await _read_body(receive)
+            if body is None:
+                response = Response(
+                    f'request body exceeds {compression.MAX_SIZE} bytes',
+                    status=413)
+            else:
+                response = await _respond(handler, Request(scope, body),
+                                          match.groupdict())
+            await response.send(send)
+            metrics.REQUEST_SECONDS.labels(
+                handler.__name__, method,
+                str(response.status)).observe(time.perf_counter() - start)
+            return
+    await _wsgi(scope, receive, send)
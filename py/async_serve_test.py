@@ -0,0 +1,477 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for editor.py.async_serve."""
+
+import asyncio
+import base64
+import http.server
+import json
+import threading
+import time
+import urllib.parse
+
+from absl.testing import absltest
+import httpx
+
+from google.protobuf import text_format
+from ord_schema.proto import dataset_pb2
+from ord_schema.proto import reaction_pb2
+
+import admission  # pylint: disable=import-error,wrong-import-order
+import async_serve  # pylint: disable=import-error,wrong-import-order
+import compression  # pylint: disable=import-error,wrong-import-order
+import reviews  # pylint: disable=import-error,wrong-import-order
+import serve  # pylint: disable=import-error,wrong-import-order
+
+# Seconds the stub waits before answering /slow/ requests.
+SLOW = 2.0
+# URL prefixes used by ord_schema.resolvers, by StubHandler service.
+RESOLVER_SERVICES = {
+    'https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound': 'pubchem',
+    'https://cactus.nci.nih.gov/chemical/structure': 'cactus',
+    'https://www.emolecules.com': 'emolecules',
+}
+
+
+def _encode(updates):
+    """Encodes validation socket updates as the editor does."""
+    return {
+        path: None if data is None else base64.b64encode(data).decode()
+        for path, data in updates.items()
+    }
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """Stands in for PubChem, CACTUS, and eMolecules.
+
+    Paths look like /<behavior>/<service>/...; the behavior is one of "ok",
+    "fail" (PubChem returns 404), or "slow".
+    """
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Responds as the behavior and service in the path direct."""
+        behavior, service = self.path.split('/')[1:3]
+        if behavior == 'slow':
+            time.sleep(SLOW)
+        if behavior == 'fail' and service == 'pubchem':
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = {
+            'pubchem': b'CCO\n',
+            'cactus': b'OCC\n',
+            'emolecules': b'__END__\n',
+        }[service]
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+def _dataset(name, num_reactions):
+    dataset = dataset_pb2.Dataset(name=name)
+    for index in range(num_reactions):
+        dataset.reactions.add(reaction_id=f'ord-{name}-{index}')
+    return dataset
+
+
+class GitHubStubHandler(http.server.BaseHTTPRequestHandler):
+    """Stands in for github.com, api.github.com, and raw.githubusercontent.com.
+
+    Paths start with /github, /api, or /raw respectively. As on github.com,
+    raw_url answers with a redirect to the raw contents.
+    """
+
+    # Pull request files, by path on the raw host; "main" is the base branch.
+    CONTENTS = {
+        f'{reviews.REVIEW_REPO}/head/data/new.pbtxt':
+            text_format.MessageToString(_dataset('new', 1)).encode(),
+        f'{reviews.REVIEW_REPO}/head/data/old.pb':
+            _dataset('old', 2).SerializeToString(),
+        f'{reviews.REVIEW_REPO}/main/data/old.pb':
+            _dataset('old', 1).SerializeToString(),
+    }
+
+    def _send(self, status, body=b'', headers=()):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serves the pull request listing, raw files, and the user."""
+        path = urllib.parse.urlparse(self.path).path
+        stub = f'http://localhost:{self.server.server_address[1]}'
+        pulls = f'/api/repos/{reviews.REVIEW_REPO}/pulls'
+        if path == pulls:
+            self._send(200, [{
+                'number': 1,
+                'title': 'Add data',
+                'base': {
+                    'ref': 'main'
+                }
+            }])
+        elif path == f'{pulls}/1/files':
+            raw = f'{stub}/github/{reviews.REVIEW_REPO}/raw/head'
+            self._send(200, [
+                {
+                    'filename': 'data/new.pbtxt',
+                    'status': 'added',
+                    'raw_url': f'{raw}/data/new.pbtxt'
+                },
+                {
+                    'filename': 'data/old.pb',
+                    'status': 'modified',
+                    'raw_url': f'{raw}/data/old.pb'
+                },
+                {
+                    'filename': 'README.md',
+                    'status': 'modified',
+                    'raw_url': f'{raw}/README.md'
+                },
+            ])
+        elif path.startswith('/github/'):
+            repo, _, rest = path[len('/github/'):].partition('/raw/')
+            self._send(302, headers=[('Location', f'/raw/{repo}/{rest}')])
+        elif path.startswith('/raw/') and path[5:] in self.CONTENTS:
+            self._send(200, self.CONTENTS[path[5:]])
+        elif (path == '/api/user' and
+              self.headers['Authorization'] == 'token github-token'):
+            self._send(200, {'login': 'octocat'})
+        else:
+            self._send(404)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Exchanges the OAuth code "good" for an access token."""
+        length = int(self.headers['Content-Length'])
+        form = urllib.parse.parse_qs(self.rfile.read(length).decode())
+        if self.path != '/github/login/oauth/access_token':
+            self._send(404)
+        elif form.get('code') == ['good']:
+            self._send(200, {'access_token': 'github-token'})
+        else:
+            self._send(200, {'error': 'bad_verification_code'})
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+async def _run_inline(function, *args):
+    """Stands in for async_serve.run_with_db() without a database."""
+    return function(*args)
+
+
+class AsyncServeTest(absltest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Starts the stub upstream server."""
+        super().setUpClass()
+        cls.server = http.server.ThreadingHTTPServer(('localhost', 0),
+                                                     StubHandler)
+        cls.stub = f'http://localhost:{cls.server.server_address[1]}'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.github_server = http.server.ThreadingHTTPServer(('localhost', 0),
+                                                            GitHubStubHandler)
+        cls.github_stub = (
+            f'http://localhost:{cls.github_server.server_address[1]}')
+        threading.Thread(target=cls.github_server.serve_forever,
+                         daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.github_server.shutdown()
+        super().tearDownClass()
+
+    def _use_stub(self, behavior, timeout=5.0):
+        self.enter_context(
+            absltest.mock.patch.dict(
+                async_serve.RESOLVER_URLS, {
+                    url: f'{self.stub}/{behavior}/{service}'
+                    for url, service in RESOLVER_SERVICES.items()
+                }))
+        self.enter_context(
+            absltest.mock.patch.object(async_serve, 'TIMEOUT', timeout))
+
+    def _run(self, *requests):
+        """Sends (method, path, body[, cookie]) requests concurrently.
+
+        Returns:
+            List of (response, seconds) tuples.
+        """
+
+        async def send(client, method, path, body, cookie=None):
+            start = time.perf_counter()
+            headers = {'Cookie': cookie} if cookie else None
+            response = await client.request(method,
+                                            path,
+                                            content=body,
+                                            headers=headers)
+            return response, time.perf_counter() - start
+
+        async def main():
+            transport = httpx.ASGITransport(app=async_serve.app)
+            async with httpx.AsyncClient(transport=transport,
+                                         base_url='http://editor') as client:
+                try:
+                    return await asyncio.gather(
+                        *(send(client, *request) for request in requests))
+                finally:
+                    await async_serve.close_upstream()
+
+        return asyncio.run(main())
+
+    def test_resolve_compound(self):
+        self._use_stub('ok')
+        [(response, _)] = self._run(('POST', '/resolve/name', b'ethanol'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), ['CCO', 'PubChem API'])
+
+    def test_resolve_compound_fallback(self):
+        self._use_stub('fail')
+        [(response, _)] = self._run(('POST', '/resolve/name', b'ethanol'))
+        self.assertEqual(response.json(),
+                         ['CCO', 'NCI/CADD Chemical Identifier Resolver'])
+
+    def test_resolve_compound_timeout(self):
+        self._use_stub('slow', timeout=0.2)
+        [(response, seconds)] = self._run(('POST', '/resolve/name', b'ethanol'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, '')
+        self.assertLess(seconds, SLOW)
+
+    def test_resolve_input(self):
+        self._use_stub('ok')
+        [(response, _)] = self._run(
+            ('POST', '/resolve/input', b'10 mL of 1.0 M ethanol in water'))
+        self.assertEqual(response.status_code, 200)
+        reaction_input = reaction_pb2.ReactionInput.FromString(response.content)
+        self.assertLen(reaction_input.components, 2)
+        for component in reaction_input.components:
+            self.assertEqual(component.identifiers[-1].details,
+                             'NAME resolved by the PubChem API')
+
+    def test_resolve_input_invalid(self):
+        self._use_stub('ok')
+        [(response, _)] = self._run(('POST', '/resolve/input', b'ethanol'))
+        self.assertEqual(response.status_code, 409)
+
+    def test_body_too_large(self):
+        self._use_stub('ok')
+        self.enter_context(
+            absltest.mock.patch.object(compression, 'MAX_SIZE', 10))
+        [(response, _)] = self._run(('POST', '/resolve/name', b'x' * 11))
+        self.assertEqual(response.status_code, 413)
+        [(response, _)] = self._run(('POST', '/resolve/name', b'ethanol'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_admission(self):
+        self._use_stub('ok')
+        controller = admission.Controller(
+            {'resolve': admission.Limit(rate=0, burst=1, concurrency=1)},
+            concurrency=10,
+            user_concurrency=10)
+        self.enter_context(
+            absltest.mock.patch.object(admission, '_controller', controller))
+        [(first, _)] = self._run(('POST', '/resolve/name', b'ethanol'))
+        self.assertEqual(first.status_code, 200)
+        # Resolution does not authenticate, so a new cookie does not help.
+        [(second, _)] = self._run(
+            ('POST', '/resolve/name', b'ethanol', 'Access-Token=other'))
+        self.assertEqual(second.status_code, 429)
+        self.assertIn('Retry-After', second.headers)
+
+    def test_slow_resolver_does_not_block(self):
+        self._use_stub('slow')
+        results = self._run(('POST', '/resolve/name', b'ethanol'),
+                            ('GET', '/css/reaction.css', b''))
+        (resolved, resolve_seconds), (sheet, sheet_seconds) = results
+        self.assertEqual(resolved.json(), ['CCO', 'PubChem API'])
+        self.assertEqual(sheet.status_code, 200)
+        self.assertGreaterEqual(resolve_seconds, SLOW)
+        self.assertLess(sheet_seconds, SLOW)
+
+    def _use_github_stub(self):
+        for module, attribute, path in [
+            (async_serve, 'GITHUB_URL', '/github'),
+            (async_serve, 'GITHUB_API_URL', '/api'),
+            (reviews, 'GITHUB_RAW_URL', '/raw'),
+        ]:
+            self.enter_context(
+                absltest.mock.patch.object(module, attribute,
+                                           f'{self.github_stub}{path}'))
+        self.enter_context(
+            absltest.mock.patch.object(async_serve, 'run_with_db', _run_inline))
+
+    def test_sync_reviews(self):
+        self._use_github_stub()
+        self.enter_context(
+            absltest.mock.patch.object(serve,
+                                       'get_session',
+                                       return_value=(serve.REVIEWER, None)))
+        store_reviews = self.enter_context(
+            absltest.mock.patch.object(serve, 'store_reviews'))
+        [(response, _)] = self._run(
+            ('GET', '/review/sync', b'', 'Access-Token=reviewer'))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.headers['Location'], '/review')
+        [submissions] = store_reviews.call_args.args
+        self.assertEqual(submissions, [
+            (1, 'Add data', 'data/new.pbtxt', _dataset('new', 1), None),
+            (1, 'Add data', 'data/old.pb', _dataset('old', 2), _dataset(
+                'old', 1)),
+        ])
+
+    def test_sync_reviews_requires_reviewer(self):
+        self._use_github_stub()
+        self.enter_context(
+            absltest.mock.patch.object(serve,
+                                       'get_session',
+                                       return_value=('guest', None)))
+        store_reviews = self.enter_context(
+            absltest.mock.patch.object(serve, 'store_reviews'))
+        [(response, _)] = self._run(
+            ('GET', '/review/sync', b'', 'Access-Token=guest'))
+        self.assertEqual(response.headers['Location'], '/')
+        store_reviews.assert_not_called()
+
+    def test_github_callback(self):
+        self._use_github_stub()
+        login = self.enter_context(
+            absltest.mock.patch.object(serve,
+                                       'login_github_user',
+                                       return_value='user'))
+        self.enter_context(
+            absltest.mock.patch.object(serve,
+                                       'create_login',
+                                       return_value='access-token'))
+        [(response, _)] = self._run(
+            ('GET', '/github-callback?code=good', b'', 'Access-Token=guest'))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.headers['Location'], '/')
+        self.assertIn('Access-Token=access-token',
+                      response.headers['Set-Cookie'])
+        login.assert_called_once_with('octocat', 'guest')
+
+    def test_github_callback_bad_code(self):
+        self._use_github_stub()
+        login = self.enter_context(
+            absltest.mock.patch.object(serve, 'login_github_user'))
+        [(response, _)] = self._run(('GET', '/github-callback?code=bad', b''))
+        self.assertEqual(response.headers['Location'], '/login')
+        login.assert_not_called()
+
+    def _socket(self, texts):
+        """Sends text messages over a validation socket.
+
+        Returns:
+            List of the messages the app sends back.
+        """
+        incoming = [{'type': 'websocket.connect'}]
+        for text in texts:
+            incoming.append({'type': 'websocket.receive', 'text': text})
+        incoming.append({'type': 'websocket.disconnect'})
+        outgoing = []
+
+        async def receive():
+            return incoming.pop(0)
+
+        async def send(message):
+            outgoing.append(message)
+
+        asyncio.run(
+            async_serve.app(
+                {
+                    'type': 'websocket',
+                    'path': '/dataset/proto/validate/socket',
+                    'client': ('127.0.0.1', 1234)
+                }, receive, send))
+        return outgoing
+
+    def test_validation_socket(self):
+        reaction = reaction_pb2.Reaction()
+        reaction.provenance.record_created.time.value = '2021-01-01'
+        setup = reaction_pb2.ReactionSetup()
+        setup.vessel.volume.value = -1
+        setup.vessel.volume.units = reaction_pb2.Volume.MILLILITER
+        updates = [
+            ('', reaction.SerializeToString()),
+            ('setup', setup.SerializeToString()),
+            ('setup', None),
+            ('no_such_field', b''),
+        ]
+        outgoing = self._socket([
+            json.dumps({
+                'id': index,
+                'updates': _encode({path: data})
+            }) for index, (path, data) in enumerate(updates, 1)
+        ])
+        self.assertEqual(outgoing[0]['type'], 'websocket.accept')
+        replies = [json.loads(message['text']) for message in outgoing[1:]]
+        self.assertEqual([reply['id'] for reply in replies], [1, 2, 3, 4])
+        self.assertIn('Reactions should have at least 1 reaction input',
+                      replies[0]['results']['']['errors'])
+        self.assertEqual(
+            replies[1]['results']['setup.vessel.volume'], {
+                'errors':
+                    ['Field value of message Volume must be non-negative'],
+                'warnings': [],
+            })
+        self.assertNotIn('provenance', replies[1]['results'])
+        self.assertIsNone(replies[2]['results']['setup'])
+        self.assertIn('invalid request', replies[3]['error'])
+
+    def test_validation_socket_limits(self):
+        self.enter_context(
+            absltest.mock.patch.object(async_serve, 'MAX_SOCKET_MESSAGE', 100))
+        self.enter_context(
+            absltest.mock.patch.object(async_serve, 'MAX_SOCKET_UPDATES', 1))
+        outgoing = self._socket([
+            json.dumps({
+                'id': 1,
+                'updates': {
+                    'setup': None,
+                    'workups[0]': None
+                }
+            }), 'x' * 101, 'not sent'
+        ])
+        self.assertIn('more than 1 updates',
+                      json.loads(outgoing[1]['text'])['error'])
+        self.assertEqual(outgoing[2], {'type': 'websocket.close', 'code': 1009})
+        self.assertLen(outgoing, 3)
+
+    def test_validation_socket_admission(self):
+        controller = admission.Controller(
+            {'validate': admission.Limit(rate=0, burst=1, concurrency=1)},
+            concurrency=10,
+            user_concurrency=10)
+        self.enter_context(
+            absltest.mock.patch.object(admission, '_controller', controller))
+        text = json.dumps({'id': 1, 'updates': {'': ''}})
+        outgoing = self._socket([text, text])
+        replies = [json.loads(message['text']) for message in outgoing[1:]]
+        self.assertIn('results', replies[0])
+        self.assertIn('too many validate requests', replies[1]['error'])
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Load test and latency benchmark for the hot editor endpoints.
+
+Datasets of each requested size are built by tiling reactions enumerated from
+the nielsen_fig1 template. Each scenario is driven by several worker processes
+at once. By default every worker hosts the Flask app in-process (like a
+gunicorn worker, without the HTTP layer) against the Postgres configured for
+serve.py; with --url the workers drive a running server instead.
+
+Results are compared against a stored baseline so regressions stand out:
+
+    $ export POSTGRES_PASSWORD=########
+    $ PYTHONPATH=py python py/benchmark.py --sizes=1,100 --save_baseline
+    ... change something ...
+    $ PYTHONPATH=py python py/benchmark.py --sizes=1,100
+
+The process exits with status 1 if any scenario regressed.
+"""
+
+import base64
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+from absl import app
+from absl import flags
+import pandas as pd
+import requests
+
+from ord_schema import templating
+from ord_schema.proto import dataset_pb2
+
+import serve  # pylint: disable=import-error
+
+FLAGS = flags.FLAGS
+flags.DEFINE_list('sizes', ['1', '100', '10000', '100000'],
+                  'Numbers of reactions per generated dataset.')
+flags.DEFINE_list('scenarios', None,
+                  'Scenarios to run; defaults to all of them.')
+flags.DEFINE_integer('workers', 2, 'Concurrent worker processes.')
+flags.DEFINE_integer('iterations', 20, 'Requests per scenario and size.')
+flags.DEFINE_string('url', None,
+                    'If set, drive the server at this URL over HTTP.')
+flags.DEFINE_string(
+    'baseline',
+    os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json'),
+    'JSON file of baseline results.')
+flags.DEFINE_boolean('save_baseline', False,
+                     'If True, overwrite the baseline with these results.')
+flags.DEFINE_float(
+    'tolerance', 0.2,
+    'Allowed fractional slowdown before reporting a regression.')
+flags.DEFINE_boolean(
+    'admission', False,
+    'If True, in-process workers are subject to admission control.')
+
+TESTDATA = os.path.join(os.path.dirname(__file__), 'testdata')
+
+# Request payloads, built before forking so workers share them.
+_payloads = {}
+
+
+class HttpClient:
+    """Mimics the Flask test client API over HTTP."""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+
+    def get(self, path, **kwargs):
+        return self.session.get(self.url + path,
+                                allow_redirects=False,
+                                **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.session.post(self.url + path,
+                                 allow_redirects=False,
+                                 **kwargs)
+
+
+def make_client(url):
+    """Returns a client logged in as the test user."""
+    if url:
+        client = HttpClient(url)
+    else:
+        client = serve.app.test_client()
+    client.get('/authenticate')
+    return client
+
+
+def make_dataset(size):
+    """Returns a Dataset of `size` reactions tiled from the nielsen template."""
+    with open(os.path.join(TESTDATA, 'nielsen_fig1_template.pbtxt'), 'rt') as f:
+        template = f.read()
+    dataframe = pd.read_csv(os.path.join(TESTDATA, 'nielsen_fig1.csv'))
+    enumerated = templating.generate_dataset(template,
+                                             dataframe,
+                                             validate=False)
+    dataset = dataset_pb2.Dataset(name=f'benchmark_{size}')
+    for i in range(size):
+        reaction = dataset.reactions.add()
+        reaction.CopyFrom(enumerated.reactions[i % len(enumerated.reactions)])
+        reaction.reaction_id = f'ord-benchmark-{i}'
+    return dataset
+
+
+def make_spreadsheet(size):
+    """Returns CSV bytes with `size` rows tiled from the nielsen spreadsheet."""
+    dataframe = pd.read_csv(os.path.join(TESTDATA, 'nielsen_fig1.csv'))
+    repeats = -(-size // len(dataframe))
+    tiled = pd.concat([dataframe] * repeats, ignore_index=True)[:size]
+    return tiled.to_csv(index=False).encode()
+
+
+def build_payloads(size):
+    """Fills _payloads with the request bodies for one dataset size."""
+    dataset = make_dataset(size)
+    with open(os.path.join(TESTDATA, 'nielsen_fig1_template.pbtxt'), 'rt') as f:
+        template = f.read()
+    _payloads.clear()
+    _payloads.update({
+        'size': size,
+        'name': f'benchmark_{size}',
+        'dataset': dataset.SerializeToString(deterministic=True),
+        'reaction': dataset.reactions[0].SerializeToString(),
+        'enumerate': {
+            'spreadsheet_name':
+                f'benchmark_{size}.csv',
+            'spreadsheet_data':
+                base64.b64encode(make_spreadsheet(size)).decode(),
+            'template_string':
+                template,
+        },
+    })
+
+
+def read_proto(client, worker):
+    del worker  # Unused.
+    return client.get(f'/dataset/proto/read/{_payloads["name"]}')
+
+
+def write_proto(client, worker):
+    return client.post(f'/dataset/proto/write/{_payloads["name"]}_{worker}',
+                       data=_payloads['dataset'])
+
+
+def read_reaction(client, worker):
+    del worker  # Unused.
+    return client.get(f'/dataset/proto/read/{_payloads["name"]}/reaction/0')
+
+
+def write_reaction(client, worker):
+    del worker  # Unused.
+    # Writes back the same first reaction, so the dataset does not change.
+    return client.post(f'/dataset/proto/write/{_payloads["name"]}/reaction/0',
+                       data=_payloads['reaction'])
+
+
+def show_dataset(client, worker):
+    del worker  # Unused.
+    return client.get(f'/dataset/{_payloads["name"]}')
+
+
+def validate(client, worker):
+    del worker  # Unused.
+    return client.post('/dataset/proto/validate/Reaction',
+                       data=_payloads['reaction'])
+
+
+def render(client, worker):
+    del worker  # Unused.
+    return client.post('/render/reaction', data=_payloads['reaction'])
+
+
+def enumerate_dataset(client, worker):
+    del worker  # Unused.
+    return client.post('/dataset/enumerate', json=_payloads['enumerate'])
+
+
+def _export(client, kind):
+    response = client.get(f'/dataset/{_payloads["name"]}/export/{kind}')
+    # Flask's test client streams lazily; read the body so it is timed.
+    getattr(response, 'data', None)
+    return response
+
+
+def export_csv(client, worker):
+    del worker  # Unused.
+    return _export(client, 'csv')
+
+
+def export_parquet(client, worker):
+    del worker  # Unused.
+    return _export(client, 'parquet')
+
+
+def upload(client, worker):
+    """Uploads the dataset under a name of its own for each worker."""
+    name = f'{_payloads["name"]}_upload_{worker}'
+    # The upload endpoint refuses to overwrite, so delete first (untimed).
+    client.get(f'/dataset/{name}/delete')
+    start = time.perf_counter()
+    response = client.post(f'/dataset/{name}/upload', data=_payloads['dataset'])
+    return response, time.perf_counter() - start
+
+
+SCENARIOS = {
+    'read': read_proto,
+    'write': write_proto,
+    'read_reaction': read_reaction,
+    'write_reaction': write_reaction,
+    'show_dataset': show_dataset,
+    'validate': validate,
+    'render': render,
+    'enumerate': enumerate_dataset,
+    'upload': upload,
+    'export_csv': export_csv,
+    'export_parquet': export_parquet,
+}
+
+
+def run_worker(args):
+    """Runs one worker's share of a scenario; executes in a child process.
+
+    Returns:
+        (latencies in seconds, number of failed requests, peak RSS in MB).
+    """
+    scenario, worker, iterations, url = args
+    function = SCENARIOS[scenario]
+    client = make_client(url)
+    latencies = []
+    failures = 0
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = function(client, worker)
+        if isinstance(result, tuple):
+            result, latency = result
+        else:
+            latency = time.perf_counter() - start
+        latencies.append(latency)
+        if result.status_code >= 400:
+            failures += 1
+    # ru_maxrss is in kilobytes on Linux.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return latencies, failures, peak_rss
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list."""
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_scenario(scenario, workers, iterations, url):
+    """Runs a scenario across worker processes and summarizes it."""
+    per_worker = max(1, iterations // workers)
+    # Warm up connections and caches before timing.
+    setup = make_client(url)
+    setup.post(f'/dataset/{_payloads["name"]}/upload',
+               data=_payloads['dataset'])
+    SCENARIOS[scenario](setup, 'warmup')
+    context = multiprocessing.get_context('fork')
+    start = time.perf_counter()
+    with context.Pool(workers) as pool:
+        results = pool.map(
+            run_worker,
+            [(scenario, worker, per_worker, url) for worker in range(workers)])
+    elapsed = time.perf_counter() - start
+    latencies = sorted(sum((result[0] for result in results), []))
+    return {
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'throughput': len(latencies) / elapsed,
+        'failures': sum(result[1] for result in results),
+        'peak_rss_mb': max(result[2] for result in results),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of regression messages relative to the baseline."""
+    regressions = []
+    for key, result in sorted(results.items()):
+        if key not in baseline:
+            continue
+        expected = baseline[key]
+        if result['p95'] > expected['p95'] * (1 + tolerance):
+            regressions.append(f'{key}: p95 {1e3 * result["p95"]:.1f}ms vs '
+                               f'{1e3 * expected["p95"]:.1f}ms')
+        if result['throughput'] < expected['throughput'] * (1 - tolerance):
+            regressions.append(f'{key}: throughput '
+                               f'{result["throughput"]:.1f}/s vs '
+                               f'{expected["throughput"]:.1f}/s')
+        if result['peak_rss_mb'] > expected['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f'{key}: peak RSS '
+                               f'{result["peak_rss_mb"]:.0f}MB vs '
+                               f'{expected["peak_rss_mb"]:.0f}MB')
+    return regressions
+
+
+def main(argv):
+    del argv  # Only used by app.run().
+    serve.admission.ENABLED = FLAGS.admission
+    scenarios = FLAGS.scenarios or list(SCENARIOS)
+    results = {}
+    print(f'{"scenario":<24} {"p50":>9} {"p95":>9} {"p99":>9} '
+          f'{"req/s":>8} {"fail":>5} {"RSS MB":>7}')
+    for size in map(int, FLAGS.sizes):
+        build_payloads(size)
+        for scenario in scenarios:
+            key = f'{scenario}/{size}'
+            result = run_scenario(scenario, FLAGS.workers, FLAGS.iterations,
+                                  FLAGS.url)
+            results[key] = result
+            print(f'{key:<24} {1e3 * result["p50"]:>7.1f}ms '
+                  f'{1e3 * result["p95"]:>7.1f}ms '
+                  f'{1e3 * result["p99"]:>7.1f}ms '
+                  f'{result["throughput"]:>8.1f} {result["failures"]:>5} '
+                  f'{result["peak_rss_mb"]:>7.0f}')
+    if FLAGS.save_baseline:
+        baseline = {}
+        if os.path.exists(FLAGS.baseline):
+            with open(FLAGS.baseline, 'rt') as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(FLAGS.baseline, 'wt') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        return
+    if not os.path.exists(FLAGS.baseline):
+        print(f'no baseline at {FLAGS.baseline}; rerun with --save_baseline')
+        return
+    with open(FLAGS.baseline, 'rt') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, FLAGS.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    app.run(main)
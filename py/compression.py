@@ -0,0 +1,149 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Content-Encoding for protobuf request and response bodies.
+
+Serialized datasets repeat compound names, units, and analysis blobs, and
+usually shrink several times under gzip. read_body() accepts request bodies
+with Content-Encoding gzip or deflate (zlib, as HTTP defines it), and
+send_bytes() compresses responses for clients that send Accept-Encoding.
+
+Request bodies are decompressed incrementally from the input stream, and
+decompression stops as soon as the output would exceed MAX_SIZE bytes, so a
+small body that inflates enormously (a "zip bomb") is refused with 413 after
+costing at most twice MAX_SIZE of memory (the chunks and their join). MAX_SIZE
+defaults to 64 MiB, well above the largest datasets the editor handles; raise
+it with ORD_EDITOR_MAX_DECOMPRESSED_SIZE if needed.
+"""
+
+import os
+import zlib
+
+import flask
+
+# Largest decompressed request body, in bytes.
+MAX_SIZE = int(os.getenv('ORD_EDITOR_MAX_DECOMPRESSED_SIZE', str(64 << 20)))
+# Responses smaller than this are not worth compressing.
+MIN_SIZE = 1024
+# zlib compression level for responses; 6 is zlib's default tradeoff.
+LEVEL = int(os.getenv('ORD_EDITOR_COMPRESSION_LEVEL', '6'))
+# Bytes read from the request stream at a time.
+CHUNK_SIZE = 64 * 1024
+
+# zlib wbits for each supported Content-Encoding.
+WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'x-gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+class TooLarge(ValueError):
+    """Raised when a body decompresses to more than the allowed size."""
+
+
+def decompress(stream, encoding, max_size=MAX_SIZE):
+    """Reads and decompresses a stream.
+
+    Args:
+        stream: File-like object with read().
+        encoding: Key of WBITS.
+        max_size: Largest allowed output, in bytes.
+
+    Returns:
+        The decompressed bytes.
+
+    Raises:
+        TooLarge: The output would exceed max_size.
+        ValueError: The input is not valid for the encoding.
+    """
+    decompressor = zlib.decompressobj(WBITS[encoding])
+    chunks = []
+    size = 0
+    try:
+        while not decompressor.eof:
+            data = decompressor.unconsumed_tail or stream.read(CHUNK_SIZE)
+            if not data:
+                raise ValueError(f'truncated {encoding} body')
+            # Asking for one byte more than allowed detects overflow without
+            # ever inflating much past the limit.
+            chunk = decompressor.decompress(data, max_size - size + 1)
+            size += len(chunk)
+            if size > max_size:
+                raise TooLarge(f'body decompresses to more than {max_size} '
+                               'bytes')
+            chunks.append(chunk)
+    except zlib.error as error:
+        raise ValueError(f'invalid {encoding} body: {error}') from error
+    return b''.join(chunks)
+
+
+def compress(data, encoding, level=LEVEL):
+    """Compresses bytes with an encoding in WBITS."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, WBITS[encoding])
+    return compressor.compress(data) + compressor.flush()
+
+
+def read_body(max_size=MAX_SIZE):  # pylint: disable=inconsistent-return-statements
+    """Returns the body of the current request, decoding Content-Encoding.
+
+    Aborts with 415 for unsupported encodings, 413 for bodies that decompress
+    past max_size, and 400 for corrupt bodies.
+    """
+    request = flask.request
+    encoding = (request.content_encoding or 'identity').strip().lower()
+    if encoding == 'identity':
+        return request.get_data()
+    if encoding not in WBITS:
+        flask.abort(
+            flask.make_response(f'unsupported Content-Encoding: {encoding}',
+                                415))
+    try:
+        return decompress(request.stream, encoding, max_size)
+    except TooLarge as error:
+        flask.abort(flask.make_response(str(error), 413))
+    except ValueError as error:
+        flask.abort(flask.make_response(str(error), 400))
+
+
+def choose_encoding(accept_encodings):
+    """Returns 'gzip', 'deflate', or None for a werkzeug Accept header."""
+    best, best_quality = None, 0
+    for encoding in ('gzip', 'deflate'):
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def send_bytes(data, mimetype):
+    """Builds a response, compressed if the client accepts it.
+
+    Args:
+        data: Response body.
+        mimetype: Content-Type of the uncompressed body.
+
+    Returns:
+        A flask.Response.
+    """
+    response = flask.Response(mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    encoding = None
+    if len(data) >= MIN_SIZE:
+        encoding = choose_encoding(flask.request.accept_encodings)
+    if encoding is None:
+        response.set_data(data)
+    else:
+        response.set_data(compress(data, encoding))
+        response.content_encoding = encoding
+    return response
@@ -0,0 +1,117 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for editor.py.compression."""
+
+import gzip
+import io
+import zlib
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import flask
+import werkzeug.exceptions
+
+import compression  # pylint: disable=import-error
+
+DATA = b'ord-0123456789abcdef ' * 1000
+
+app = flask.Flask(__name__)
+
+
+class CompressionTest(parameterized.TestCase, absltest.TestCase):
+
+    @parameterized.parameters('gzip', 'deflate')
+    def test_round_trip(self, encoding):
+        compressed = compression.compress(DATA, encoding)
+        self.assertLess(len(compressed), len(DATA) // 10)
+        self.assertEqual(
+            compression.decompress(io.BytesIO(compressed), encoding), DATA)
+
+    def test_compatible(self):
+        self.assertEqual(
+            compression.decompress(io.BytesIO(gzip.compress(DATA)), 'gzip'),
+            DATA)
+        self.assertEqual(gzip.decompress(compression.compress(DATA, 'gzip')),
+                         DATA)
+        self.assertEqual(zlib.decompress(compression.compress(DATA, 'deflate')),
+                         DATA)
+
+    def test_size_limit(self):
+        bomb = gzip.compress(bytes(100 * 1024 * 1024))
+        self.assertLess(len(bomb), 1024 * 1024)
+        with self.assertRaises(compression.TooLarge):
+            compression.decompress(io.BytesIO(bomb), 'gzip', max_size=1 << 20)
+        self.assertLen(
+            compression.decompress(io.BytesIO(gzip.compress(DATA)),
+                                   'gzip',
+                                   max_size=len(DATA)), len(DATA))
+
+    def test_invalid(self):
+        with self.assertRaisesRegex(ValueError, 'invalid'):
+            compression.decompress(io.BytesIO(b'not gzip'), 'gzip')
+        with self.assertRaisesRegex(ValueError, 'truncated'):
+            compression.decompress(io.BytesIO(gzip.compress(DATA)[:-20]),
+                                   'gzip')
+
+    @parameterized.parameters(
+        ('gzip, deflate, br', 'gzip'),
+        ('deflate', 'deflate'),
+        ('gzip;q=0.5, deflate', 'deflate'),
+        ('gzip;q=0', None),
+        ('br', None),
+        ('', None),
+    )
+    def test_choose_encoding(self, header, expected):
+        with app.test_request_context(headers={'Accept-Encoding': header}):
+            self.assertEqual(
+                compression.choose_encoding(flask.request.accept_encodings),
+                expected)
+
+    def test_read_body(self):
+        with app.test_request_context(method='POST', data=DATA):
+            self.assertEqual(compression.read_body(), DATA)
+        with app.test_request_context(method='POST',
+                                      data=gzip.compress(DATA),
+                                      headers={'Content-Encoding': 'gzip'}):
+            self.assertEqual(compression.read_body(), DATA)
+        with app.test_request_context(method='POST',
+                                      data=gzip.compress(DATA),
+                                      headers={'Content-Encoding': 'gzip'}):
+            with self.assertRaises(werkzeug.exceptions.HTTPException) as error:
+                compression.read_body(max_size=100)
+            self.assertEqual(error.exception.response.status_code, 413)
+        with app.test_request_context(method='POST',
+                                      data=DATA,
+                                      headers={'Content-Encoding': 'br'}):
+            with self.assertRaises(werkzeug.exceptions.HTTPException) as error:
+                compression.read_body()
+            self.assertEqual(error.exception.response.status_code, 415)
+
+    def test_send_bytes(self):
+        with app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+            response = compression.send_bytes(DATA, 'application/protobuf')
+            self.assertEqual(response.content_encoding, 'gzip')
+            self.assertEqual(gzip.decompress(response.get_data()), DATA)
+            response = compression.send_bytes(b'small', 'application/protobuf')
+            self.assertIsNone(response.content_encoding)
+            self.assertEqual(response.get_data(), b'small')
+        with app.test_request_context():
+            response = compression.send_bytes(DATA, 'application/protobuf')
+            self.assertIsNone(response.content_encoding)
+            self.assertEqual(response.get_data(), DATA)
+            self.assertIn('Accept-Encoding', response.headers['Vary'])
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,288 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Process pool for CPU-bound RDKit and validation work.
+
+Drawing, molfile generation, canonicalization, and validation hold the GIL for
+tens to hundreds of milliseconds, which stalls every other request in a
+gunicorn worker. serve.py hands them to run() instead, which executes them in
+a per-process pool of WORKERS processes:
+
+    * At most MAX_PENDING tasks may be queued or running at once; beyond that
+      run() raises Busy rather than letting requests pile up.
+    * run() waits at most TIMEOUT seconds for a result and then raises
+      concurrent.futures.TimeoutError. The task keeps its slot until it
+      finishes, so stuck tasks reduce capacity instead of multiplying.
+    * If a pool process dies (e.g. RDKit crashes on a bad structure), the
+      pool is replaced and run() raises BrokenProcessPool.
+
+submit() returns the Future instead of waiting, and Executor wraps it for code
+that takes a concurrent.futures.Executor, such as large exports (export.py),
+so that they share the pool and its MAX_PENDING bound.
+
+The task functions take and return plain bytes and strings so that they are
+cheap to send between processes. Setting ORD_EDITOR_COMPUTE_WORKERS=0 runs
+tasks in the calling thread.
+
+Identical reactions are common (enumerated datasets, clones, review imports),
+so run_cached() keeps the results of deterministic tasks in a per-process LRU
+cache keyed by a content hash of their input, and each distinct input is
+rendered or validated once.
+"""
+
+import collections
+import concurrent.futures
+import concurrent.futures.process
+import os
+import threading
+
+from ord_schema import message_helpers
+from ord_schema import resolvers
+from ord_schema import validations
+from ord_schema.proto import reaction_pb2
+
+import dataset_diff
+import lazy_import
+import metrics
+
+generate_text = lazy_import.Module('ord_schema.visualization.generate_text')
+drawing = lazy_import.Module('ord_schema.visualization.drawing')
+
+# Pool processes per server process. Each gunicorn worker has its own pool, so
+# the default splits the cores between the two workers in the Dockerfile.
+WORKERS = int(
+    os.getenv('ORD_EDITOR_COMPUTE_WORKERS',
+              str(max(1, (os.cpu_count() or 2) // 2))))
+# Tasks that may be queued or running at once per server process.
+MAX_PENDING = int(os.getenv('ORD_EDITOR_COMPUTE_PENDING', str(4 * WORKERS)))
+# Seconds run() waits for a task.
+TIMEOUT = float(os.getenv('ORD_EDITOR_COMPUTE_TIMEOUT', '30'))
+# Results kept by run_cached() per server process; zero disables the cache.
+CACHE_SIZE = int(os.getenv('ORD_EDITOR_COMPUTE_CACHE_SIZE', '1024'))
+
+BrokenProcessPool = concurrent.futures.process.BrokenProcessPool
+
+_executor = None  # pylint: disable=invalid-name
+_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(max(1, MAX_PENDING))
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class Busy(Exception):
+    """Raised when MAX_PENDING tasks are already queued or running."""
+
+
+def get_executor():
+    """Returns this process's compute pool, or None to run inline."""
+    global _executor  # pylint: disable=global-statement
+    if WORKERS <= 0:
+        return None
+    with _lock:
+        if _executor is None:
+            _executor = concurrent.futures.ProcessPoolExecutor(WORKERS)
+        return _executor
+
+
+def _discard(executor):
+    """Drops a broken pool so that the next task starts a new one."""
+    global _executor  # pylint: disable=global-statement
+    with _lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+
+def _run_inline(function, *args):
+    """Returns a finished Future for function(*args) run in this thread."""
+    future = concurrent.futures.Future()
+    try:
+        future.set_result(function(*args))
+    except Exception as error:  # pylint: disable=broad-except
+        future.set_exception(error)
+    return future
+
+
+def submit(function, *args):
+    """Starts function(*args) in the pool and returns its Future.
+
+    The task counts against MAX_PENDING until it finishes. Without a pool it
+    runs in the calling thread before submit() returns.
+
+    Args:
+        function: Module-level function.
+        *args: Picklable arguments.
+
+    Raises:
+        Busy: Too many tasks are pending.
+        BrokenProcessPool: A pool process died.
+    """
+    executor = get_executor()
+    if executor is None:
+        return _run_inline(function, *args)
+    # Released when the task finishes; see below.
+    # pylint: disable-next=consider-using-with
+    if not _pending.acquire(blocking=False):
+        raise Busy(f'{MAX_PENDING} compute tasks are pending')
+    try:
+        future = executor.submit(function, *args)
+    except BaseException as error:
+        _pending.release()
+        if isinstance(error, BrokenProcessPool):
+            _discard(executor)
+        raise
+    future.add_done_callback(lambda _: _pending.release())
+    return future
+
+
+def run(function, *args, timeout=None):
+    """Runs function(*args) in the pool and returns its result.
+
+    Args:
+        function: Module-level function of this module.
+        *args: Picklable arguments.
+        timeout: Seconds to wait; defaults to TIMEOUT.
+
+    Raises:
+        Busy: Too many tasks are pending.
+        concurrent.futures.TimeoutError: The task did not finish in time.
+        BrokenProcessPool: A pool process died.
+    """
+    if get_executor() is None:
+        return function(*args)
+    future = submit(function, *args)
+    try:
+        return future.result(timeout=TIMEOUT if timeout is None else timeout)
+    except BrokenProcessPool:
+        _discard(get_executor())
+        raise
+
+
+class Executor(concurrent.futures.Executor):
+    """The pool as a concurrent.futures.Executor, e.g. for export.flatten().
+
+    Tasks count against MAX_PENDING like those of run(). When too many are
+    pending, submit() runs the task in the calling thread instead of raising
+    Busy, so that a caller with several tasks in flight slows down rather than
+    fails part way.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # Read by export.flatten() to size its window, as for the pools.
+        self._max_workers = max(1, WORKERS)
+
+    def submit(self, fn, *args, **kwargs):  # pylint: disable=arguments-differ
+        if kwargs:
+            raise TypeError('compute tasks take positional arguments only')
+        try:
+            return submit(fn, *args)
+        except Busy:
+            return _run_inline(fn, *args)
+
+
+def run_cached(function, *args):
+    """Like run(function, *args), reusing earlier results for the same args.
+
+    Results are keyed by the function and its args, with bytes args replaced
+    by their content hash (see dataset_diff.content_hash), so function must
+    be deterministic. Errors are not cached.
+    """
+    key = (function.__name__,) + tuple(
+        dataset_diff.content_hash(arg) if isinstance(arg, bytes) else arg
+        for arg in args)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            metrics.COMPUTE_CACHE.labels(function.__name__, 'hit').inc()
+            return _cache[key]
+    metrics.COMPUTE_CACHE.labels(function.__name__, 'miss').inc()
+    result = run(function, *args)
+    if CACHE_SIZE > 0:
+        with _cache_lock:
+            _cache[key] = result
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+    return result
+
+
+def validate(message_name, data):
+    """Returns (errors, warnings) for a serialized message."""
+    message = message_helpers.create_message(message_name)
+    message.ParseFromString(data)
+    options = validations.ValidationOptions(require_provenance=True)
+    output = validations.validate_message(message,
+                                          raise_on_error=False,
+                                          options=options)
+    return output.errors, output.warnings
+
+
+def check_messages(items):
+    """Runs the own checks of messages, without recursing into submessages.
+
+    Args:
+        items: List of (message name, serialized message, trace) tuples, where
+            the name is relative to reaction_pb2 (e.g. "Reaction.Provenance")
+            and the trace is the location used in error messages.
+
+    Returns:
+        List of (errors, warnings) tuples.
+    """
+    options = validations.ValidationOptions(require_provenance=True)
+    outputs = []
+    for message_name, data, trace in items:
+        message = message_helpers.create_message(message_name)
+        message.ParseFromString(data)
+        output = validations.validate_message(message,
+                                              recurse=False,
+                                              raise_on_error=False,
+                                              options=options,
+                                              trace=tuple(trace))
+        outputs.append((output.errors, output.warnings))
+    return outputs
+
+
+def render_reaction(data):
+    """Returns an HTML summary of a serialized Reaction, or None."""
+    reaction = reaction_pb2.Reaction.FromString(data)
+    try:
+        return generate_text.generate_html(reaction)
+    except (ValueError, KeyError):
+        return None
+
+
+def render_compound(data):
+    """Returns an HTML-tagged SVG of a serialized Compound, or None."""
+    compound = reaction_pb2.Compound.FromString(data)
+    try:
+        mol = message_helpers.mol_from_compound(compound)
+        return drawing.mol_to_svg(mol)
+    except ValueError:
+        return None
+
+
+def molfile(data):
+    """Returns a MolFile block for a serialized Compound, or None."""
+    compound = reaction_pb2.Compound.FromString(data)
+    try:
+        return message_helpers.molblock_from_compound(compound)
+    except ValueError:
+        return None
+
+
+def canonicalize_smiles(smiles):
+    """Canonicalizes a SMILES string, or returns it unchanged on failure."""
+    try:
+        return resolvers.canonicalize_smiles(smiles)
+    except ValueError:
+        return smiles
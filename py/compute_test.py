@@ -0,0 +1,113 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for editor.py.compute."""
+
+import collections
+import concurrent.futures
+import threading
+import time
+from unittest import mock
+
+from absl.testing import absltest
+
+from ord_schema import message_helpers
+from ord_schema.proto import reaction_pb2
+
+import compute  # pylint: disable=import-error
+
+
+class ComputeTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.enter_context(mock.patch.object(compute, 'WORKERS', 1))
+        compound = message_helpers.build_compound(smiles='c1ccccc1O')
+        self.compound = compound.SerializeToString()
+
+    def test_run(self):
+        self.assertEqual(
+            compute.run(compute.canonicalize_smiles, 'OC1=CC=CC=C1'),
+            'Oc1ccccc1')
+        self.assertIsNotNone(compute.get_executor())
+
+    def test_run_inline(self):
+        with mock.patch.object(compute, 'WORKERS', 0):
+            self.assertIsNone(compute.get_executor())
+            self.assertEqual(compute.run(threading.get_ident),
+                             threading.get_ident())
+
+    def test_busy(self):
+        self.enter_context(
+            mock.patch.object(compute, '_pending',
+                              threading.BoundedSemaphore(1)))
+        thread = threading.Thread(target=compute.run, args=(time.sleep, 1))
+        thread.start()
+        time.sleep(0.1)
+        with self.assertRaises(compute.Busy):
+            compute.run(time.sleep, 0)
+        thread.join()
+        compute.run(time.sleep, 0)  # The slot was released.
+
+    def test_executor(self):
+        self.enter_context(
+            mock.patch.object(compute, '_pending',
+                              threading.BoundedSemaphore(1)))
+        executor = compute.Executor()
+        pooled = executor.submit(time.sleep, 0.5)
+        # The pool is full, so the next task runs in this thread.
+        inline = executor.submit(threading.get_ident)
+        self.assertTrue(inline.done())
+        self.assertEqual(inline.result(), threading.get_ident())
+        self.assertIsNone(pooled.result())
+        with self.assertRaises(ZeroDivisionError):
+            executor.submit(divmod, 1, 0).result()
+
+    def test_timeout(self):
+        with self.assertRaises(concurrent.futures.TimeoutError):
+            compute.run(time.sleep, 1, timeout=0.1)
+
+    def test_run_cached(self):
+        self.enter_context(
+            mock.patch.object(compute, '_cache', collections.OrderedDict()))
+        run = self.enter_context(
+            mock.patch.object(compute, 'run', wraps=compute.run))
+        data = reaction_pb2.Reaction(reaction_id='test').SerializeToString()
+        first = compute.run_cached(compute.validate, 'Reaction', data)
+        # Equal content is looked up, not validated again.
+        self.assertEqual(
+            compute.run_cached(compute.validate, 'Reaction', bytes(data)),
+            first)
+        self.assertEqual(run.call_count, 1)
+        compute.run_cached(compute.validate, 'ReactionInput', data)
+        self.assertEqual(run.call_count, 2)
+
+    def test_validate(self):
+        errors, warnings = compute.validate(
+            'Reaction',
+            reaction_pb2.Reaction(reaction_id='test').SerializeToString())
+        self.assertNotEmpty(errors)
+        self.assertIsInstance(warnings, list)
+
+    def test_molfile(self):
+        self.assertIn('V2000', compute.run(compute.molfile, self.compound))
+        self.assertIsNone(
+            compute.molfile(reaction_pb2.Compound().SerializeToString()))
+
+    def test_render_compound(self):
+        self.assertIn('<svg', compute.run(compute.render_compound,
+                                          self.compound))
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,293 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Structural diffs between Datasets.
+
+Reactions are matched by a hash of their deterministic serialization, so
+unchanged reactions cost one hash each. Only the leftovers are paired (by
+reaction_id, then by position) and compared field by field. Unchanged reactions
+that changed their relative order are reported as moved, so a reordered
+Dataset is not equal to the original. The result is a JSON-ready report:
+
+    {
+        "unchanged": 98,
+        "moved": [{"old_index": 5, "new_index": 1, "reaction_id": "ord-..."}],
+        "added": [{"index": 7, "reaction_id": "ord-..."}],
+        "removed": [{"index": 3, "reaction_id": ""}],
+        "modified": [{
+            "old_index": 0,
+            "new_index": 0,
+            "reaction_id": "",
+            "changes": [{
+                "path": "inputs[\"a\"].components[0].amount.mass.value",
+                "old": 1.0,
+                "new": 2.0,
+            }],
+            "truncated": false,
+        }],
+        "dataset": [... changes to fields other than reactions ...],
+    }
+"""
+
+import bisect
+import collections
+import hashlib
+
+from google.protobuf import descriptor
+from google.protobuf import text_format
+
+# Changes listed per reaction before the rest are elided.
+MAX_CHANGES = 100
+# Longest rendering of a single value in a change.
+MAX_VALUE_LENGTH = 200
+
+
+def content_hash(serialized):
+    """Returns a 16-byte digest of serialized message bytes."""
+    return hashlib.blake2b(serialized, digest_size=16).digest()
+
+
+def reaction_hash(reaction):
+    """Returns a digest of a message's deterministic serialization."""
+    return content_hash(reaction.SerializeToString(deterministic=True))
+
+
+def _is_map(field):
+    return (field.type == descriptor.FieldDescriptor.TYPE_MESSAGE and
+            field.message_type.GetOptions().map_entry)
+
+
+def _format(field, value):
+    """Renders a field value as a short JSON-compatible value."""
+    if value is None:
+        return None
+    if field.type == descriptor.FieldDescriptor.TYPE_MESSAGE:
+        text = text_format.MessageToString(value, as_one_line=True)
+    elif field.type == descriptor.FieldDescriptor.TYPE_BYTES:
+        return f'<{len(value)} bytes>'
+    elif field.type == descriptor.FieldDescriptor.TYPE_ENUM:
+        enum_value = field.enum_type.values_by_number.get(value)
+        return value if enum_value is None else enum_value.name
+    elif field.type == descriptor.FieldDescriptor.TYPE_STRING:
+        text = value
+    else:
+        return value
+    if len(text) > MAX_VALUE_LENGTH:
+        text = text[:MAX_VALUE_LENGTH - 3] + '...'
+    return text
+
+
+def _compare_values(field, old, new, path, changes):
+    if old is not None and new is not None and (
+            field.type == descriptor.FieldDescriptor.TYPE_MESSAGE):
+        if old != new:
+            changes.extend(diff_messages(old, new, path))
+    elif old != new:
+        changes.append({
+            'path': path,
+            'old': _format(field, old),
+            'new': _format(field, new),
+        })
+
+
+def diff_messages(old, new, prefix='', skip=()):
+    """Lists the fields that differ between two messages of the same type.
+
+    Repeated fields are compared by index and map fields by key.
+
+    Args:
+        old: Message.
+        new: Message of the same type.
+        prefix: Path of these messages within their parent.
+        skip: Names of top-level fields to ignore.
+
+    Returns:
+        List of {"path", "old", "new"} dicts; absent values are None.
+    """
+    fields = {}
+    for message in (old, new):
+        for field, _ in message.ListFields():
+            if field.name not in skip:
+                fields[field.number] = field
+    changes = []
+    for number in sorted(fields):
+        field = fields[number]
+        path = f'{prefix}.{field.name}' if prefix else field.name
+        old_value = getattr(old, field.name)
+        new_value = getattr(new, field.name)
+        if _is_map(field):
+            value_field = field.message_type.fields_by_name['value']
+            for key in sorted(set(old_value) | set(new_value)):
+                _compare_values(value_field,
+                                old_value[key] if key in old_value else None,
+                                new_value[key] if key in new_value else None,
+                                f'{path}["{key}"]', changes)
+        elif field.label == descriptor.FieldDescriptor.LABEL_REPEATED:
+            for index in range(max(len(old_value), len(new_value))):
+                _compare_values(
+                    field, old_value[index] if index < len(old_value) else None,
+                    new_value[index] if index < len(new_value) else None,
+                    f'{path}[{index}]', changes)
+        elif field.type == descriptor.FieldDescriptor.TYPE_MESSAGE:
+            _compare_values(field,
+                            old_value if old.HasField(field.name) else None,
+                            new_value if new.HasField(field.name) else None,
+                            path, changes)
+        else:
+            _compare_values(field, old_value, new_value, path, changes)
+    return changes
+
+
+def _moved(matched):
+    """Picks the identical reactions that changed their relative order.
+
+    The reactions in a longest run whose old and new indices both increase
+    stay in place, so an insert or delete does not count as moving the
+    reactions after it; the rest are moved.
+
+    Args:
+        matched: List of (old index, new index) tuples in increasing order of
+            new index.
+
+    Returns:
+        List of the moved (old index, new index) tuples.
+    """
+    # tails[k] is the position in matched of the smallest old index that ends
+    # an increasing run of length k + 1, and ends[k] that old index; previous
+    # links each run back.
+    tails, ends = [], []
+    previous = [None] * len(matched)
+    for position, (old_index, _) in enumerate(matched):
+        length = bisect.bisect_left(ends, old_index)
+        if length:
+            previous[position] = tails[length - 1]
+        if length == len(tails):
+            tails.append(position)
+            ends.append(old_index)
+        else:
+            tails[length] = position
+            ends[length] = old_index
+    kept = set()
+    position = tails[-1] if tails else None
+    while position is not None:
+        kept.add(position)
+        position = previous[position]
+    return [
+        pair for position, pair in enumerate(matched) if position not in kept
+    ]
+
+
+def _pair_leftovers(old, new, old_left, new_left):
+    """Pairs changed reactions by reaction_id, then in order.
+
+    Returns:
+        (pairs, removed, added); see match_reactions().
+    """
+    old_ids = {
+        old.reactions[index].reaction_id: index
+        for index in old_left
+        if old.reactions[index].reaction_id
+    }
+    pairs = []
+    new_unpaired = []
+    for index in new_left:
+        reaction_id = new.reactions[index].reaction_id
+        if reaction_id in old_ids:
+            pairs.append((old_ids.pop(reaction_id), index))
+        else:
+            new_unpaired.append(index)
+    paired = {old_index for old_index, _ in pairs}
+    old_unpaired = [index for index in old_left if index not in paired]
+    # Reactions without IDs are paired in order.
+    pairs.extend(
+        zip([
+            index for index in old_unpaired
+            if not old.reactions[index].reaction_id
+        ], [
+            index for index in new_unpaired
+            if not new.reactions[index].reaction_id
+        ]))
+    paired_old = {old_index for old_index, _ in pairs}
+    paired_new = {new_index for _, new_index in pairs}
+    removed = [index for index in old_unpaired if index not in paired_old]
+    added = [index for index in new_unpaired if index not in paired_new]
+    return sorted(pairs), sorted(removed), sorted(added)
+
+
+def match_reactions(old, new):
+    """Pairs up the reactions of two Datasets.
+
+    Args:
+        old: Dataset.
+        new: Dataset.
+
+    Returns:
+        (matched, pairs, removed, added) where matched lists (old index, new
+        index) of identical reactions in new order, pairs lists (old index,
+        new index) of changed reactions, and removed and added list the
+        unpaired indices.
+    """
+    pool = collections.defaultdict(collections.deque)
+    for index, reaction in enumerate(old.reactions):
+        pool[reaction_hash(reaction)].append(index)
+    matched = []
+    new_left = []
+    for index, reaction in enumerate(new.reactions):
+        matches = pool.get(reaction_hash(reaction))
+        if matches:
+            matched.append((matches.popleft(), index))
+        else:
+            new_left.append(index)
+    old_left = sorted(index for indices in pool.values() for index in indices)
+    return (matched,) + _pair_leftovers(old, new, old_left, new_left)
+
+
+def diff_datasets(old, new):
+    """Returns a structural diff report; see the module docstring."""
+    matched, pairs, removed, added = match_reactions(old, new)
+    modified = []
+    for old_index, new_index in pairs:
+        changes = diff_messages(old.reactions[old_index],
+                                new.reactions[new_index])
+        modified.append({
+            'old_index': old_index,
+            'new_index': new_index,
+            'reaction_id': new.reactions[new_index].reaction_id,
+            'changes': changes[:MAX_CHANGES],
+            'truncated': len(changes) > MAX_CHANGES,
+        })
+    return {
+        'unchanged': len(matched),
+        'moved': [{
+            'old_index': old_index,
+            'new_index': new_index,
+            'reaction_id': new.reactions[new_index].reaction_id
+        } for old_index, new_index in _moved(matched)],
+        'added': [{
+            'index': index,
+            'reaction_id': new.reactions[index].reaction_id
+        } for index in added],
+        'removed': [{
+            'index': index,
+            'reaction_id': old.reactions[index].reaction_id
+        } for index in removed],
+        'modified': modified,
+        'dataset': diff_messages(old, new, skip=('reactions',)),
+    }
+
+
+def is_empty(report):
+    """Returns True if a diff report contains no differences."""
+    return not any(
+        report[key]
+        for key in ('moved', 'added', 'removed', 'modified', 'dataset'))
@@ -0,0 +1,135 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for editor.py.dataset_diff."""
+
+from absl.testing import absltest
+
+from ord_schema.proto import dataset_pb2
+from ord_schema.proto import reaction_pb2
+
+import dataset_diff  # pylint: disable=import-error
+
+
+def _reaction(smiles, reaction_id=''):
+    reaction = reaction_pb2.Reaction(reaction_id=reaction_id)
+    reaction.inputs['a'].components.add().identifiers.add(type='SMILES',
+                                                          value=smiles)
+    return reaction
+
+
+class DatasetDiffTest(absltest.TestCase):
+
+    def test_identical(self):
+        dataset = dataset_pb2.Dataset(
+            name='test', reactions=[_reaction('C'),
+                                    _reaction('CC')])
+        report = dataset_diff.diff_datasets(dataset, dataset)
+        self.assertTrue(dataset_diff.is_empty(report))
+        self.assertEqual(report['unchanged'], 2)
+
+    def test_reordered(self):
+        old = dataset_pb2.Dataset(reactions=[_reaction('C'), _reaction('CC')])
+        new = dataset_pb2.Dataset(reactions=[_reaction('CC'), _reaction('C')])
+        report = dataset_diff.diff_datasets(old, new)
+        self.assertFalse(dataset_diff.is_empty(report))
+        self.assertEqual(report['unchanged'], 2)
+        self.assertEqual(report['moved'], [{
+            'old_index': 1,
+            'new_index': 0,
+            'reaction_id': ''
+        }])
+
+    def test_moved(self):
+        smiles = ['C', 'CC', 'CCC', 'CCCC', 'CCCCC']
+        old = dataset_pb2.Dataset(reactions=[_reaction(s) for s in smiles])
+        new = dataset_pb2.Dataset(
+            reactions=[_reaction(s) for s in smiles[1:] + smiles[:1]])
+        report = dataset_diff.diff_datasets(old, new)
+        self.assertEqual([(reaction['old_index'], reaction['new_index'])
+                          for reaction in report['moved']], [(0, 4)])
+
+    def test_inserted_is_not_moved(self):
+        old = dataset_pb2.Dataset(reactions=[_reaction('C'), _reaction('CC')])
+        new = dataset_pb2.Dataset(
+            reactions=[_reaction('CCC'),
+                       _reaction('C'),
+                       _reaction('CC')])
+        report = dataset_diff.diff_datasets(old, new)
+        self.assertEqual(report['moved'], [])
+        self.assertEqual([reaction['index'] for reaction in report['added']],
+                         [0])
+
+    def test_modified(self):
+        old = dataset_pb2.Dataset(name='old', reactions=[_reaction('C')])
+        new = dataset_pb2.Dataset(name='new', reactions=[_reaction('CC')])
+        new.reactions[0].inputs['a'].components[0].amount.mass.value = 1.5
+        report = dataset_diff.diff_datasets(old, new)
+        self.assertEqual(report['dataset'], [{
+            'path': 'name',
+            'old': 'old',
+            'new': 'new'
+        }])
+        self.assertEqual(report['modified'], [{
+            'old_index': 0,
+            'new_index': 0,
+            'reaction_id': '',
+            'changes': [{
+                'path': 'inputs["a"].components[0].identifiers[0].value',
+                'old': 'C',
+                'new': 'CC',
+            }, {
+                'path': 'inputs["a"].components[0].amount',
+                'old': None,
+                'new': 'mass { value: 1.5 }',
+            }],
+            'truncated': False,
+        }])
+
+    def test_added_and_removed(self):
+        old = dataset_pb2.Dataset(
+            reactions=[_reaction('C', 'ord-1'),
+                       _reaction('CC', 'ord-2')])
+        new = dataset_pb2.Dataset(reactions=[
+            _reaction('CCC', 'ord-2'),
+            _reaction('CCCC', 'ord-3'),
+            _reaction('CCCCC')
+        ])
+        report = dataset_diff.diff_datasets(old, new)
+        self.assertEqual(report['removed'], [{
+            'index': 0,
+            'reaction_id': 'ord-1'
+        }])
+        self.assertEqual(report['added'], [{
+            'index': 1,
+            'reaction_id': 'ord-3'
+        }, {
+            'index': 2,
+            'reaction_id': ''
+        }])
+        self.assertEqual([(reaction['old_index'], reaction['new_index'])
+                          for reaction in report['modified']], [(1, 0)])
+
+    def test_truncated(self):
+        old = dataset_pb2.Dataset(reactions=[_reaction('C')])
+        new = dataset_pb2.Dataset(reactions=[_reaction('C')])
+        for i in range(dataset_diff.MAX_CHANGES + 1):
+            new.reactions[0].observations.add(comment=str(i))
+        report = dataset_diff.diff_datasets(old, new)
+        self.assertLen(report['modified'][0]['changes'],
+                       dataset_diff.MAX_CHANGES)
+        self.assertTrue(report['modified'][0]['truncated'])
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,301 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Summary statistics for datasets and users.
+
+Every write through dataset_store.insert_dataset() stores a summary of the
+Dataset in its datasets row (see COLUMNS) and adds the change to the owner's
+totals in the user_stats table, so listings never parse a serialized proto.
+
+Validation dominates the cost of a summary, so each distinct reaction is
+summarized once and kept in the reaction_stats table under its content hash
+(see dataset_diff.content_hash). Saving a dataset only summarizes reactions
+that are new; the rest are looked up. New reactions are summarized in the
+compute pool (see compute.py), SUMMARY_CHUNK at a time, so validating a large
+upload does not hold the GIL of the server process.
+"""
+
+import bisect
+import time
+
+import psycopg2.extras
+
+from ord_schema import validations
+from ord_schema.proto import reaction_pb2
+
+# compute() below is this module's own.
+import compute as compute_pool
+
+# Upper bounds (in percent) of the yield buckets. Bucket 0 counts reactions
+# with no reported yield; bucket i > 0 counts yields below YIELD_BOUNDS[i - 1],
+# and the last bucket counts yields of at least YIELD_BOUNDS[-1].
+YIELD_BOUNDS = (20, 40, 60, 80)
+NUM_BUCKETS = len(YIELD_BOUNDS) + 2
+YIELD_LABELS = (
+    ['none', f'<{YIELD_BOUNDS[0]}%'] +
+    [f'{low}-{high}%' for low, high in zip(YIELD_BOUNDS, YIELD_BOUNDS[1:])] +
+    [f'>={YIELD_BOUNDS[-1]}%'])
+
+# Reactions summarized per compute task.
+SUMMARY_CHUNK = 200
+
+# Summary columns of the datasets and user_stats tables, in order.
+COLUMNS = ('num_reactions', 'size', 'num_compounds', 'num_errors',
+           'yield_buckets')
+
+_YIELD = reaction_pb2.ProductMeasurement.YIELD
+
+
+def _options():
+    # Match what the editor reports for each reaction.
+    return validations.ValidationOptions(require_provenance=True)
+
+
+def reaction_yield(reaction):
+    """Returns the highest percentage yield of any product, or None."""
+    best = None
+    for outcome in reaction.outcomes:
+        for product in outcome.products:
+            for measurement in product.measurements:
+                if (measurement.type == _YIELD and
+                        measurement.WhichOneof('value') == 'percentage'):
+                    value = measurement.percentage.value
+                    if best is None or value > best:
+                        best = value
+    return best
+
+
+def yield_bucket(value):
+    """Returns the index of the yield bucket for a percentage or None."""
+    if value is None:
+        return 0
+    return 1 + bisect.bisect_right(YIELD_BOUNDS, value)
+
+
+def summarize_reaction(reaction):
+    """Returns (num_compounds, num_errors, yield bucket) for a Reaction.
+
+    Compounds are input components and outcome products.
+    """
+    num_compounds = sum(
+        len(reaction_input.components)
+        for reaction_input in reaction.inputs.values())
+    num_compounds += sum(len(outcome.products) for outcome in reaction.outcomes)
+    output = validations.validate_message(reaction,
+                                          raise_on_error=False,
+                                          options=_options())
+    return (num_compounds, len(output.errors),
+            yield_bucket(reaction_yield(reaction)))
+
+
+def summarize_serialized(reactions):
+    """Returns summarize_reaction() of each of a list of serialized Reactions.
+
+    This is the compute task of summarize().
+    """
+    return [
+        summarize_reaction(reaction_pb2.Reaction.FromString(serialized))
+        for serialized in reactions
+    ]
+
+
+def empty():
+    """Returns the summary of no datasets."""
+    return {
+        'num_reactions': 0,
+        'size': 0,
+        'num_compounds': 0,
+        'num_errors': 0,
+        'yield_buckets': [0] * NUM_BUCKETS,
+    }
+
+
+def _total(reaction_summaries, size):
+    """Combines reaction summaries into a dataset summary."""
+    summary = empty()
+    summary['size'] = size
+    for num_compounds, num_errors, bucket in reaction_summaries:
+        summary['num_reactions'] += 1
+        summary['num_compounds'] += num_compounds
+        summary['num_errors'] += num_errors
+        summary['yield_buckets'][bucket] += 1
+    return summary
+
+
+def compute(dataset, size):
+    """Summarizes a Dataset without the reaction_stats cache.
+
+    Args:
+        dataset: Dataset.
+        size: Integer size of the serialized Dataset in bytes.
+    """
+    return _total(map(summarize_reaction, dataset.reactions), size)
+
+
+def lookup(cursor, hashes):
+    """Returns the stored summaries of reactions.
+
+    Args:
+        cursor: psycopg2 cursor.
+        hashes: Iterable of reaction content hashes.
+
+    Returns:
+        Dict mapping each hash in the reaction_stats table to its
+        (num_compounds, num_errors, yield bucket) tuple.
+    """
+    hashes = sorted(set(hashes))
+    if not hashes:
+        return {}
+    cursor.execute(
+        'SELECT hash, num_compounds, num_errors, yield_bucket '
+        'FROM reaction_stats WHERE hash=ANY(%s::BYTEA[])', [hashes])
+    return {bytes(row[0]): tuple(row[1:]) for row in cursor}
+
+
+def summarize(cursor, payloads, size):
+    """Summarizes a Dataset, reusing the stored summaries of its reactions.
+
+    Summaries of reactions that are not yet stored are computed and added to
+    the reaction_stats table.
+
+    Args:
+        cursor: psycopg2 cursor.
+        payloads: List of (hash, serialized Reaction) tuples, as returned by
+            revisions.split_dataset().
+        size: Integer size of the serialized Dataset in bytes.
+
+    Returns:
+        Dict mapping each of COLUMNS to its value.
+    """
+    known = lookup(cursor, [value for value, _ in payloads])
+    missing = {}
+    for value, serialized in payloads:
+        if value not in known:
+            missing.setdefault(value, serialized)
+    new = _summarize_missing(missing)
+    if new:
+        psycopg2.extras.execute_values(
+            cursor, 'INSERT INTO reaction_stats '
+            '(hash, num_compounds, num_errors, yield_bucket) VALUES %s '
+            'ON CONFLICT DO NOTHING',
+            [(value, *summary) for value, summary in new.items()])
+        known.update(new)
+    return _total((known[value] for value, _ in payloads), size)
+
+
+def _summarize_missing(missing):
+    """Summarizes {hash: serialized Reaction} in the compute pool.
+
+    compute_pool.Executor runs a task in this thread when the pool is busy, so a
+    save slows down rather than fails.
+    """
+    values = list(missing)
+    reactions = list(missing.values())
+    executor = compute_pool.Executor()
+    futures = [
+        executor.submit(summarize_serialized, reactions[i:i + SUMMARY_CHUNK])
+        for i in range(0, len(reactions), SUMMARY_CHUNK)
+    ]
+    summaries = [summary for future in futures for summary in future.result()]
+    return dict(zip(values, summaries))
+
+
+def from_row(row):
+    """Returns the summary dict for a row of COLUMNS values, or None."""
+    if row is None:
+        return None
+    return dict(zip(COLUMNS, row))
+
+
+def update_user(cursor, user_id, old, new):
+    """Adds the change in one dataset's summary to its owner's totals.
+
+    Args:
+        cursor: psycopg2 cursor.
+        user_id: String owner of the dataset.
+        old: Summary dict before the write, or None if the dataset is new.
+        new: Summary dict after the write, or None if it was deleted.
+    """
+    num_datasets = (new is not None) - (old is not None)
+    old = old or empty()
+    new = new or empty()
+    cursor.execute(
+        'INSERT INTO user_stats (user_id, num_datasets, num_reactions, size, '
+        'num_compounds, num_errors, yield_buckets, updated_time) '
+        'VALUES (%s, %s, %s, %s, %s, %s, %s, %s) '
+        'ON CONFLICT (user_id) DO UPDATE SET '
+        'num_datasets=user_stats.num_datasets+EXCLUDED.num_datasets, '
+        'num_reactions=user_stats.num_reactions+EXCLUDED.num_reactions, '
+        'size=user_stats.size+EXCLUDED.size, '
+        'num_compounds=user_stats.num_compounds+EXCLUDED.num_compounds, '
+        'num_errors=user_stats.num_errors+EXCLUDED.num_errors, '
+        'yield_buckets=ARRAY('
+        '  SELECT a + b FROM UNNEST(user_stats.yield_buckets, '
+        '    EXCLUDED.yield_buckets) WITH ORDINALITY AS t(a, b, i) '
+        '  ORDER BY i), '
+        'updated_time=EXCLUDED.updated_time', [
+            user_id,
+            num_datasets,
+            *(new[key] - old[key] for key in COLUMNS[:-1]),
+            [b - a for a, b in zip(old['yield_buckets'], new['yield_buckets'])],
+            int(time.time()),
+        ])
+
+
+def refresh_users(cursor, user_ids):
+    """Recomputes the totals of the given users from their datasets rows."""
+    for user_id in user_ids:
+        cursor.execute(
+            'SELECT num_reactions, size, num_compounds, num_errors, '
+            'yield_buckets, updated_time FROM datasets WHERE user_id=%s',
+            [user_id])
+        totals = empty()
+        updated_time = 0
+        num_datasets = 0
+        for row in cursor:
+            num_datasets += 1
+            for key, value in zip(COLUMNS, row):
+                if key == 'yield_buckets':
+                    for i, count in enumerate(value):
+                        totals[key][i] += count
+                else:
+                    totals[key] += value
+            updated_time = max(updated_time, row[-1])
+        cursor.execute(
+            'INSERT INTO user_stats (user_id, num_datasets, num_reactions, '
+            'size, num_compounds, num_errors, yield_buckets, updated_time) '
+            'VALUES (%s, %s, %s, %s, %s, %s, %s, %s) '
+            'ON CONFLICT (user_id) DO UPDATE SET '
+            'num_datasets=EXCLUDED.num_datasets, '
+            'num_reactions=EXCLUDED.num_reactions, size=EXCLUDED.size, '
+            'num_compounds=EXCLUDED.num_compounds, '
+            'num_errors=EXCLUDED.num_errors, '
+            'yield_buckets=EXCLUDED.yield_buckets, '
+            'updated_time=EXCLUDED.updated_time', [
+                user_id, num_datasets, *(totals[key] for key in COLUMNS),
+                updated_time
+            ])
+
+
+def get_user(cursor, user_id):
+    """Returns a user's totals as a dict, including num_datasets."""
+    cursor.execute(
+        'SELECT num_datasets, num_reactions, size, num_compounds, num_errors, '
+        'yield_buckets, updated_time FROM user_stats WHERE user_id=%s',
+        [user_id])
+    row = cursor.fetchone()
+    if row is None:
+        return {'num_datasets': 0, 'updated_time': 0, **empty()}
+    totals = {'num_datasets': row[0], 'updated_time': row[-1]}
+    totals.update(zip(COLUMNS, row[1:-1]))
+    return totals
@@ -0,0 +1,107 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for editor.py.dataset_stats."""
+
+import os
+from unittest import mock
+
+from absl.testing import absltest
+from absl.testing import parameterized
+
+from ord_schema import message_helpers
+from ord_schema.proto import dataset_pb2
+from ord_schema.proto import reaction_pb2
+
+import compute  # pylint: disable=import-error
+import dataset_stats  # pylint: disable=import-error
+
+
+class DatasetStatsTest(parameterized.TestCase, absltest.TestCase):
+
+    @parameterized.parameters(
+        (None, 0),
+        (0, 1),
+        (19.9, 1),
+        (20, 2),
+        (79, 4),
+        (80, 5),
+        (120, 5),
+    )
+    def test_yield_bucket(self, value, expected):
+        self.assertEqual(dataset_stats.yield_bucket(value), expected)
+
+    def test_labels(self):
+        self.assertLen(dataset_stats.YIELD_LABELS, dataset_stats.NUM_BUCKETS)
+
+    def test_summarize_reaction(self):
+        reaction = reaction_pb2.Reaction()
+        reaction.inputs['a'].components.add().identifiers.add(type='SMILES',
+                                                              value='C')
+        reaction.inputs['b'].components.add().identifiers.add(type='SMILES',
+                                                              value='CC')
+        outcome = reaction.outcomes.add()
+        for value in (35, 65):
+            product = outcome.products.add()
+            product.identifiers.add(type='SMILES', value='CCC')
+            product.measurements.add(type='YIELD', percentage={'value': value})
+        num_compounds, num_errors, bucket = dataset_stats.summarize_reaction(
+            reaction)
+        self.assertEqual(num_compounds, 4)
+        self.assertGreater(num_errors, 0)  # No provenance, for one.
+        self.assertEqual(bucket, dataset_stats.yield_bucket(65))
+
+    def test_compute(self):
+        dataset = message_helpers.load_message(
+            os.path.join(os.path.dirname(__file__), 'testdata',
+                         'nielsen_fig1_dataset.pbtxt'), dataset_pb2.Dataset)
+        summary = dataset_stats.compute(dataset, 123)
+        self.assertEqual(summary['size'], 123)
+        self.assertEqual(summary['num_reactions'], len(dataset.reactions))
+        self.assertEqual(sum(summary['yield_buckets']), len(dataset.reactions))
+        self.assertGreater(summary['num_compounds'], len(dataset.reactions))
+
+    def test_summarize_in_pool(self):
+        dataset = message_helpers.load_message(
+            os.path.join(os.path.dirname(__file__), 'testdata',
+                         'nielsen_fig1_dataset.pbtxt'), dataset_pb2.Dataset)
+        payloads = [(str(i).encode(), reaction.SerializeToString())
+                    for i, reaction in enumerate(dataset.reactions)]
+        payloads.append(payloads[0])
+        cursor = mock.MagicMock()
+        cursor.__iter__.return_value = iter([])
+        with mock.patch.object(dataset_stats, 'SUMMARY_CHUNK', 2), \
+                mock.patch.object(compute, 'submit',
+                                  wraps=compute.submit) as submit, \
+                mock.patch.object(dataset_stats.psycopg2.extras,
+                                  'execute_values') as execute_values:
+            summary = dataset_stats.summarize(cursor, payloads, 123)
+        self.assertEqual(submit.call_count, (len(dataset.reactions) + 1) // 2)
+        self.assertLen(execute_values.call_args[0][2], len(dataset.reactions))
+        expected = dataset_stats.compute(dataset, 123)
+        first = dataset_stats.summarize_reaction(dataset.reactions[0])
+        expected['num_reactions'] += 1
+        expected['num_compounds'] += first[0]
+        expected['num_errors'] += first[1]
+        expected['yield_buckets'][first[2]] += 1
+        self.assertEqual(summary, expected)
+
+    def test_from_row(self):
+        self.assertIsNone(dataset_stats.from_row(None))
+        summary = dataset_stats.from_row((1, 2, 3, 4, [1, 0, 0, 0, 0, 0]))
+        self.assertEqual(summary['num_errors'], 4)
+        self.assertEqual(set(summary), set(dataset_stats.empty()))
+
+
+if __name__ == '__main__':
+    absltest.main()
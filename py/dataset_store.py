@@ -0,0 +1,280 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Reads, writes, and copies Datasets in the datasets table.
+
+Every write stores, besides the deterministically serialized Dataset, the byte
+offsets of its reactions (see reaction_index.py) and its summary columns (see
+dataset_stats.py). It also records a revision (see revisions.py) and updates
+the owner's statistics, in the caller's transaction.
+
+The serialized Dataset is a full copy, not a list of reaction hashes, so
+reaction_index.py can read and splice single reactions without assembling the
+Dataset; only the revision history shares reactions between datasets. Copies
+made by revisions.copy() have no serialized proto until they are first
+written; the readers rebuild them from their revision history.
+"""
+
+import binascii
+import time
+
+import psycopg2.sql
+
+from ord_schema.proto import dataset_pb2
+from ord_schema.proto import reaction_pb2
+
+import dataset_stats
+import metrics
+import reaction_index
+import revisions
+
+
+def insert_dataset(cursor, user_id, name, dataset, clobber=False):
+    """Writes a dataset proto and its summary columns to the datasets table.
+
+    See insert_serialized().
+
+    Args:
+        cursor: psycopg2 cursor for the write.
+        user_id: String owner of the dataset.
+        name: String dataset name.
+        dataset: Dataset proto.
+        clobber: If True, replace any existing dataset with the same name.
+    """
+    with metrics.PROTO_SECONDS.labels('serialize').time():
+        serialized = dataset.SerializeToString(deterministic=True)
+    metrics.PROTO_BYTES.labels('serialize').observe(len(serialized))
+    metrics.DATASET_REACTIONS.labels('serialize').observe(len(
+        dataset.reactions))
+    insert_serialized(cursor, user_id, name, serialized, clobber=clobber)
+
+
+def insert_serialized(cursor,
+                      user_id,
+                      name,
+                      serialized,
+                      *,
+                      offsets=None,
+                      clobber=False):
+    """Writes a serialized Dataset and its summary columns.
+
+    The row also stores the byte offsets of its reactions; see
+    reaction_index.py. Also records a revision in the dataset's history (see
+    revisions.py) and updates the owner's statistics (see dataset_stats.py).
+
+    Args:
+        cursor: psycopg2 cursor for the write.
+        user_id: String owner of the dataset.
+        name: String dataset name.
+        serialized: Deterministically serialized Dataset.
+        offsets: reaction_index.scan(serialized), if already known.
+        clobber: If True, replace any existing dataset with the same name.
+    """
+    if offsets is None:
+        offsets = reaction_index.scan(serialized)
+    split = reaction_index.split(serialized, offsets)
+    summary = dataset_stats.summarize(cursor, split[1], len(serialized))
+    old = None
+    if clobber:
+        query = psycopg2.sql.SQL(
+            'SELECT num_reactions, size, num_compounds, num_errors, '
+            'yield_buckets FROM datasets WHERE user_id=%s AND name=%s '
+            'FOR UPDATE')
+        cursor.execute(query, [user_id, name])
+        old = dataset_stats.from_row(cursor.fetchone())
+    values = [
+        user_id, name,
+        serialized.hex(),
+        reaction_index.encode(offsets), summary['size'],
+        summary['num_reactions'], summary['num_compounds'],
+        summary['num_errors'], summary['yield_buckets'],
+        int(time.time())
+    ]
+    if clobber:
+        query = psycopg2.sql.SQL(
+            'INSERT INTO datasets (user_id, name, serialized, '
+            'reaction_offsets, size, num_reactions, num_compounds, '
+            'num_errors, yield_buckets, updated_time) '
+            'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) '
+            'ON CONFLICT (user_id, name) DO UPDATE SET '
+            'serialized=EXCLUDED.serialized, '
+            'reaction_offsets=EXCLUDED.reaction_offsets, '
+            'size=EXCLUDED.size, num_reactions=EXCLUDED.num_reactions, '
+            'num_compounds=EXCLUDED.num_compounds, '
+            'num_errors=EXCLUDED.num_errors, '
+            'yield_buckets=EXCLUDED.yield_buckets, '
+            'updated_time=EXCLUDED.updated_time')
+    else:
+        query = psycopg2.sql.SQL(
+            'INSERT INTO datasets (user_id, name, serialized, '
+            'reaction_offsets, size, num_reactions, num_compounds, '
+            'num_errors, yield_buckets, updated_time) '
+            'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)')
+    cursor.execute(query, values)
+    revisions.record(cursor, user_id, name, None, split=split)
+    dataset_stats.update_user(cursor, user_id, old, summary)
+
+
+def read_dataset(cursor, user_id, name):
+    """Reads and parses a Dataset.
+
+    Args:
+        cursor: psycopg2 cursor.
+        user_id: String owner of the dataset.
+        name: String dataset name.
+
+    Returns:
+        Dataset proto.
+
+    Raises:
+        KeyError: The dataset does not exist.
+    """
+    query = psycopg2.sql.SQL(
+        'SELECT serialized FROM datasets WHERE user_id=%s AND name=%s')
+    cursor.execute(query, [user_id, name])
+    if cursor.rowcount == 0:
+        raise KeyError(name)
+    serialized = cursor.fetchone()[0]
+    with metrics.PROTO_SECONDS.labels('parse').time():
+        if serialized is None:
+            dataset = revisions.load(
+                cursor, user_id, name,
+                revisions.latest_revision(cursor, user_id, name))
+            serialized = dataset.SerializeToString()
+        else:
+            serialized = binascii.unhexlify(serialized.tobytes())
+            dataset = dataset_pb2.Dataset.FromString(serialized)
+    metrics.PROTO_BYTES.labels('parse').observe(len(serialized))
+    metrics.DATASET_REACTIONS.labels('parse').observe(len(dataset.reactions))
+    return dataset
+
+
+def read_serialized(cursor, user_id, name, for_update=False):
+    """Reads a serialized Dataset and the offsets of its reactions.
+
+    Args:
+        cursor: psycopg2 cursor.
+        user_id: String owner of the dataset.
+        name: String dataset name.
+        for_update: If True, lock the row until the end of the transaction.
+
+    Returns:
+        (serialized Dataset, reaction_index offsets) tuple, or (None, None)
+        for copies that have no serialized proto.
+
+    Raises:
+        KeyError: The dataset does not exist.
+    """
+    query = ('SELECT serialized, reaction_offsets FROM datasets '
+             'WHERE user_id=%s AND name=%s')
+    if for_update:
+        query += ' FOR UPDATE'
+    cursor.execute(psycopg2.sql.SQL(query), [user_id, name])
+    if cursor.rowcount == 0:
+        raise KeyError(name)
+    serialized, offsets = cursor.fetchone()
+    if serialized is None:
+        return None, None
+    serialized = binascii.unhexlify(serialized.tobytes())
+    if offsets is None:
+        return serialized, reaction_index.scan(serialized)
+    return serialized, reaction_index.decode(offsets)
+
+
+def read_reaction(cursor, user_id, name, index):
+    """Reads and parses one Reaction of a dataset; see reaction_index.py.
+
+    Only the Reaction's bytes are read, unless the dataset has no offset index
+    (copies that have not been written yet).
+
+    Args:
+        cursor: psycopg2 cursor.
+        user_id: String owner of the dataset.
+        name: String dataset name.
+        index: Integer index of the Reaction.
+
+    Returns:
+        Reaction, or None if the index is out of range.
+
+    Raises:
+        KeyError: The dataset does not exist.
+    """
+    start, length = reaction_index.entry_range(index)
+    query = psycopg2.sql.SQL(
+        'SELECT num_reactions, SUBSTRING(reaction_offsets FROM %s FOR %s) '
+        'FROM datasets WHERE user_id=%s AND name=%s')
+    cursor.execute(query, [start, length, user_id, name])
+    if cursor.rowcount == 0:
+        raise KeyError(name)
+    num_reactions, entry = cursor.fetchone()
+    if not 0 <= index < num_reactions:
+        return None
+    if entry is None:
+        return read_dataset(cursor, user_id, name).reactions[index]
+    [(offset, length)] = reaction_index.decode(entry)
+    # The serialized column holds hex, two characters per byte.
+    query = psycopg2.sql.SQL(
+        'SELECT SUBSTRING(serialized FROM %s FOR %s) FROM datasets '
+        'WHERE user_id=%s AND name=%s')
+    cursor.execute(query, [2 * offset + 1, 2 * length, user_id, name])
+    serialized = binascii.unhexlify(cursor.fetchone()[0].tobytes())
+    with metrics.PROTO_SECONDS.labels('parse').time():
+        reaction = reaction_pb2.Reaction.FromString(serialized)
+    metrics.PROTO_BYTES.labels('parse').observe(len(serialized))
+    return reaction
+
+
+def copy_dataset(cursor, user_id, name, new_user_id, new_name):
+    """Copies a dataset without duplicating its reactions; see revisions.copy().
+
+    The copy has no serialized proto until it is first written. Also updates
+    the new owner's statistics.
+
+    Args:
+        cursor: psycopg2 cursor for the write.
+        user_id: String owner of the source dataset.
+        name: String source dataset name.
+        new_user_id: String owner of the copy.
+        new_name: String name of the copy.
+
+    Raises:
+        KeyError: The source dataset does not exist.
+    """
+    # Datasets loaded by migrate.py may be newer than their history.
+    query = psycopg2.sql.SQL(
+        'SELECT datasets.updated_time, MAX(revisions.created_time) '
+        'FROM datasets LEFT JOIN revisions USING (user_id, name) '
+        'WHERE datasets.user_id=%s AND datasets.name=%s '
+        'GROUP BY datasets.updated_time')
+    cursor.execute(query, [user_id, name])
+    if cursor.rowcount == 0:
+        raise KeyError(name)
+    updated_time, revised_time = cursor.fetchone()
+    if revised_time is None or revised_time < updated_time:
+        revisions.record(cursor, user_id, name,
+                         read_dataset(cursor, user_id, name))
+    revisions.copy(cursor, user_id, name, new_user_id, new_name)
+    query = psycopg2.sql.SQL(
+        'INSERT INTO datasets (user_id, name, serialized, size, '
+        'num_reactions, num_compounds, num_errors, yield_buckets, '
+        'updated_time) '
+        'SELECT %s, %s, NULL, size, num_reactions, num_compounds, '
+        'num_errors, yield_buckets, %s FROM datasets '
+        'WHERE user_id=%s AND name=%s '
+        'RETURNING num_reactions, size, num_compounds, num_errors, '
+        'yield_buckets')
+    cursor.execute(query,
+                   [new_user_id, new_name,
+                    int(time.time()), user_id, name])
+    dataset_stats.update_user(cursor, new_user_id, None,
+                              dataset_stats.from_row(cursor.fetchone()))
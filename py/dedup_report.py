@@ -0,0 +1,173 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Reports how much reaction content is duplicated across datasets.
+
+Enumerated datasets, cloned reactions, and review imports repeat byte-identical
+Reactions. Every Reaction of every current dataset is identified by the content
+hash of its deterministic serialization (see dataset_diff.content_hash), the
+same key as the reactions table, and the report compares:
+
+    * reactions: Reactions in all datasets, and their bytes;
+    * distinct: distinct Reactions among them, and their bytes;
+    * repeated_within: Reactions that repeat an earlier one in the same
+      dataset;
+    * stored: rows and bytes of the reactions table, which keeps each distinct
+      Reaction of the revision history once (see revisions.py). The current
+      datasets are stored whole besides, so this is not their storage cost.
+
+The dedup ratio is reactions / distinct. Stored datasets are scanned with
+reaction_index.py without parsing; copies that have only a revision history
+are read from the reactions table. Datasets are read one at a time, so memory
+grows with the number of distinct Reactions rather than the data.
+
+    $ PYTHONPATH=py python py/dedup_report.py
+"""
+
+import binascii
+import json
+import os
+
+from absl import app
+from absl import flags
+import psycopg2
+
+import dataset_diff
+import reaction_index
+import revisions
+
+
+def tally(datasets):
+    """Counts duplicated Reactions.
+
+    Args:
+        datasets: Iterable of lists of (hash, size in bytes) tuples, one list
+            per dataset, for its Reactions in order.
+
+    Returns:
+        Dict of counts; see the module docstring.
+    """
+    sizes = {}
+    counts = {
+        'datasets': 0,
+        'reactions': 0,
+        'reaction_bytes': 0,
+        'repeated_within': 0,
+    }
+    for reactions in datasets:
+        counts['datasets'] += 1
+        seen = set()
+        for value, size in reactions:
+            counts['reactions'] += 1
+            counts['reaction_bytes'] += size
+            if value in seen:
+                counts['repeated_within'] += 1
+            seen.add(value)
+            sizes[value] = size
+    counts['distinct'] = len(sizes)
+    counts['distinct_bytes'] = sum(sizes.values())
+    counts['ratio'] = (counts['reactions'] /
+                       counts['distinct'] if counts['distinct'] else 1.0)
+    counts['byte_ratio'] = (counts['reaction_bytes'] / counts['distinct_bytes']
+                            if counts['distinct_bytes'] else 1.0)
+    return counts
+
+
+def scan_datasets(cursor, owner=None):
+    """Yields a list of (hash, size) tuples for each dataset.
+
+    Args:
+        cursor: psycopg2 cursor.
+        owner: Optional user ID whose datasets are scanned; defaults to all.
+    """
+    cursor.execute(
+        'SELECT user_id, name, serialized IS NULL FROM datasets '
+        'WHERE %(owner)s IS NULL OR user_id=%(owner)s ORDER BY user_id, name',
+        {'owner': owner})
+    keys = cursor.fetchall()
+    for user_id, name, is_copy in keys:
+        if is_copy:
+            latest = revisions.latest_revision(cursor, user_id, name)
+            if latest is None:
+                continue
+            hashes, _ = revisions.load_hashes(cursor, user_id, name, latest)
+            cursor.execute(
+                'SELECT hash, LENGTH(serialized) FROM reactions '
+                'WHERE hash=ANY(%s::BYTEA[])', [sorted(set(hashes))])
+            sizes = {bytes(value): size for value, size in cursor}
+            yield [(value, sizes[value]) for value in hashes]
+            continue
+        cursor.execute(
+            'SELECT serialized, reaction_offsets FROM datasets '
+            'WHERE user_id=%s AND name=%s', [user_id, name])
+        serialized, offsets = cursor.fetchone()
+        serialized = binascii.unhexlify(serialized.tobytes())
+        if offsets is None:
+            offsets = reaction_index.scan(serialized)
+        else:
+            offsets = reaction_index.decode(offsets)
+        yield [(dataset_diff.content_hash(serialized[offset:offset + length]),
+                length) for offset, length in offsets]
+
+
+def report(cursor, owner=None):
+    """Returns tally() over scan_datasets() plus the reactions table totals."""
+    counts = tally(scan_datasets(cursor, owner))
+    cursor.execute('SELECT COUNT(*), COALESCE(SUM(LENGTH(serialized)), 0) '
+                   'FROM reactions')
+    counts['stored'], counts['stored_bytes'] = cursor.fetchone()
+    return counts
+
+
+FLAGS = flags.FLAGS
+
+
+def main(argv):
+    del argv  # Only used by app.run().
+    connection = psycopg2.connect(dbname='editor',
+                                  host=FLAGS.host,
+                                  port=FLAGS.port,
+                                  user=FLAGS.user,
+                                  password=os.getenv('POSTGRES_PASSWORD', ''))
+    try:
+        # Read-only, but in one transaction for a consistent view.
+        connection.set_session(readonly=True)
+        with connection.cursor() as cursor:
+            counts = report(cursor, FLAGS.owner)
+    finally:
+        connection.close()
+    if FLAGS.json:
+        print(json.dumps(counts, indent=2))
+        return
+    print(f'{counts["reactions"]} reactions ({counts["reaction_bytes"]} bytes) '
+          f'in {counts["datasets"]} datasets')
+    print(f'{counts["distinct"]} distinct ({counts["distinct_bytes"]} bytes); '
+          f'dedup ratio {counts["ratio"]:.2f} '
+          f'({counts["byte_ratio"]:.2f} by bytes)')
+    print(f'{counts["repeated_within"]} repeat a reaction in the same dataset')
+    print(f'{counts["stored"]} stored in the reactions table '
+          f'({counts["stored_bytes"]} bytes, including history)')
+
+
+if __name__ == '__main__':
+    # Flags are defined here because tests import this module with schema.py.
+    flags.DEFINE_string('host', os.getenv('POSTGRES_HOST', 'localhost'),
+                        'Postgres host.')
+    flags.DEFINE_integer('port', int(os.getenv('POSTGRES_PORT', '5432')),
+                         'Postgres port.')
+    flags.DEFINE_string('user', os.getenv('POSTGRES_USER', 'postgres'),
+                        'Postgres user.')
+    flags.DEFINE_string('owner', None,
+                        'If set, only report on datasets of this user ID.')
+    flags.DEFINE_boolean('json', False, 'If True, print the counts as JSON.')
+    app.run(main)
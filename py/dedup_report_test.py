@@ -0,0 +1,177 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for editor.py.dedup_report and reaction reference counts.
+
+ReportTest needs the editor database, reachable as in serve_test.py.
+"""
+
+import os
+import uuid
+
+from absl.testing import absltest
+import psycopg2
+
+from ord_schema.proto import dataset_pb2
+
+import dedup_report  # pylint: disable=import-error
+import revisions  # pylint: disable=import-error
+import schema  # pylint: disable=import-error
+
+
+def _dataset():
+    dataset = dataset_pb2.Dataset(name='dedup')
+    for index in range(3):
+        dataset.reactions.add(reaction_id=f'ord-{index}')
+    # A clone of the first reaction.
+    dataset.reactions.add(reaction_id='ord-0')
+    return dataset
+
+
+class TallyTest(absltest.TestCase):
+
+    def test_tally(self):
+        counts = dedup_report.tally([
+            [(b'a', 10), (b'b', 20), (b'a', 10)],
+            [(b'a', 10), (b'c', 30)],
+            [],
+        ])
+        self.assertEqual(counts['datasets'], 3)
+        self.assertEqual(counts['reactions'], 5)
+        self.assertEqual(counts['reaction_bytes'], 80)
+        self.assertEqual(counts['distinct'], 3)
+        self.assertEqual(counts['distinct_bytes'], 60)
+        self.assertEqual(counts['repeated_within'], 1)
+        self.assertAlmostEqual(counts['ratio'], 5 / 3)
+        self.assertAlmostEqual(counts['byte_ratio'], 80 / 60)
+
+    def test_tally_empty(self):
+        counts = dedup_report.tally([])
+        self.assertEqual(counts['distinct'], 0)
+        self.assertEqual(counts['ratio'], 1.0)
+
+
+class ReportTest(absltest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Connects to the editor database and applies the migrations."""
+        super().setUpClass()
+        cls.conn = psycopg2.connect(dbname='editor',
+                                    user=os.getenv('POSTGRES_USER', 'postgres'),
+                                    password=os.getenv('POSTGRES_PASSWORD', ''),
+                                    host=os.getenv('POSTGRES_HOST',
+                                                   'localhost'),
+                                    port=int(os.getenv('POSTGRES_PORT',
+                                                       '5432')))
+        schema.migrate(cls.conn)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Closes the database connection."""
+        cls.conn.close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.user_id = uuid.uuid4().hex
+        self.dataset = _dataset()
+        _, payloads = revisions.split_dataset(self.dataset)
+        self.hashes = [value for value, _ in payloads]
+        with self.conn.cursor() as cursor:
+            cursor.execute('INSERT INTO users VALUES (%s, NULL, 0)',
+                           [self.user_id])
+            cursor.execute(
+                'INSERT INTO datasets (user_id, name, serialized) '
+                'VALUES (%s, %s, %s)', [
+                    self.user_id, 'source',
+                    self.dataset.SerializeToString(deterministic=True).hex()
+                ])
+            revisions.record(cursor, self.user_id, 'source', self.dataset)
+            revisions.copy(cursor, self.user_id, 'source', self.user_id, 'copy')
+            cursor.execute(
+                'INSERT INTO datasets (user_id, name, serialized) '
+                'VALUES (%s, %s, NULL)', [self.user_id, 'copy'])
+        self.conn.commit()
+
+    def tearDown(self):
+        """Deletes the rows created by setUp()."""
+        self.conn.rollback()
+        with self.conn.cursor() as cursor:
+            cursor.execute('DELETE FROM datasets WHERE user_id=%s',
+                           [self.user_id])
+            revisions.delete_history(cursor, self.user_id)
+            cursor.execute('DELETE FROM users WHERE user_id=%s', [self.user_id])
+        self.conn.commit()
+        super().tearDown()
+
+    def refs(self):
+        """Returns the reference counts of the dataset's stored reactions."""
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                'SELECT hash, refs FROM reactions WHERE hash=ANY(%s::BYTEA[])',
+                [sorted(set(self.hashes))])
+            refs = {bytes(value): count for value, count in cursor}
+        self.conn.commit()
+        return refs
+
+    def test_report(self):
+        with self.conn.cursor() as cursor:
+            counts = dedup_report.report(cursor, self.user_id)
+        self.conn.commit()
+        self.assertEqual(counts['datasets'], 2)
+        self.assertEqual(counts['reactions'], 8)
+        self.assertEqual(counts['distinct'], 3)
+        self.assertEqual(counts['repeated_within'], 2)
+        self.assertAlmostEqual(counts['ratio'], 8 / 3)
+        self.assertGreaterEqual(counts['stored'], 3)
+
+    def test_references(self):
+        # One reference from each of the two revisions rows.
+        self.assertEqual(self.refs(), {value: 2 for value in self.hashes})
+        changed = dataset_pb2.Dataset()
+        changed.CopyFrom(self.dataset)
+        del changed.reactions[1]
+        with self.conn.cursor() as cursor:
+            revisions.record(cursor, self.user_id, 'source', changed)
+            self.assertEqual(
+                revisions.compact(cursor,
+                                  self.user_id,
+                                  'source',
+                                  max_revisions=1), 1)
+        self.conn.commit()
+        refs = self.refs()
+        self.assertEqual(refs[self.hashes[1]], 1)  # Only the copy's.
+        self.assertEqual(refs[self.hashes[0]], 2)
+        self.assertEqual(refs[self.hashes[2]], 2)
+        with self.conn.cursor() as cursor:
+            revisions.remove_references(cursor, {self.hashes[1]: 1})
+        self.conn.commit()
+        self.assertNotIn(self.hashes[1], self.refs())
+
+    def test_delete_history(self):
+        with self.conn.cursor() as cursor:
+            self.assertEqual(
+                revisions.delete_history(cursor, self.user_id, 'copy'), 1)
+            self.assertIsNone(
+                revisions.latest_revision(cursor, self.user_id, 'copy'))
+        self.conn.commit()
+        self.assertEqual(self.refs(), {value: 1 for value in self.hashes})
+        with self.conn.cursor() as cursor:
+            self.assertEqual(revisions.delete_history(cursor, self.user_id), 1)
+        self.conn.commit()
+        self.assertEqual(self.refs(), {})
+
+
+if __name__ == '__main__':
+    absltest.main()
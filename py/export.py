@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Flattens Datasets into tables for analysis, as CSV or Parquet.
+
+There is one row per compound: each input component and each outcome product.
+Reaction-level values (conditions, and for products the outcome's reaction
+time and conversion) are repeated on every row of the reaction; see COLUMNS.
+
+Reactions are flattened in batches of BATCH_SIZE, each into one list per
+column, and every batch is written out as a Parquet row group (or a block of
+CSV lines) before the next is kept. With an executor, batches are flattened in
+worker processes with at most a few in flight, so memory stays bounded. The
+server uses its compute pool (see compute.Executor) and passes the stored bytes
+of each Reaction to flatten_serialized(), so a Dataset is not parsed whole.
+
+To export a dataset file:
+
+    $ ./py/export.py --input=dataset.pb --output=dataset.parquet
+
+Parquet output requires pyarrow.
+"""
+
+import collections
+import concurrent.futures
+import csv
+import io
+import itertools
+import os
+
+from absl import app
+from absl import flags
+
+from ord_schema import message_helpers
+from ord_schema.proto import dataset_pb2
+from ord_schema.proto import reaction_pb2
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FLAGS = flags.FLAGS
+
+# Reactions per batch, and so per Parquet row group.
+BATCH_SIZE = 1000
+# Datasets with fewer reactions are flattened in the calling process.
+POOL_THRESHOLD = 5000
+
+# (name, type) of each output column, in order.
+COLUMNS = (
+    ('dataset', 'string'),
+    ('reaction_index', 'int'),
+    ('reaction_id', 'string'),
+    ('kind', 'string'),  # "input" or "product".
+    ('input_key', 'string'),
+    ('addition_order', 'int'),
+    ('outcome_index', 'int'),
+    ('component_index', 'int'),
+    ('reaction_role', 'string'),
+    ('smiles', 'string'),
+    ('name', 'string'),
+    ('amount_kind', 'string'),  # "mass", "moles", "volume", or "unmeasured".
+    ('amount_value', 'float'),
+    ('amount_units', 'string'),
+    ('temperature_value', 'float'),
+    ('temperature_units', 'string'),
+    ('pressure_value', 'float'),
+    ('pressure_units', 'string'),
+    ('reaction_time_value', 'float'),
+    ('reaction_time_units', 'string'),
+    ('conversion_percent', 'float'),
+    ('is_desired_product', 'bool'),
+    ('yield_percent', 'float'),
+)
+COLUMN_NAMES = tuple(name for name, _ in COLUMNS)
+
+MIMETYPES = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+_ROLES = reaction_pb2.ReactionRole.ReactionRoleType
+_YIELD = reaction_pb2.ProductMeasurement.YIELD
+_SMILES = reaction_pb2.CompoundIdentifier.SMILES
+_NAME = reaction_pb2.CompoundIdentifier.NAME
+
+
+def _float(value):
+    """Drops the noise from widening a proto float to a Python float."""
+    return float(f'{value:.7g}')
+
+
+def _identifier(compound, identifier_type):
+    for identifier in compound.identifiers:
+        if identifier.type == identifier_type:
+            return identifier.value
+    return None
+
+
+def _measurement(message, field):
+    """Returns (value, units name) of an optional value/units submessage."""
+    if not message.HasField(field):
+        return None, None
+    value = getattr(message, field)
+    units = value.DESCRIPTOR.fields_by_name['units'].enum_type
+    return (_float(value.value) if value.HasField('value') else None,
+            units.values_by_number[value.units].name)
+
+
+def _amount(compound):
+    kind = compound.amount.WhichOneof('kind')
+    if kind is None:
+        return None, None, None
+    if kind == 'unmeasured':
+        units = reaction_pb2.UnmeasuredAmount.UnmeasuredAmountType.Name(
+            compound.amount.unmeasured.type)
+        return kind, None, units
+    return (kind, *_measurement(compound.amount, kind))
+
+
+def _yield(product):
+    for measurement in product.measurements:
+        if (measurement.type == _YIELD and
+                measurement.WhichOneof('value') == 'percentage'):
+            return _float(measurement.percentage.value)
+    return None
+
+
+def _input_rows(reaction):
+    """Yields a partial row for each input component of a Reaction."""
+    for key in sorted(reaction.inputs):
+        reaction_input = reaction.inputs[key]
+        for index, component in enumerate(reaction_input.components):
+            amount_kind, amount_value, amount_units = _amount(component)
+            yield {
+                'kind': 'input',
+                'input_key': key,
+                'addition_order': reaction_input.addition_order or None,
+                'component_index': index,
+                'reaction_role': _ROLES.Name(component.reaction_role),
+                'smiles': _identifier(component, _SMILES),
+                'name': _identifier(component, _NAME),
+                'amount_kind': amount_kind,
+                'amount_value': amount_value,
+                'amount_units': amount_units,
+            }
+
+
+def _product_rows(reaction):
+    """Yields a partial row for each outcome product of a Reaction."""
+    for outcome_index, outcome in enumerate(reaction.outcomes):
+        time_value, time_units = _measurement(outcome, 'reaction_time')
+        conversion = (_float(outcome.conversion.value)
+                      if outcome.HasField('conversion') else None)
+        for index, product in enumerate(outcome.products):
+            yield {
+                'kind': 'product',
+                'outcome_index': outcome_index,
+                'component_index': index,
+                'reaction_role': _ROLES.Name(product.reaction_role),
+                'smiles': _identifier(product, _SMILES),
+                'name': _identifier(product, _NAME),
+                'reaction_time_value': time_value,
+                'reaction_time_units': time_units,
+                'conversion_percent': conversion,
+                'is_desired_product':
+                    (product.is_desired_product
+                     if product.HasField('is_desired_product') else None),
+                'yield_percent': _yield(product),
+            }
+
+
+def flatten_reaction(reaction, dataset_name, reaction_index, columns):
+    """Appends the rows for one Reaction to a dict of column lists."""
+    conditions = reaction.conditions
+    temperature = _measurement(conditions.temperature, 'setpoint')
+    pressure = _measurement(conditions.pressure, 'setpoint')
+    shared = {
+        'dataset': dataset_name,
+        'reaction_index': reaction_index,
+        'reaction_id': reaction.reaction_id or None,
+        'temperature_value': temperature[0],
+        'temperature_units': temperature[1],
+        'pressure_value': pressure[0],
+        'pressure_units': pressure[1],
+    }
+    for row in itertools.chain(_input_rows(reaction), _product_rows(reaction)):
+        row.update(shared)
+        for name in COLUMN_NAMES:
+            columns[name].append(row.get(name))
+
+
+def flatten_batch(task):
+    """Flattens serialized Reactions; may run in a worker process.
+
+    Args:
+        task: (dataset name, index of the first reaction, list of serialized
+            Reactions) tuple.
+
+    Returns:
+        Dict mapping each column name to a list of values.
+    """
+    dataset_name, start, reactions = task
+    columns = {name: [] for name in COLUMN_NAMES}
+    for offset, serialized in enumerate(reactions):
+        flatten_reaction(reaction_pb2.Reaction.FromString(serialized),
+                         dataset_name, start + offset, columns)
+    return columns
+
+
+def flatten_serialized(dataset_name,
+                       reactions,
+                       batch_size=BATCH_SIZE,
+                       executor=None):
+    """Yields column dicts for consecutive batches of serialized Reactions.
+
+    Args:
+        dataset_name: String for the dataset column.
+        reactions: Iterable of serialized Reactions, in order.
+        batch_size: Integer number of reactions per batch.
+        executor: Optional concurrent.futures.Executor. Batches are yielded in
+            order, with at most twice its worker count in flight.
+    """
+
+    def tasks():
+        iterator = iter(reactions)
+        for start in itertools.count(0, batch_size):
+            batch = list(itertools.islice(iterator, batch_size))
+            if not batch:
+                return
+            yield dataset_name, start, batch
+
+    if executor is None:
+        yield from map(flatten_batch, tasks())
+        return
+    # pylint: disable-next=protected-access
+    window = 2 * getattr(executor, '_max_workers', 1)
+    pending = collections.deque()
+    for task in tasks():
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(flatten_batch, task))
+    while pending:
+        yield pending.popleft().result()
+
+
+def flatten(dataset, batch_size=BATCH_SIZE, executor=None):
+    """Yields column dicts for consecutive batches of a Dataset's reactions.
+
+    See flatten_serialized().
+    """
+    return flatten_serialized(
+        dataset.name,
+        (reaction.SerializeToString() for reaction in dataset.reactions),
+        batch_size=batch_size,
+        executor=executor)
+
+
+def write_csv(batches):
+    """Yields CSV bytes for an iterable of column dicts, header first."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMN_NAMES)
+    for columns in batches:
+        writer.writerows(zip(*(columns[name] for name in COLUMN_NAMES)))
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+class _Sink(io.RawIOBase):
+    """A write-only file whose contents are handed off as they arrive."""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        self.position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def arrow_schema():
+    """Returns the pyarrow schema for COLUMNS."""
+    types = {
+        'string': pyarrow.string(),
+        'int': pyarrow.int64(),
+        'float': pyarrow.float64(),
+        'bool': pyarrow.bool_(),
+    }
+    return pyarrow.schema([(name, types[kind]) for name, kind in COLUMNS])
+
+
+def write_parquet(batches):
+    """Yields Parquet bytes for an iterable of column dicts.
+
+    Each batch becomes one row group and is yielded as soon as it is written.
+
+    Raises:
+        RuntimeError: pyarrow is not installed.
+    """
+    if pyarrow is None:
+        raise RuntimeError('Parquet export requires pyarrow')
+    schema = arrow_schema()
+    sink = _Sink()
+    with pyarrow.parquet.ParquetWriter(sink, schema) as writer:
+        for columns in batches:
+            writer.write_table(pyarrow.Table.from_pydict(columns,
+                                                         schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def write(batches, kind):
+    """Yields column dicts as CSV or Parquet bytes.
+
+    Args:
+        batches: Iterable of column dicts, e.g. from flatten().
+        kind: "csv" or "parquet".
+    """
+    if kind == 'csv':
+        return write_csv(batches)
+    if kind == 'parquet':
+        return write_parquet(batches)
+    raise ValueError(f'unsupported format: {kind}')
+
+
+def stream(dataset, kind, batch_size=BATCH_SIZE, executor=None):
+    """Yields a Dataset as CSV or Parquet bytes.
+
+    Args:
+        dataset: Dataset.
+        kind: "csv" or "parquet".
+        batch_size: Integer number of reactions per batch.
+        executor: Optional executor for flattening; see flatten().
+    """
+    return write(flatten(dataset, batch_size=batch_size, executor=executor),
+                 kind)
+
+
+def main(argv):
+    del argv  # Only used by app.run().
+    kind = FLAGS.format or os.path.splitext(FLAGS.output)[1].lstrip('.')
+    dataset = message_helpers.load_message(FLAGS.input, dataset_pb2.Dataset)
+    with concurrent.futures.ProcessPoolExecutor(FLAGS.processes) as executor:
+        with open(FLAGS.output, 'wb') as f:
+            for chunk in stream(dataset,
+                                kind,
+                                batch_size=FLAGS.batch_size,
+                                executor=executor):
+                f.write(chunk)
+
+
+if __name__ == '__main__':
+    # Flags are defined here because serve.py imports this module.
+    flags.DEFINE_string('input', None, 'Dataset file (.pb or .pbtxt).')
+    flags.DEFINE_string('output', None, 'Output file.')
+    flags.DEFINE_enum('format', None, ['csv', 'parquet'],
+                      'Output format; defaults to the output file suffix.')
+    flags.DEFINE_integer('processes', os.cpu_count(),
+                         'Number of worker processes.')
+    flags.DEFINE_integer('batch_size', BATCH_SIZE, 'Reactions per batch.')
+    flags.mark_flags_as_required(['input', 'output'])
+    app.run(main)
@@ -0,0 +1,98 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for editor.py.export."""
+
+import concurrent.futures
+import csv
+import io
+import os
+
+from absl.testing import absltest
+
+from ord_schema import message_helpers
+from ord_schema.proto import dataset_pb2
+
+import compute  # pylint: disable=import-error
+import export  # pylint: disable=import-error
+
+
+class ExportTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dataset = message_helpers.load_message(
+            os.path.join(os.path.dirname(__file__), 'testdata',
+                         'nielsen_fig1_dataset.pbtxt'), dataset_pb2.Dataset)
+        self.num_rows = sum(
+            sum(len(value.components)
+                for value in reaction.inputs.values()) +
+            sum(len(outcome.products)
+                for outcome in reaction.outcomes)
+            for reaction in self.dataset.reactions)
+
+    def test_flatten(self):
+        batches = list(export.flatten(self.dataset, batch_size=7))
+        self.assertLen(batches, -(-len(self.dataset.reactions) // 7))
+        columns = {
+            name: sum((batch[name] for batch in batches), [])
+            for name in export.COLUMN_NAMES
+        }
+        self.assertLen(columns['kind'], self.num_rows)
+        self.assertEqual(columns['reaction_index'][0], 0)
+        self.assertEqual(columns['reaction_index'][-1],
+                         len(self.dataset.reactions) - 1)
+        self.assertEqual(set(columns['kind']), {'input', 'product'})
+
+    def test_flatten_in_pool(self):
+        with concurrent.futures.ProcessPoolExecutor(2) as executor:
+            pooled = list(
+                export.flatten(self.dataset, batch_size=5, executor=executor))
+        self.assertEqual(pooled, list(export.flatten(self.dataset,
+                                                     batch_size=5)))
+
+    def test_flatten_serialized(self):
+        reactions = [
+            reaction.SerializeToString() for reaction in self.dataset.reactions
+        ]
+        self.assertEqual(
+            list(
+                export.flatten_serialized(self.dataset.name,
+                                          reactions,
+                                          batch_size=5,
+                                          executor=compute.Executor())),
+            list(export.flatten(self.dataset, batch_size=5)))
+
+    def test_csv(self):
+        data = b''.join(export.stream(self.dataset, 'csv', batch_size=10))
+        rows = list(csv.reader(io.StringIO(data.decode())))
+        self.assertEqual(tuple(rows[0]), export.COLUMN_NAMES)
+        self.assertLen(rows, self.num_rows + 1)
+
+    @absltest.skipIf(export.pyarrow is None, 'requires pyarrow')
+    def test_parquet(self):
+        data = b''.join(export.stream(self.dataset, 'parquet', batch_size=10))
+        parquet = export.pyarrow.parquet.ParquetFile(
+            export.pyarrow.BufferReader(data))
+        self.assertEqual(parquet.schema_arrow, export.arrow_schema())
+        self.assertEqual(parquet.metadata.num_rows, self.num_rows)
+        self.assertEqual(parquet.num_row_groups,
+                         -(-len(self.dataset.reactions) // 10))
+
+    def test_unsupported(self):
+        with self.assertRaisesRegex(ValueError, 'unsupported'):
+            export.stream(self.dataset, 'xlsx')
+
+
+if __name__ == '__main__':
+    absltest.main()
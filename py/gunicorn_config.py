@@ -0,0 +1,54 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Gunicorn server hooks for the editor; see the Dockerfile."""
+
+import os
+import shutil
+import time
+
+from prometheus_client import multiprocess
+
+# Import the app once in the master and warm it (see serve.warm) before forking
+# workers. Set ORD_EDITOR_PRELOAD=0 to import it in each worker instead, e.g.
+# to pick up code changes on a HUP.
+preload_app = os.getenv('ORD_EDITOR_PRELOAD', '1') == '1'
+
+if preload_app and os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+    # The preloaded app registers its metrics before on_starting() runs.
+    os.makedirs(os.getenv('PROMETHEUS_MULTIPROC_DIR'), exist_ok=True)
+
+
+def on_starting(server):
+    """Clears metrics left over from previous runs of the server."""
+    del server  # Unused.
+    path = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+
+def when_ready(server):
+    """Warms the preloaded app before the first workers are forked."""
+    if server.cfg.preload_app:
+        import serve  # pylint: disable=import-error,import-outside-toplevel
+        start = time.perf_counter()
+        serve.warm()
+        server.log.info('Warmed the app in %.2fs', time.perf_counter() - start)
+
+
+def child_exit(server, worker):
+    """Retires the metrics files of a worker that has exited."""
+    del server  # Unused.
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,277 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Incremental validation of a Reaction as it is edited.
+
+The output of validations.validate_message() for a message is the output for
+each of its submessages, in field order, followed by the message's own checks.
+A Session keeps the output of every submessage of the last Reaction it saw,
+keyed by the submessage's position and a digest of its serialization. After
+an edit only the submessages whose serialization changed--the edited ones and
+their ancestors--are checked again. Every other submessage is serialized to
+compute its digest but not validated, so the cost of a check scales with the
+edit rather than the reaction.
+
+Edits arrive as updates keyed by field path:
+
+    ''               the whole Reaction;
+    'setup'          a singular message field of the Reaction;
+    'workups[2]'     an element of a repeated field (an index equal to the
+                     length appends);
+    'inputs["A"]'    a map entry.
+
+An update value of None clears the field or removes the element. Results are
+reported for submessages at any depth, keyed by paths in the same syntax, with
+errors relative to the submessage as in serve.validate_reaction().
+"""
+
+import collections
+import hashlib
+import re
+
+from google.protobuf import message as message_lib
+
+from ord_schema.proto import reaction_pb2
+
+# Validation output of a message and its submessages: (errors, warnings)
+# lists, plus the keys of its message-valued children.
+Node = collections.namedtuple('Node', ['errors', 'warnings', 'children'])
+
+PATH_PATTERN = re.compile(r'(\w+)(?:\[(\d+)\]|\["(.*)"\])?', re.DOTALL)
+
+ROOT = ('Reaction',)
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def message_name(message):
+    """Returns the name of a message type relative to its package."""
+    descriptor = message.DESCRIPTOR
+    return descriptor.full_name[len(descriptor.file.package) + 1:]
+
+
+def submessages(message, trace):
+    """Yields (trace, submessage) in the order validate_message() visits them.
+
+    Traces are built the same way as in validations._validate_message(), so
+    that error locations match those of a full validation.
+    """
+    for field, value in message.ListFields():
+        if field.type != field.TYPE_MESSAGE:
+            continue
+        if field.label != field.LABEL_REPEATED:
+            yield trace + (field.name,), value
+        elif field.message_type.GetOptions().map_entry:
+            if (field.message_type.fields_by_name['value'].type ==
+                    field.TYPE_MESSAGE):
+                for key, submessage in value.items():
+                    yield trace + (f'{field.name}["{key}"]',), submessage
+        else:
+            for index, submessage in enumerate(value):
+                yield trace + (f'{field.name}[{index}]',), submessage
+
+
+def _update_order(path):
+    # The whole Reaction first, then appends in index order.
+    if not path:
+        return ('', -1, '')
+    match = PATH_PATTERN.fullmatch(path)
+    if match is None:
+        raise ValueError(f'invalid path: {path!r}')
+    name, index, key = match.groups()
+    return (name, -1 if index is None else int(index), key or '')
+
+
+def apply_updates(reaction, updates):
+    """Applies path-keyed updates to a Reaction in place.
+
+    Args:
+        reaction: Reaction to modify.
+        updates: Dict mapping paths (see the module docstring) to serialized
+            messages, or to None to clear them.
+
+    Raises:
+        ValueError: A path or message is invalid.
+    """
+    removals = []
+    for path in sorted(updates, key=_update_order):
+        data = updates[path]
+        try:
+            if path:
+                _apply_update(reaction, path, data, removals)
+            else:
+                reaction.Clear()
+                if data is not None:
+                    reaction.MergeFromString(data)
+        except message_lib.DecodeError as error:
+            raise ValueError(
+                f'invalid message for {path!r}: {error}') from error
+    for name, index in sorted(removals, reverse=True):
+        container = getattr(reaction, name)
+        if index < len(container):
+            del container[index]
+
+
+def _apply_update(reaction, path, data, removals):
+    """Applies an update below the root; see apply_updates().
+
+    Removals from repeated fields are appended to removals as (name, index)
+    tuples instead, since they shift the indices of later updates.
+    """
+    name, index, key = PATH_PATTERN.fullmatch(path).groups()
+    field = reaction.DESCRIPTOR.fields_by_name.get(name)
+    if field is None or field.type != field.TYPE_MESSAGE:
+        raise ValueError(f'not a message field: {name}')
+    is_map = field.message_type.GetOptions().map_entry
+    is_repeated = field.label == field.LABEL_REPEATED and not is_map
+    if (index is not None) != is_repeated or (key is not None) != is_map:
+        raise ValueError(f'invalid path for {name}: {path!r}')
+    if is_map:
+        container = getattr(reaction, name)
+        if data is None:
+            container.pop(key, None)
+        else:
+            container[key].Clear()
+            container[key].MergeFromString(data)
+    elif is_repeated:
+        container = getattr(reaction, name)
+        index = int(index)
+        if data is None:
+            removals.append((name, index))
+        elif index < len(container):
+            container[index].Clear()
+            container[index].MergeFromString(data)
+        elif index == len(container):
+            container.add().MergeFromString(data)
+        else:
+            raise ValueError(f'index out of range: {path!r}')
+    else:
+        reaction.ClearField(name)
+        if data is not None:
+            submessage = getattr(reaction, name)
+            submessage.MergeFromString(data)
+            submessage.SetInParent()
+
+
+def relative(error, trace):
+    """Rewrites an error relative to the message at trace."""
+    prefix = '.'.join(trace)
+    location, _, text = error.partition(':')
+    location = location.strip()
+    if location == prefix:
+        return text.strip()
+    if location.startswith(prefix + '.'):
+        return f'{location[len(prefix) + 1:]}: {text.strip()}'
+    return error
+
+
+class Session:
+    """The last validated Reaction of one editor, and its validation outputs.
+
+    Not thread-safe; each connection should own a Session.
+    """
+
+    def __init__(self):
+        self.reaction = reaction_pb2.Reaction()
+        # Maps (trace, digest) keys to Nodes of the last validated Reaction.
+        self._nodes = {}
+        # Maps reported paths to the keys whose output was reported.
+        self._reported = {}
+        # Number of messages checked by the last validate().
+        self.num_checked = 0
+
+    def update(self, updates):
+        """Applies updates (see apply_updates) atomically."""
+        reaction = reaction_pb2.Reaction()
+        reaction.CopyFrom(self.reaction)
+        apply_updates(reaction, updates)
+        self.reaction = reaction
+
+    def _plan(self, message, trace, misses):
+        """Returns the key of a message, queueing uncached messages.
+
+        Misses are queued after their children, so they can be assembled in
+        order.
+        """
+        data = message.SerializeToString(deterministic=True)
+        key = (trace, _digest(data))
+        if key in self._nodes:
+            return key
+        children = [
+            self._plan(submessage, subtrace, misses)
+            for subtrace, submessage in submessages(message, trace)
+        ]
+        misses.append((key, message_name(message), data, children))
+        return key
+
+    def _collect(self, key, nodes):
+        nodes[key] = self._nodes[key]
+        for child in nodes[key].children:
+            self._collect(child, nodes)
+
+    def validate(self, check):
+        """Validates the current Reaction.
+
+        Args:
+            check: Function taking a list of (message name, serialized message,
+                trace) tuples and returning a list of (errors, warnings) tuples
+                for the own checks of each message; see compute.check_messages.
+
+        Returns:
+            Dict mapping the path of every submessage whose output changed
+            since the last call to {'errors': [...], 'warnings': [...]}, or to
+            None if the submessage no longer exists.
+        """
+        misses = []
+        root = self._plan(self.reaction, ROOT, misses)
+        self.num_checked = len(misses)
+        if misses:
+            outputs = check([
+                (name, data, key[0]) for key, name, data, _ in misses
+            ])
+            for (key, _, _, children), (errors,
+                                        warnings) in zip(misses, outputs):
+                node = Node([], [], children)
+                for child in children:
+                    node.errors.extend(self._nodes[child].errors)
+                    node.warnings.extend(self._nodes[child].warnings)
+                node.errors.extend(errors)
+                node.warnings.extend(warnings)
+                self._nodes[key] = node
+        # Keep only the nodes of the current Reaction.
+        nodes = {}
+        self._collect(root, nodes)
+        self._nodes = nodes
+        return self._report()
+
+    def _report(self):
+        reported = {}
+        results = {}
+        for key, node in self._nodes.items():
+            trace = key[0]
+            path = '.'.join(trace[1:])
+            reported[path] = key
+            if self._reported.get(path) != key:
+                results[path] = {
+                    'errors': [relative(error, trace) for error in node.errors],
+                    'warnings': [
+                        relative(warning, trace) for warning in node.warnings
+                    ],
+                }
+        for path in self._reported:
+            if path not in reported:
+                results[path] = None
+        self._reported = reported
+        return results
@@ -0,0 +1,148 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for editor.py.incremental_validation."""
+
+import os
+
+from absl.testing import absltest
+from google.protobuf import text_format
+
+from ord_schema import validations
+from ord_schema.proto import dataset_pb2
+from ord_schema.proto import reaction_pb2
+
+import compute  # pylint: disable=import-error
+import incremental_validation  # pylint: disable=import-error
+
+TESTDATA = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'testdata')
+
+
+def full_validation(reaction):
+    """Returns serve.validate_reaction()-style output for a whole Reaction."""
+    output = validations.validate_message(
+        reaction_pb2.Reaction.FromString(reaction.SerializeToString()),
+        raise_on_error=False,
+        options=validations.ValidationOptions(require_provenance=True))
+    return {
+        'errors': [
+            incremental_validation.relative(error, ('Reaction',))
+            for error in output.errors
+        ],
+        'warnings': [
+            incremental_validation.relative(warning, ('Reaction',))
+            for warning in output.warnings
+        ],
+    }
+
+
+class SessionTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        with open(os.path.join(TESTDATA, 'nielsen_fig1_dataset.pbtxt')) as f:
+            dataset = text_format.Parse(f.read(), dataset_pb2.Dataset())
+        self.reaction = dataset.reactions[0]
+        self.session = incremental_validation.Session()
+        self.session.update({'': self.reaction.SerializeToString()})
+        self.results = self.session.validate(compute.check_messages)
+
+    def test_initial(self):
+        self.assertEqual(self.results[''], full_validation(self.reaction))
+        self.assertLen(self.results, self.session.num_checked)
+        self.assertEqual(self.session.validate(compute.check_messages), {})
+        self.assertEqual(self.session.num_checked, 0)
+
+    def test_edit(self):
+        name = next(iter(self.reaction.inputs))
+        reaction_input = reaction_pb2.ReactionInput()
+        reaction_input.CopyFrom(self.reaction.inputs[name])
+        reaction_input.components[0].amount.mass.value = -1
+        self.session.update(
+            {f'inputs["{name}"]': reaction_input.SerializeToString()})
+        results = self.session.validate(compute.check_messages)
+        self.reaction.inputs[name].CopyFrom(reaction_input)
+        self.assertEqual(results[''], full_validation(self.reaction))
+        # The input, its component, and the amount; the mass; the Reaction.
+        self.assertEqual(self.session.num_checked, 5)
+        self.assertIn(
+            'must be non-negative',
+            results[f'inputs["{name}"].components[0].amount.mass']['errors']
+            [-1])
+        self.assertNotIn('provenance', results)
+
+    def test_remove(self):
+        self.session.update({'provenance': None, 'outcomes[0]': None})
+        results = self.session.validate(compute.check_messages)
+        self.reaction.ClearField('provenance')
+        del self.reaction.outcomes[0]
+        self.assertEqual(results[''], full_validation(self.reaction))
+        self.assertEqual(self.session.num_checked, 1)
+        self.assertIn('Reaction requires provenance', results['']['errors'])
+        self.assertIsNone(results['provenance'])
+        self.assertIsNone(results['outcomes[0]'])
+
+    def test_invalid_update(self):
+        before = self.session.reaction.SerializeToString()
+        for updates in [{
+                'reaction_id': b''
+        }, {
+                'inputs': b''
+        }, {
+                'setup[0]': b''
+        }, {
+                'workups[9]': b''
+        }, {
+                'not a path': b''
+        }, {
+                'setup': b'\xff'
+        }]:
+            with self.assertRaises(ValueError):
+                self.session.update(updates)
+        self.assertEqual(self.session.reaction.SerializeToString(), before)
+
+
+class ApplyUpdatesTest(absltest.TestCase):
+
+    def test_apply_updates(self):
+        reaction = reaction_pb2.Reaction()
+        workup = reaction_pb2.ReactionWorkup(details='first')
+        reaction_input = reaction_pb2.ReactionInput(addition_order=1)
+        incremental_validation.apply_updates(
+            reaction, {
+                'workups[1]':
+                    reaction_pb2.ReactionWorkup(details='second'
+                                               ).SerializeToString(),
+                'workups[0]':
+                    workup.SerializeToString(),
+                'inputs["a"]':
+                    reaction_input.SerializeToString(),
+                'setup':
+                    b'',
+            })
+        self.assertEqual([w.details for w in reaction.workups],
+                         ['first', 'second'])
+        self.assertEqual(reaction.inputs['a'], reaction_input)
+        self.assertTrue(reaction.HasField('setup'))
+        incremental_validation.apply_updates(reaction, {
+            'workups[0]': None,
+            'inputs["a"]': None,
+            'setup': None
+        })
+        self.assertEqual([w.details for w in reaction.workups], ['second'])
+        self.assertEmpty(reaction.inputs)
+        self.assertFalse(reaction.HasField('setup'))
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Microbenchmark for the per-request authentication overhead in init_user.
+
+Compares init_user() with the session cache disabled (every request queries
+Postgres) and enabled (only the first request queries Postgres). Requires a
+database initialized with py/schema.py:
+
+    $ export POSTGRES_PASSWORD=########
+    $ PYTHONPATH=py python py/init_user_benchmark.py --iterations=1000
+"""
+
+import re
+import statistics
+import time
+
+from absl import app
+from absl import flags
+
+import serve  # pylint: disable=import-error
+import sessions  # pylint: disable=import-error
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('iterations', 1000, 'Number of init_user() calls.')
+
+
+def time_init_user(access_token, iterations):
+    """Returns a list of init_user() durations in seconds."""
+    headers = {'Cookie': f'Access-Token={access_token}'}
+    durations = []
+    for _ in range(iterations):
+        with serve.app.test_request_context('/datasets', headers=headers):
+            start = time.perf_counter()
+            serve.init_user()
+            durations.append(time.perf_counter() - start)
+    return durations
+
+
+def report(label, durations):
+    """Prints summary statistics in microseconds."""
+    durations = sorted(durations)
+    p95 = durations[int(0.95 * (len(durations) - 1))]
+    print(f'{label:>10}: '
+          f'mean={1e6 * statistics.mean(durations):.0f}us '
+          f'median={1e6 * statistics.median(durations):.0f}us '
+          f'p95={1e6 * p95:.0f}us')
+
+
+def main(argv):
+    del argv  # Only used by app.run().
+    response = serve.app.test_client().get('/authenticate')
+    access_token = re.search('Access-Token=([0-9a-f]{32})',
+                             response.headers['Set-Cookie']).group(1)
+    ttl = sessions.SESSION_TTL
+    try:
+        sessions.SESSION_TTL = 0
+        sessions.invalidate(access_token=access_token)
+        report('uncached', time_init_user(access_token, FLAGS.iterations))
+    finally:
+        sessions.SESSION_TTL = ttl
+    report('cached', time_init_user(access_token, FLAGS.iterations))
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -0,0 +1,51 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Deferred imports for modules that only a few routes need.
+
+    github = lazy_import.Module('github')
+
+binds a placeholder that imports the module on first attribute access, so a
+worker that never serves those routes never pays for the import. serve.warm()
+loads every placeholder up front when gunicorn preloads the app.
+"""
+
+import importlib
+import time
+
+# Maps module names to the seconds spent importing them in this process.
+load_seconds = {}
+
+
+class Module:
+    """Stands in for a module until one of its attributes is used."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def load(self):
+        """Imports the module if necessary and returns it."""
+        if self._module is None:
+            start = time.perf_counter()
+            module = importlib.import_module(self._name)
+            load_seconds[self._name] = time.perf_counter() - start
+            self._module = module
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f'<lazy module {self._name!r} ({state})>'
@@ -0,0 +1,44 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for editor.py.lazy_import."""
+
+import sys
+
+from absl.testing import absltest
+
+import lazy_import  # pylint: disable=import-error
+
+
+class LazyImportTest(absltest.TestCase):
+
+    def test_module(self):
+        sys.modules.pop('colorsys', None)
+        module = lazy_import.Module('colorsys')
+        self.assertNotIn('colorsys', sys.modules)
+        self.assertIn('not loaded', repr(module))
+        self.assertEqual(module.rgb_to_hsv(1.0, 0.0, 0.0), (0.0, 1.0, 1.0))
+        self.assertIn('colorsys', sys.modules)
+        self.assertIn('colorsys', lazy_import.load_seconds)
+        self.assertIs(module.load(), sys.modules['colorsys'])
+
+    def test_missing(self):
+        module = lazy_import.Module('no_such_module_for_testing')
+        with self.assertRaises(ImportError):
+            module.load()
+        with self.assertRaises(ImportError):
+            getattr(module, 'value')
+
+
+if __name__ == '__main__':
+    absltest.main()
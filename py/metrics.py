@@ -0,0 +1,147 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Prometheus metrics for the editor.
+
+Under gunicorn, set PROMETHEUS_MULTIPROC_DIR so that each worker writes its
+samples to shared files and /metrics reports totals across all workers; see
+gunicorn_config.py. Without it, metrics cover the current process only.
+"""
+
+import os
+import re
+import time
+
+import flask
+import prometheus_client
+from prometheus_client import multiprocess
+import psycopg2.extensions
+import psycopg2.sql
+
+# Bucket upper bounds for payload sizes, 1kB to 1GB.
+BYTES_BUCKETS = tuple(4**i * 1024 for i in range(11))
+# Bucket upper bounds for reaction counts.
+COUNT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+REQUEST_SECONDS = prometheus_client.Histogram('editor_request_seconds',
+                                              'Request latency by route.',
+                                              ['endpoint', 'method', 'status'])
+QUERY_SECONDS = prometheus_client.Histogram(
+    'editor_query_seconds', 'Postgres statement latency by statement type.',
+    ['statement'])
+PROTO_SECONDS = prometheus_client.Histogram(
+    'editor_proto_seconds', 'Dataset proto parse and serialize time.',
+    ['operation'])
+PROTO_BYTES = prometheus_client.Histogram(
+    'editor_proto_bytes',
+    'Serialized Dataset sizes by operation.', ['operation'],
+    buckets=BYTES_BUCKETS)
+DATASET_REACTIONS = prometheus_client.Histogram(
+    'editor_dataset_reactions',
+    'Reactions per Dataset read or written.', ['operation'],
+    buckets=COUNT_BUCKETS)
+VALIDATION_SECONDS = prometheus_client.Histogram(
+    'editor_validation_seconds', 'Time spent in validate_message.')
+RENDER_SECONDS = prometheus_client.Histogram(
+    'editor_render_seconds', 'Time spent drawing molecules and reactions.',
+    ['kind'])
+ADMISSION_REJECTIONS = prometheus_client.Counter(
+    'editor_admission_rejections',
+    'Requests refused by admission control; see admission.py.',
+    ['endpoint_class', 'reason'])
+COMPUTE_FAILURES = prometheus_client.Counter(
+    'editor_compute_failures',
+    'Compute pool tasks refused or abandoned; see compute.py.',
+    ['task', 'reason'])
+VALIDATION_MESSAGES = prometheus_client.Histogram(
+    'editor_validation_messages',
+    'Messages checked per incremental validation; see '
+    'incremental_validation.py.',
+    buckets=COUNT_BUCKETS)
+COMPUTE_CACHE = prometheus_client.Counter(
+    'editor_compute_cache',
+    'Lookups in the compute result cache; see compute.run_cached().',
+    ['task', 'result'])
+REAPED = prometheus_client.Counter('editor_reaped',
+                                   'Rows and files deleted by reaper.py.',
+                                   ['kind'])
+
+# Matches the statement type and first table name of a query.
+STATEMENT = re.compile(r'\s*(\w+)\b(?:.*?\b(?:FROM|INTO|TABLE)\s+|\s+)(\w+)',
+                       re.IGNORECASE | re.DOTALL)
+
+
+def statement_label(query):
+    """Returns a low-cardinality label such as "SELECT datasets"."""
+    if isinstance(query, psycopg2.sql.SQL):
+        query = query.string
+    elif not isinstance(query, str):
+        query = str(query)
+    match = STATEMENT.match(query)
+    if match is None:
+        return query.split(None, 1)[0].upper() if query.strip() else ''
+    return f'{match.group(1).upper()} {match.group(2).lower()}'
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """A cursor that records the duration of every statement it executes."""
+
+    def execute(self, query, vars=None):  # pylint: disable=redefined-builtin
+        """Executes a statement and records its duration by statement_label."""
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            QUERY_SECONDS.labels(
+                statement_label(query)).observe(time.perf_counter() - start)
+
+
+def _start_timer():
+    flask.g.metrics_start = time.perf_counter()
+
+
+def _record_status(response):
+    flask.g.metrics_status = response.status_code
+    return response
+
+
+def _observe_request(exception):
+    start = flask.g.pop('metrics_start', None)
+    if start is None:
+        return
+    status = flask.g.pop('metrics_status', 500 if exception else 200)
+    REQUEST_SECONDS.labels(flask.request.endpoint or 'none',
+                           flask.request.method,
+                           str(status)).observe(time.perf_counter() - start)
+
+
+def init_app(app):
+    """Registers per-request timing hooks on a Flask app.
+
+    The timer starts before any other before_request function so that
+    authentication and database setup are included.
+    """
+    app.before_request_funcs.setdefault(None, []).insert(0, _start_timer)
+    app.after_request(_record_status)
+    app.teardown_request(_observe_request)
+
+
+def generate():
+    """Returns (body, content type) for the Prometheus text exposition."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return (prometheus_client.generate_latest(registry),
+            prometheus_client.CONTENT_TYPE_LATEST)
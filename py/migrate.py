@@ -12,51 +12,333 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-"""Slurp the local db/ directory contents into Postgres."""
+"""Bulk import and export between Postgres and a db/ directory.
 
+The directory layout is db/<user_id>/<name>.pbtxt (or .pb). Importing parses
+files in a process pool and loads them in batches with binary COPY. Datasets
+whose rows are newer than their files are skipped, so an interrupted import can
+simply be run again.
+
+To slurp the local db/ directory into Postgres:
+
+    $ ./py/migrate.py
+
+To write every dataset in Postgres back out as pbtxt files:
+
+    $ ./py/migrate.py --export=/path/to/backup --format=pbtxt
+"""
+
+import binascii
+import concurrent.futures
+import io
 import os
 import re
+import struct
 import sys
 import time
 
+from absl import app
+from absl import flags
 import psycopg2
+import psycopg2.extras
 import psycopg2.sql
 
 from ord_schema import message_helpers
 from ord_schema.proto import dataset_pb2
 
+import dataset_stats  # pylint: disable=import-error
+import reaction_index  # pylint: disable=import-error
+import revisions  # pylint: disable=import-error
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string('root', 'db', 'Directory of <user_id>/<name> files.')
+flags.DEFINE_string('export', None,
+                    'If set, export all datasets to this directory instead.')
+flags.DEFINE_enum('format', 'pbtxt', ['pb', 'pbtxt'], 'Export file format.')
+flags.DEFINE_string('host', os.getenv('POSTGRES_HOST', 'localhost'),
+                    'Postgres host.')
+flags.DEFINE_integer('port', int(os.getenv('POSTGRES_PORT', '5432')),
+                     'Postgres port.')
+flags.DEFINE_string('user', os.getenv('POSTGRES_USER', 'postgres'),
+                    'Postgres user.')
+flags.DEFINE_integer('processes', os.cpu_count(), 'Number of worker processes.')
+flags.DEFINE_integer('batch_size', 100, 'Datasets per COPY and commit.')
+flags.DEFINE_boolean(
+    'resume', True,
+    'If True, skip datasets whose rows are newer than their files.')
+
+USER_ID = re.compile('^[0-9a-fA-F]{32}$')
+# Columns loaded by COPY, in order.
+COLUMNS = ('user_id', 'name', 'serialized', 'reaction_offsets', 'size',
+           'num_reactions', 'updated_time', 'num_compounds', 'num_errors',
+           'yield_buckets')
+# See https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4.
+COPY_HEADER = b'PGCOPY\n\377\r\n\0' + struct.pack('!ii', 0, 0)
+COPY_TRAILER = struct.pack('!h', -1)
+# Type OID of INTEGER array elements in the binary COPY format.
+INT4_OID = 23
+
+
+class Progress:
+    """Periodically prints counts and throughput to stderr."""
+
+    # Seconds between reports.
+    INTERVAL = 5.0
+
+    def __init__(self, label, total=None):
+        self.label = label
+        self.total = total
+        self.count = 0
+        self.failures = 0
+        self.bytes = 0
+        self.start = time.time()
+        self._last_report = self.start
+
+    def update(self, nbytes=0, failed=False):
+        """Records one finished dataset."""
+        self.count += 1
+        self.bytes += nbytes
+        if failed:
+            self.failures += 1
+        now = time.time()
+        if now - self._last_report >= self.INTERVAL:
+            self._last_report = now
+            self.report()
+
+    def report(self):
+        """Prints the current state."""
+        elapsed = max(time.time() - self.start, 1e-9)
+        total = '' if self.total is None else f'/{self.total}'
+        print(
+            f'{self.label}: {self.count}{total} datasets '
+            f'({self.failures} failed) in {elapsed:.1f}s, '
+            f'{self.count / elapsed:.1f} datasets/s, '
+            f'{self.bytes / elapsed / 1e6:.1f} MB/s',
+            file=sys.stderr)
+
+
+def connect(dbname='editor'):
+    """Connects to Postgres using the command-line flags."""
+    return psycopg2.connect(dbname=dbname,
+                            host=FLAGS.host,
+                            port=FLAGS.port,
+                            user=FLAGS.user,
+                            password=os.getenv('POSTGRES_PASSWORD', ''))
+
+
+def bounded_map(executor, function, iterable, window):
+    """Like executor.map, but unordered and with at most `window` in flight.
+
+    This keeps memory bounded when the input is a large stream.
+    """
+    pending = set()
+    for item in iterable:
+        if len(pending) >= window:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        pending.add(executor.submit(function, item))
+    for future in concurrent.futures.as_completed(pending):
+        yield future.result()
+
+
+def find_datasets(root):
+    """Yields (user_id, name, path, mtime) for each dataset file under root."""
+    for user_id in sorted(os.listdir(root)):
+        if USER_ID.match(user_id) is None:
+            continue
+        for filename in sorted(os.listdir(os.path.join(root, user_id))):
+            for suffix in ('.pbtxt', '.pb'):
+                if filename.endswith(suffix):
+                    path = os.path.join(root, user_id, filename)
+                    yield (user_id, filename[:-len(suffix)], path,
+                           os.path.getmtime(path))
+                    break
 
-def migrate_one(user_id, name, conn):
-    """Slurp one named dataset from the db/ directory into Postgres."""
-    dataset = message_helpers.load_message(f'db/{user_id}/{name}',
-                                           dataset_pb2.Dataset)
-    serialized = dataset.SerializeToString().hex()
-    query = psycopg2.sql.SQL(
-        'INSERT INTO datasets VALUES (%s, %s, %s) '
-        'ON CONFLICT (user_id, name) DO UPDATE SET serialized=%s')
+
+def parse_dataset(task):
+    """Loads one dataset file; runs in a worker process.
+
+    Args:
+        task: (user_id, name, path, updated_time) tuple.
+
+    Returns:
+        A row of COLUMNS values, or (path, error message) on failure.
+    """
+    user_id, name, path, updated_time = task
+    try:
+        dataset = message_helpers.load_message(path, dataset_pb2.Dataset)
+    except Exception as error:  # pylint: disable=broad-except
+        return path, str(error)
+    serialized = dataset.SerializeToString(deterministic=True)
+    summary = dataset_stats.compute(dataset, len(serialized))
+    offsets = reaction_index.encode(reaction_index.scan(serialized))
+    return (user_id, name, serialized.hex().encode(), offsets, len(serialized),
+            len(dataset.reactions), updated_time, summary['num_compounds'],
+            summary['num_errors'], summary['yield_buckets'])
+
+
+def encode_copy(rows):
+    """Encodes rows of COLUMNS values in the binary COPY format."""
+    buffer = io.BytesIO()
+    buffer.write(COPY_HEADER)
+    for row in rows:
+        user_id, name, serialized, offsets = row[:4]
+        numbers, yield_buckets = row[4:-1], row[-1]
+        buffer.write(struct.pack('!h', len(COLUMNS)))
+        for text in (user_id.encode(), name.encode(), serialized, offsets):
+            buffer.write(struct.pack('!i', len(text)))
+            buffer.write(text)
+        for number in numbers:
+            buffer.write(struct.pack('!ii', 4, number))
+        # One dimension, no nulls, then (length, lower bound) and elements.
+        array = struct.pack('!iiiii', 1, 0, INT4_OID, len(yield_buckets), 1)
+        array += b''.join(
+            struct.pack('!ii', 4, count) for count in yield_buckets)
+        buffer.write(struct.pack('!i', len(array)))
+        buffer.write(array)
+    buffer.write(COPY_TRAILER)
+    buffer.seek(0)
+    return buffer
+
+
+def load_batch(conn, rows):
+    """COPYs rows into a staging table and upserts them into datasets."""
+    columns = psycopg2.sql.SQL(', ').join(map(psycopg2.sql.Identifier, COLUMNS))
     with conn.cursor() as cursor:
-        cursor.execute(query, [user_id, name[:-6], serialized, serialized])
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS staging '
+                       '(LIKE datasets INCLUDING DEFAULTS) '
+                       'ON COMMIT DELETE ROWS')
+        query = psycopg2.sql.SQL(
+            'COPY staging ({}) FROM STDIN WITH (FORMAT binary)').format(columns)
+        cursor.copy_expert(query.as_string(conn), encode_copy(rows))
+        query = psycopg2.sql.SQL(
+            'INSERT INTO datasets ({columns}) SELECT {columns} FROM staging '
+            'ON CONFLICT (user_id, name) DO UPDATE SET '
+            'serialized=EXCLUDED.serialized, '
+            'reaction_offsets=EXCLUDED.reaction_offsets, size=EXCLUDED.size, '
+            'num_reactions=EXCLUDED.num_reactions, '
+            'updated_time=EXCLUDED.updated_time, '
+            'num_compounds=EXCLUDED.num_compounds, '
+            'num_errors=EXCLUDED.num_errors, '
+            'yield_buckets=EXCLUDED.yield_buckets').format(columns=columns)
+        cursor.execute(query)
+        dataset_stats.refresh_users(cursor, sorted({row[0] for row in rows}))
+    conn.commit()
+
 
+def import_all(conn, root, processes, batch_size, resume):
+    """Loads every dataset file under root into Postgres.
 
-def migrate_all():
-    """Run as a script, copies the entire contents of the db/ directory."""
-    with psycopg2.connect(dbname='editor',
-                          host='localhost',
-                          port=5432,
-                          user='postgres') as conn:
-        for user_id in os.listdir('db'):
-            if re.match('^[0-9a-fA-F]{32}$', user_id) is None:
+    Returns:
+        The number of files that failed to parse.
+    """
+    tasks = list(find_datasets(root))
+    with conn.cursor() as cursor:
+        timestamp = int(time.time())
+        psycopg2.extras.execute_values(
+            cursor, 'INSERT INTO users (user_id, name, created_time) '
+            'VALUES %s ON CONFLICT DO NOTHING',
+            [(user_id, None, timestamp)
+             for user_id in sorted({task[0] for task in tasks})])
+        updated = {}
+        if resume:
+            cursor.execute('SELECT user_id, name, updated_time FROM datasets')
+            updated = {(row[0], row[1]): row[2] for row in cursor}
+    conn.commit()
+    tasks = [(user_id, name, path, timestamp)
+             for user_id, name, path, mtime in tasks
+             if updated.get((user_id, name), -1) < mtime]
+    progress = Progress('import', total=len(tasks))
+    batch = []
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        for result in bounded_map(executor, parse_dataset, tasks,
+                                  4 * processes):
+            if len(result) == 2:
+                print(f'failed to parse {result[0]}: {result[1]}',
+                      file=sys.stderr)
+                progress.update(failed=True)
                 continue
-            query = psycopg2.sql.SQL(
-                'INSERT INTO users VALUES (%s, %s, %s) ON CONFLICT DO NOTHING')
-            with conn.cursor() as cursor:
-                timestamp = int(time.time())
-                cursor.execute(query, [user_id, None, timestamp])
-            for name in os.listdir(f'db/{user_id}'):
-                if not name.endswith('.pbtxt'):
-                    continue
-                migrate_one(user_id, name, conn)
+            batch.append(result)
+            progress.update(nbytes=result[COLUMNS.index('size')])
+            if len(batch) >= batch_size:
+                load_batch(conn, batch)
+                batch = []
+    if batch:
+        load_batch(conn, batch)
+    progress.report()
+    return progress.failures
+
+
+def write_dataset(task):
+    """Writes one exported dataset file; runs in a worker process.
+
+    Args:
+        task: (path, hex-encoded serialized Dataset) tuple.
+
+    Returns:
+        Size in bytes of the serialized Dataset.
+    """
+    path, serialized = task
+    serialized = binascii.unhexlify(serialized)
+    if path.endswith('.pb'):
+        with open(path, 'wb') as f:
+            f.write(serialized)
+    else:
+        dataset = dataset_pb2.Dataset.FromString(serialized)
+        message_helpers.write_message(dataset, path)
+    return len(serialized)
+
+
+def export_all(conn, directory, kind, processes):
+    """Writes every dataset in Postgres to <directory>/<user_id>/<name>.<kind>.
+    """
+
+    def path(user_id, name):
+        os.makedirs(os.path.join(directory, user_id), exist_ok=True)
+        filename = f'{name.replace(os.sep, "_")}.{kind}'
+        return os.path.join(directory, user_id, filename)
+
+    def tasks():
+        # A named cursor streams rows from the server instead of loading them.
+        with conn.cursor(name='export') as cursor:
+            cursor.itersize = 100
+            cursor.execute('SELECT user_id, name, serialized FROM datasets '
+                           'WHERE serialized IS NOT NULL')
+            for user_id, name, serialized in cursor:
+                yield path(user_id, name), serialized.tobytes()
+        # Unwritten copies are rebuilt from their revision history.
+        with conn.cursor() as cursor:
+            cursor.execute(
+                'SELECT user_id, name FROM datasets WHERE serialized IS NULL')
+            for user_id, name in cursor.fetchall():
+                dataset = revisions.load(
+                    cursor, user_id, name,
+                    revisions.latest_revision(cursor, user_id, name))
+                yield (path(user_id, name),
+                       dataset.SerializeToString(deterministic=True).hex())
+
+    progress = Progress('export')
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        for size in bounded_map(executor, write_dataset, tasks(),
+                                4 * processes):
+            progress.update(nbytes=size)
+    progress.report()
+
+
+def main(argv):
+    del argv  # Only used by app.run().
+    conn = connect()
+    try:
+        if FLAGS.export:
+            export_all(conn, FLAGS.export, FLAGS.format, FLAGS.processes)
+        elif import_all(conn, FLAGS.root, FLAGS.processes, FLAGS.batch_size,
+                        FLAGS.resume):
+            sys.exit(1)
+    finally:
+        conn.close()
 
 
 if __name__ == '__main__':
-    sys.exit(migrate_all())
+    app.run(main)
@@ -0,0 +1,129 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for editor.py.migrate."""
+
+import os
+import shutil
+import struct
+import uuid
+
+from absl.testing import absltest
+import psycopg2
+
+from ord_schema.proto import dataset_pb2
+
+import dataset_stats  # pylint: disable=import-error
+import migrate  # pylint: disable=import-error
+import reaction_index  # pylint: disable=import-error
+
+
+class MigrateTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.root = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                 '../db')
+
+    def test_find_datasets(self):
+        found = list(migrate.find_datasets(self.root))
+        names = [name for _, name, _, _ in found]
+        self.assertIn('ord-nielsen-example', names)
+        self.assertTrue(all(len(user_id) == 32 for user_id, _, _, _ in found))
+
+    def test_parse_dataset(self):
+        user_id, name, path, _ = next(migrate.find_datasets(self.root))
+        row = migrate.parse_dataset((user_id, name, path, 123))
+        self.assertLen(row, len(migrate.COLUMNS))
+        serialized = bytes.fromhex(row[2].decode())
+        self.assertEqual(reaction_index.decode(row[3]),
+                         reaction_index.scan(serialized))
+        self.assertEqual(row[4], len(serialized))
+        dataset = dataset_pb2.Dataset.FromString(serialized)
+        self.assertLen(dataset.reactions, row[5])
+        self.assertEqual(row[6], 123)
+        self.assertLen(row[9], dataset_stats.NUM_BUCKETS)
+        self.assertEqual(sum(row[9]), row[5])
+
+    def test_parse_dataset_failure(self):
+        path = self.create_tempfile('bad.pbtxt',
+                                    content='not a dataset').full_path
+        result = migrate.parse_dataset(('0' * 32, 'bad', path, 0))
+        self.assertLen(result, 2)
+
+    def test_encode_copy(self):
+        rows = [('0' * 32, 'test', b'abcd', b'\0' * 8, 2, 1, 7, 3, 0, [1, 0])]
+        data = migrate.encode_copy(rows).read()
+        self.assertTrue(data.startswith(migrate.COPY_HEADER))
+        self.assertTrue(data.endswith(migrate.COPY_TRAILER))
+        body = data[len(migrate.COPY_HEADER):-len(migrate.COPY_TRAILER)]
+        self.assertEqual(struct.unpack('!h', body[:2])[0], 10)
+        self.assertLen(
+            body, 2 + (4 + 32) + (4 + 4) + (4 + 4) + (4 + 8) + 5 * 8 +
+            (4 + 20 + 2 * 8))
+
+
+class ImportTest(absltest.TestCase):
+    """Runs import_all() against the editor database, as in serve_test.py."""
+
+    def setUp(self):
+        super().setUp()
+        self.conn = psycopg2.connect(dbname='editor',
+                                     user=os.getenv('POSTGRES_USER',
+                                                    'postgres'),
+                                     password=os.getenv('POSTGRES_PASSWORD',
+                                                        ''),
+                                     host=os.getenv('POSTGRES_HOST',
+                                                    'localhost'),
+                                     port=int(os.getenv('POSTGRES_PORT',
+                                                        '5432')))
+        self.user_id = uuid.uuid4().hex
+        self.root = self.create_tempdir().full_path
+        os.mkdir(os.path.join(self.root, self.user_id))
+        source = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                              'testdata', 'nielsen_fig1_dataset.pbtxt')
+        shutil.copy(source,
+                    os.path.join(self.root, self.user_id, 'nielsen.pbtxt'))
+
+    def tearDown(self):
+        """Deletes the imported rows."""
+        self.conn.rollback()
+        with self.conn.cursor() as cursor:
+            cursor.execute('DELETE FROM datasets WHERE user_id=%s',
+                           [self.user_id])
+            cursor.execute('DELETE FROM users WHERE user_id=%s', [self.user_id])
+        self.conn.commit()
+        self.conn.close()
+        super().tearDown()
+
+    def test_import_all(self):
+        failures = migrate.import_all(self.conn,
+                                      self.root,
+                                      processes=1,
+                                      batch_size=1,
+                                      resume=False)
+        self.assertEqual(failures, 0)
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                'SELECT serialized, num_reactions FROM datasets '
+                'WHERE user_id=%s AND name=%s', [self.user_id, 'nielsen'])
+            serialized, num_reactions = cursor.fetchone()
+        self.conn.commit()
+        dataset = dataset_pb2.Dataset.FromString(
+            bytes.fromhex(serialized.tobytes().decode()))
+        self.assertLen(dataset.reactions, num_reactions)
+        self.assertNotEmpty(dataset.reactions)
+
+
+if __name__ == '__main__':
+    absltest.main()
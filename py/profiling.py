@@ -0,0 +1,206 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Opt-in sampling profiler for individual requests.
+
+A request is profiled if it is picked at random with probability
+ORD_EDITOR_PROFILE_SAMPLE_RATE, or if it carries the X-Ord-Profile header (or
+ord-profile cookie) and the authenticated user is listed in
+ORD_EDITOR_PROFILE_USERS. While a request runs, a background thread samples its
+stack every few milliseconds. Afterwards two files are written to
+ORD_EDITOR_PROFILE_DIR:
+
+    <id>.collapsed: one "frame;frame;frame count" line per distinct stack,
+        ready for flamegraph.pl or speedscope.
+    <id>.json: wall and CPU time, sample counts, and the hottest functions.
+
+The sampler backs off whenever the time spent sampling exceeds MAX_OVERHEAD of
+the request's wall time, and at most one request per process is profiled at a
+time. When neither variable is set, init_app() registers nothing.
+"""
+
+import collections
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+import flask
+
+PROFILE_DIR = os.getenv('ORD_EDITOR_PROFILE_DIR', '/tmp/ord-editor-profiles')
+SAMPLE_RATE = float(os.getenv('ORD_EDITOR_PROFILE_SAMPLE_RATE', '0'))
+PROFILE_USERS = frozenset(
+    filter(None,
+           os.getenv('ORD_EDITOR_PROFILE_USERS', '').split(',')))
+# Seconds between stack samples.
+INTERVAL = 0.005
+# Maximum fraction of a request's wall time that may be spent sampling.
+MAX_OVERHEAD = 0.05
+# Sampling stops after this many samples.
+MAX_SAMPLES = 5000
+# Functions listed in each summary.
+TOP_FUNCTIONS = 20
+
+# Guards against profiling concurrent requests in the same process.
+_active = threading.Lock()
+
+
+def collapse(frame):
+    """Returns a frame's stack as "outermost;...;innermost"."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} '
+                     f'({os.path.basename(code.co_filename)}:'
+                     f'{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler(threading.Thread):  # pylint: disable=too-many-instance-attributes
+    """Periodically records the stack of another thread."""
+
+    def __init__(self,
+                 thread_id,
+                 interval=INTERVAL,
+                 max_overhead=MAX_OVERHEAD,
+                 max_samples=MAX_SAMPLES):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_overhead = max_overhead
+        self.max_samples = max_samples
+        self.stacks = collections.Counter()
+        self.num_samples = 0
+        self.overhead = 0.0
+        self.truncated = False
+        self._done = threading.Event()
+
+    def run(self):
+        start = time.perf_counter()
+        interval = self.interval
+        while not self._done.wait(interval):
+            before = time.perf_counter()
+            frame = sys._current_frames().get(self.thread_id)  # pylint: disable=protected-access
+            if frame is None:
+                break
+            self.stacks[collapse(frame)] += 1
+            del frame
+            self.num_samples += 1
+            self.overhead += time.perf_counter() - before
+            if self.overhead > self.max_overhead * (time.perf_counter() -
+                                                    start):
+                interval *= 2
+            if self.num_samples >= self.max_samples:
+                self.truncated = True
+                break
+
+    def stop(self):
+        """Stops sampling and waits for the thread to finish."""
+        self._done.set()
+        self.join()
+
+
+def summarize(stacks, limit=TOP_FUNCTIONS):
+    """Returns the functions with the most samples, self and inclusive."""
+    own = collections.Counter()
+    total = collections.Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        own[frames[-1]] += count
+        for name in set(frames):
+            total[name] += count
+    return {
+        'self': own.most_common(limit),
+        'inclusive': total.most_common(limit),
+    }
+
+
+def _requested():
+    return (flask.request.headers.get('X-Ord-Profile') or
+            flask.request.cookies.get('ord-profile'))
+
+
+def _start():
+    sampled = random.random() < SAMPLE_RATE
+    requested = bool(PROFILE_USERS) and bool(_requested())
+    # Released by _finish().
+    # pylint: disable-next=consider-using-with
+    if not (sampled or requested) or not _active.acquire(blocking=False):
+        return
+    sampler = Sampler(threading.get_ident())
+    flask.g.profile = {
+        'sampler': sampler,
+        'sampled': sampled,
+        'wall': time.perf_counter(),
+        'cpu': time.thread_time(),
+    }
+    sampler.start()
+
+
+def _record_status(response):
+    if 'profile' in flask.g:
+        flask.g.profile['status'] = response.status_code
+    return response
+
+
+def _finish(exception):
+    profile = flask.g.pop('profile', None)
+    if profile is None:
+        return
+    try:
+        wall = time.perf_counter() - profile['wall']
+        cpu = time.thread_time() - profile['cpu']
+        sampler = profile['sampler']
+        sampler.stop()
+        user_id = flask.g.get('user_id')
+        if not profile['sampled'] and user_id not in PROFILE_USERS and (
+                flask.g.get('user_name') not in PROFILE_USERS):
+            return  # Requested by someone who is not allowed to profile.
+        name = (f'{time.strftime("%Y%m%d-%H%M%S")}-'
+                f'{flask.request.endpoint or "none"}-{uuid.uuid4().hex[:8]}')
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(PROFILE_DIR, f'{name}.collapsed'), 'wt') as f:
+            for stack, count in sorted(sampler.stacks.items()):
+                f.write(f'{stack} {count}\n')
+        summary = {
+            'path': flask.request.path,
+            'method': flask.request.method,
+            'endpoint': flask.request.endpoint,
+            'status': profile.get('status', 500 if exception else 200),
+            'user_id': user_id,
+            'sampled': profile['sampled'],
+            'wall_seconds': wall,
+            'cpu_seconds': cpu,
+            'samples': sampler.num_samples,
+            'interval_seconds': sampler.interval,
+            'overhead_seconds': sampler.overhead,
+            'truncated': sampler.truncated,
+            'top': summarize(sampler.stacks),
+        }
+        with open(os.path.join(PROFILE_DIR, f'{name}.json'), 'wt') as f:
+            json.dump(summary, f, indent=2)
+    finally:
+        _active.release()
+
+
+def init_app(app):
+    """Registers profiling hooks on a Flask app if profiling is enabled."""
+    if SAMPLE_RATE <= 0 and not PROFILE_USERS:
+        return
+    app.before_request_funcs.setdefault(None, []).insert(0, _start)
+    app.after_request(_record_status)
+    app.teardown_request(_finish)
@@ -0,0 +1,87 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for editor.py.profiling."""
+
+import json
+import os
+import time
+
+from absl.testing import absltest
+import flask
+
+import profiling  # pylint: disable=import-error
+
+
+def _busy(seconds):
+    start = time.time()
+    while time.time() - start < seconds:
+        sum(range(1000))
+
+
+class ProfilingTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.enter_context(
+            absltest.mock.patch.object(profiling, 'PROFILE_DIR',
+                                       self.create_tempdir().full_path))
+
+    def _make_app(self):
+        app = flask.Flask(__name__)
+        profiling.init_app(app)
+
+        @app.route('/busy')
+        def busy():  # pylint: disable=unused-variable
+            flask.g.user_id = 'tester'
+            _busy(0.1)
+            return 'ok'
+
+        return app
+
+    def test_disabled(self):
+        with absltest.mock.patch.object(profiling, 'SAMPLE_RATE', 0.0):
+            app = self._make_app()
+        self.assertEmpty(app.before_request_funcs.get(None, []))
+
+    def test_sampled(self):
+        with absltest.mock.patch.object(profiling, 'SAMPLE_RATE', 1.0):
+            app = self._make_app()
+            app.test_client().get('/busy')
+        names = sorted(os.listdir(profiling.PROFILE_DIR))
+        self.assertLen(names, 2)
+        with open(os.path.join(profiling.PROFILE_DIR, names[1])) as f:
+            summary = json.load(f)
+        self.assertEqual(summary['endpoint'], 'busy')
+        self.assertEqual(summary['status'], 200)
+        self.assertGreater(summary['samples'], 0)
+        with open(os.path.join(profiling.PROFILE_DIR, names[0])) as f:
+            self.assertIn('_busy', f.read())
+
+    def test_requested_by_unauthorized_user(self):
+        with absltest.mock.patch.object(profiling, 'PROFILE_USERS',
+                                        frozenset(['someone else'])):
+            app = self._make_app()
+            app.test_client().get('/busy', headers={'X-Ord-Profile': '1'})
+        self.assertEmpty(os.listdir(profiling.PROFILE_DIR))
+
+    def test_requested_by_authorized_user(self):
+        with absltest.mock.patch.object(profiling, 'PROFILE_USERS',
+                                        frozenset(['tester'])):
+            app = self._make_app()
+            app.test_client().get('/busy', headers={'X-Ord-Profile': '1'})
+        self.assertLen(os.listdir(profiling.PROFILE_DIR), 2)
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,198 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Byte offsets of the reactions in a serialized Dataset.
+
+scan() walks the top-level fields of a serialized Dataset in the protobuf wire
+format without decoding them, and records where the payload of each reactions
+field starts and how long it is. dataset_store.insert_serialized() stores this
+index with the row, so a handler can read one Reaction by slicing the stored
+bytes, or replace, insert, and delete reactions by splicing bytes (see splice())
+without parsing the rest of the Dataset.
+
+Datasets are stored with deterministic serialization, which writes fields in
+field number order. The payload of each reactions field is then exactly the
+deterministic serialization of that Reaction, and the remaining bytes are the
+serialized header, so split() gives the same result as
+revisions.split_dataset() without parsing anything.
+"""
+
+import struct
+
+from ord_schema.proto import dataset_pb2
+
+import dataset_diff
+
+REACTIONS = dataset_pb2.Dataset.DESCRIPTOR.fields_by_name['reactions'].number
+
+# Each index entry is a little-endian (offset, length) pair.
+_ENTRY = struct.Struct('<II')
+
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+_FIXED32 = 5
+
+
+def _read_varint(data, position):
+    """Returns (value, position after the varint)."""
+    value = 0
+    shift = 0
+    while True:
+        if position >= len(data):
+            raise ValueError('truncated varint')
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+def _encode_varint(value):
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+_TAG = _encode_varint(REACTIONS << 3 | _LENGTH_DELIMITED)
+
+
+def _fields(data):
+    """Yields (field number, start, payload start, end) for top-level fields."""
+    position = 0
+    while position < len(data):
+        start = position
+        tag, position = _read_varint(data, position)
+        number, wire_type = tag >> 3, tag & 7
+        if wire_type == _VARINT:
+            payload = position
+            _, position = _read_varint(data, position)
+        elif wire_type == _FIXED64:
+            payload, position = position, position + 8
+        elif wire_type == _LENGTH_DELIMITED:
+            length, payload = _read_varint(data, position)
+            position = payload + length
+        elif wire_type == _FIXED32:
+            payload, position = position, position + 4
+        else:
+            raise ValueError(f'unsupported wire type: {wire_type}')
+        if position > len(data):
+            raise ValueError('truncated field')
+        yield number, start, payload, position
+
+
+def scan(data):
+    """Returns the (offset, length) of every Reaction in a serialized Dataset.
+
+    Raises:
+        ValueError: The data is not a valid serialized message.
+    """
+    return [(payload, end - payload)
+            for number, _, payload, end in _fields(data)
+            if number == REACTIONS]
+
+
+def encode(offsets):
+    """Packs (offset, length) pairs into bytes for the datasets table."""
+    return b''.join(_ENTRY.pack(*entry) for entry in offsets)
+
+
+def decode(data):
+    """Unpacks the output of encode()."""
+    return list(_ENTRY.iter_unpack(bytes(data)))
+
+
+def entry_range(index):
+    """Returns the 1-based (start, length) of one entry for SQL SUBSTRING."""
+    return index * _ENTRY.size + 1, _ENTRY.size
+
+
+def _field_start(offset, length):
+    """Returns where the reactions field with the given payload starts."""
+    return offset - len(_encode_varint(length)) - len(_TAG)
+
+
+def _insert_position(data, offsets, index):
+    if index < len(offsets):
+        return _field_start(*offsets[index])
+    if offsets:
+        return offsets[-1][0] + offsets[-1][1]
+    # Keep field number order: insert before the first later field.
+    for number, start, _, _ in _fields(data):
+        if number > REACTIONS:
+            return start
+    return len(data)
+
+
+def splice(data, offsets, start, end, reactions):
+    """Replaces reactions[start:end] of a serialized Dataset.
+
+    Args:
+        data: Serialized Dataset.
+        offsets: Output of scan(data).
+        start: Integer index of the first reaction to replace.
+        end: Integer index after the last reaction to replace; equal to start
+            to insert.
+        reactions: List of serialized Reactions to put in their place. Use
+            deterministic serialization to keep the result deterministic.
+
+    Returns:
+        (serialized Dataset, offsets) tuple.
+
+    Raises:
+        IndexError: The range is out of bounds.
+    """
+    if not 0 <= start <= end <= len(offsets):
+        raise IndexError(f'reactions[{start}:{end}] out of range')
+    left = _insert_position(data, offsets, start)
+    right = (offsets[end - 1][0] + offsets[end - 1][1]) if end > start else left
+    middle = bytearray()
+    inserted = []
+    for reaction in reactions:
+        middle += _TAG + _encode_varint(len(reaction))
+        inserted.append((left + len(middle), len(reaction)))
+        middle += reaction
+    shift = len(middle) - (right - left)
+    result = data[:left] + bytes(middle) + data[right:]
+    new_offsets = (
+        offsets[:start] + inserted +
+        [(offset + shift, length) for offset, length in offsets[end:]])
+    return result, new_offsets
+
+
+def strip(data, offsets):
+    """Returns a serialized Dataset without its Reactions."""
+    header = bytearray()
+    position = 0
+    for offset, length in offsets:
+        header += data[position:_field_start(offset, length)]
+        position = offset + length
+    header += data[position:]
+    return bytes(header)
+
+
+def split(data, offsets):
+    """Like revisions.split_dataset(), for deterministically serialized data.
+
+    Returns:
+        (serialized header, list of (hash, serialized Reaction)) tuple.
+    """
+    payloads = []
+    for offset, length in offsets:
+        reaction = bytes(data[offset:offset + length])
+        payloads.append((dataset_diff.content_hash(reaction), reaction))
+    return strip(data, offsets), payloads
@@ -0,0 +1,111 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for editor.py.reaction_index."""
+
+import os
+
+from absl.testing import absltest
+from absl.testing import parameterized
+
+from ord_schema import message_helpers
+from ord_schema.proto import dataset_pb2
+from ord_schema.proto import reaction_pb2
+
+import reaction_index  # pylint: disable=import-error
+import revisions  # pylint: disable=import-error
+
+
+class ReactionIndexTest(parameterized.TestCase, absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dataset = message_helpers.load_message(
+            os.path.join(os.path.dirname(__file__), 'testdata',
+                         'nielsen_fig1_dataset.pbtxt'), dataset_pb2.Dataset)
+        self.dataset.reaction_ids.append('ord-1')
+        self.dataset.dataset_id = 'ord_dataset-1'
+        self.data = self.dataset.SerializeToString(deterministic=True)
+        self.offsets = reaction_index.scan(self.data)
+
+    def test_scan(self):
+        self.assertLen(self.offsets, len(self.dataset.reactions))
+        for (offset, length), reaction in zip(self.offsets,
+                                              self.dataset.reactions):
+            self.assertEqual(
+                reaction_pb2.Reaction.FromString(self.data[offset:offset +
+                                                           length]), reaction)
+
+    def test_scan_invalid(self):
+        with self.assertRaisesRegex(ValueError, 'truncated'):
+            reaction_index.scan(self.data[:-1])
+
+    def test_encode(self):
+        encoded = reaction_index.encode(self.offsets)
+        self.assertEqual(reaction_index.decode(encoded), self.offsets)
+        start, length = reaction_index.entry_range(3)
+        self.assertEqual(
+            reaction_index.decode(encoded[start - 1:start - 1 + length]),
+            [self.offsets[3]])
+
+    @parameterized.parameters(
+        (0, 1, 1),  # Replace the first.
+        (5, 5, 2),  # Insert.
+        (79, 80, 0),  # Delete the last.
+        (80, 80, 1),  # Append.
+        (0, 80, 0),  # Delete all.
+    )
+    def test_splice(self, start, end, count):
+        reactions = [
+            reaction_pb2.Reaction(reaction_id=f'ord-new-{i}')
+            for i in range(count)
+        ]
+        data, offsets = reaction_index.splice(
+            self.data, self.offsets, start, end,
+            [reaction.SerializeToString() for reaction in reactions])
+        expected = dataset_pb2.Dataset()
+        expected.CopyFrom(self.dataset)
+        del expected.reactions[start:end]
+        for i, reaction in enumerate(reactions):
+            expected.reactions.insert(start + i, reaction)
+        self.assertEqual(data, expected.SerializeToString(deterministic=True))
+        self.assertEqual(offsets, reaction_index.scan(data))
+
+    def test_splice_empty(self):
+        dataset = dataset_pb2.Dataset(name='test', dataset_id='ord_dataset-1')
+        data = dataset.SerializeToString(deterministic=True)
+        reaction = reaction_pb2.Reaction(reaction_id='ord-1')
+        data, offsets = reaction_index.splice(data, [], 0, 0,
+                                              [reaction.SerializeToString()])
+        dataset.reactions.add().CopyFrom(reaction)
+        self.assertEqual(data, dataset.SerializeToString(deterministic=True))
+        self.assertLen(offsets, 1)
+
+    def test_splice_out_of_range(self):
+        with self.assertRaises(IndexError):
+            reaction_index.splice(self.data, self.offsets, 80, 81, [])
+
+    def test_split(self):
+        self.assertEqual(reaction_index.split(self.data, self.offsets),
+                         revisions.split_dataset(self.dataset))
+
+    def test_strip(self):
+        header = dataset_pb2.Dataset.FromString(
+            reaction_index.strip(self.data, self.offsets))
+        self.assertEmpty(header.reactions)
+        self.assertEqual(header.name, self.dataset.name)
+        self.assertEqual(header.reaction_ids, self.dataset.reaction_ids)
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,111 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Batched edits to the reactions of a Dataset; see serve.edit_reactions().
+
+An edit is a list of operations, applied in order. Indices refer to the
+reactions as they stand after the previous operations.
+
+    {"op": "delete", "indices": [3, 5]}
+    {"op": "clone", "indices": [0], "count": 2}  # Appends the copies.
+    {"op": "add", "count": 1}  # Appends blank reactions with new IDs.
+    {"op": "remove_reaction_ids", "reaction_ids": ["ord-..."]}
+    {"op": "reorder", "order": [2, 0, 1]}  # A permutation of indices.
+"""
+
+import os
+import uuid
+
+# Most reactions a dataset may have after apply().
+MAX_REACTIONS = int(os.getenv('ORD_EDITOR_MAX_EDIT_REACTIONS', '100000'))
+
+
+def _is_int(value):
+    # JSON true and false are bools, which are ints in Python.
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _check_indices(indices, size):
+    """Returns a list of indices if they are all in range(size)."""
+    for index in indices:
+        if not _is_int(index) or not 0 <= index < size:
+            raise ValueError(f'index out of range: {index}')
+    return indices
+
+
+def _check_count(operation, size, copies=1):
+    """Returns the count of an operation that adds copies * count reactions."""
+    count = operation.get('count', 1)
+    if (not _is_int(count) or count < 0 or
+            size + count * copies > MAX_REACTIONS):
+        raise ValueError(f'count out of range: {count}')
+    return count
+
+
+def _remove_reaction_ids(dataset, reaction_ids):
+    for reaction_id in reaction_ids:
+        if reaction_id not in dataset.reaction_ids:
+            raise ValueError(f'no reaction_id: {reaction_id}')
+        dataset.reaction_ids.remove(reaction_id)
+
+
+def apply(dataset, operations):
+    """Applies a list of operations to a Dataset.
+
+    Each Reaction is serialized once and the reactions field is rebuilt at the
+    end, so the cost does not grow with the number of operations.
+
+    Returns:
+        List of the original index of each resulting reaction, or None for
+        added reactions.
+
+    Raises:
+        ValueError: An operation is malformed or out of range, or would leave
+            more than MAX_REACTIONS reactions.
+    """
+    sources = list(range(len(dataset.reactions)))
+    for operation in operations:
+        kind = operation['op']
+        if kind == 'delete':
+            doomed = set(_check_indices(operation['indices'], len(sources)))
+            sources = [
+                source for index, source in enumerate(sources)
+                if index not in doomed
+            ]
+        elif kind == 'clone':
+            indices = _check_indices(operation['indices'], len(sources))
+            count = _check_count(operation, len(sources), len(indices))
+            for index in indices:
+                sources.extend([sources[index]] * count)
+        elif kind == 'add':
+            sources.extend([None] * _check_count(operation, len(sources)))
+        elif kind == 'remove_reaction_ids':
+            _remove_reaction_ids(dataset, operation['reaction_ids'])
+        elif kind == 'reorder':
+            order = _check_indices(operation['order'], len(sources))
+            if sorted(order) != list(range(len(sources))):
+                raise ValueError('order is not a permutation')
+            sources = [sources[index] for index in order]
+        else:
+            raise ValueError(f'unknown op: {kind}')
+    serialized = [
+        reaction.SerializeToString() for reaction in dataset.reactions
+    ]
+    del dataset.reactions[:]
+    for source in sources:
+        reaction = dataset.reactions.add()
+        if source is None:
+            reaction.reaction_id = f'ord-{uuid.uuid4().hex}'
+        else:
+            reaction.MergeFromString(serialized[source])
+    return sources
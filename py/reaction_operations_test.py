@@ -0,0 +1,105 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for editor.py.reaction_operations."""
+
+from unittest import mock
+
+from absl.testing import absltest
+from absl.testing import parameterized
+
+from ord_schema.proto import dataset_pb2
+
+import reaction_operations  # pylint: disable=import-error
+
+
+class ReactionOperationsTest(parameterized.TestCase, absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dataset = dataset_pb2.Dataset(reaction_ids=['ord-a', 'ord-b'])
+        for index in range(4):
+            self.dataset.reactions.add(reaction_id=f'ord-{index}')
+
+    def test_apply(self):
+        sources = reaction_operations.apply(self.dataset, [
+            {
+                'op': 'delete',
+                'indices': [0, 2]
+            },
+            {
+                'op': 'clone',
+                'indices': [0],
+                'count': 2
+            },
+            {
+                'op': 'add'
+            },
+            {
+                'op': 'remove_reaction_ids',
+                'reaction_ids': ['ord-a']
+            },
+            {
+                'op': 'reorder',
+                'order': [4, 0, 1, 2, 3]
+            },
+        ])
+        self.assertEqual(sources, [None, 1, 3, 1, 1])
+        self.assertEqual(list(self.dataset.reaction_ids), ['ord-b'])
+        self.assertEqual(
+            [reaction.reaction_id for reaction in self.dataset.reactions[1:]],
+            ['ord-1', 'ord-3', 'ord-1', 'ord-1'])
+        self.assertNotIn(self.dataset.reactions[0].reaction_id,
+                         ['ord-0', 'ord-1', 'ord-2', 'ord-3'])
+
+    @parameterized.parameters(
+        {
+            'op': 'delete',
+            'indices': [4]
+        },
+        {
+            'op': 'delete',
+            'indices': [True]
+        },
+        {
+            'op': 'clone',
+            'indices': [0],
+            'count': -1
+        },
+        {
+            'op': 'add',
+            'count': 10
+        },
+        {
+            'op': 'clone',
+            'indices': [0, 1],
+            'count': 4
+        },
+        {
+            'op': 'reorder',
+            'order': [0, 0, 1, 2]
+        },
+        {
+            'op': 'remove_reaction_ids',
+            'reaction_ids': ['ord-c']
+        },
+        {'op': 'rename'},
+    )
+    def test_apply_invalid(self, **operation):
+        with mock.patch.object(reaction_operations, 'MAX_REACTIONS', 10):
+            with self.assertRaises(ValueError):
+                reaction_operations.apply(self.dataset, [operation])
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,300 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Garbage collection of abandoned guests, expired logins, and temp files.
+
+Every cookie-less request creates a guest user, a login, and a temp directory,
+so crawlers and probes leave a steady trail of them. reap() removes:
+
+    * logins rows past their expires_time;
+    * guest users (no GitHub name) created more than GUEST_RETENTION seconds
+      ago that own no datasets or revisions and have not logged in since,
+      together with their logins and user_stats rows;
+    * temp directories of users that no longer exist, and uploaded files
+      (see serve.write_upload) older than UPLOAD_RETENTION seconds.
+
+Rows are deleted in transactions of at most BATCH_SIZE, with a short pause in
+between, so that no lock is held for long. A Postgres advisory lock keeps
+concurrent reapers (one per server process) from duplicating work.
+
+init_app() runs reap() every INTERVAL seconds in a background thread of each
+server process. To run it from cron instead, set ORD_EDITOR_REAP_INTERVAL=0
+and use
+
+    $ PYTHONPATH=py python py/reaper.py --temp=/tmp/ord-editor
+"""
+
+import logging
+import os
+import random
+import re
+import shutil
+import threading
+import time
+
+from absl import app
+from absl import flags
+import psycopg2
+
+import metrics
+import system_users
+
+GUEST_RETENTION = int(
+    os.getenv('ORD_EDITOR_GUEST_RETENTION', str(30 * 24 * 3600)))
+UPLOAD_RETENTION = int(os.getenv('ORD_EDITOR_UPLOAD_RETENTION', str(24 * 3600)))
+# Seconds between background runs; zero disables the background thread.
+INTERVAL = int(os.getenv('ORD_EDITOR_REAP_INTERVAL', '3600'))
+BATCH_SIZE = 500
+# Seconds to pause between batches.
+BATCH_PAUSE = 0.05
+# Key of the Postgres advisory lock held while reaping.
+LOCK_KEY = 0x6f7264726561  # "ordrea"
+
+USER_DIRECTORY = re.compile('[0-9a-f]{32}')
+
+# PID of the process whose background thread is running.
+_thread_pid = None  # pylint: disable=invalid-name
+_thread_lock = threading.Lock()
+
+
+def reap_logins(connection, now):
+    """Deletes expired logins rows; returns the number deleted."""
+    total = 0
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM logins WHERE access_token IN ('
+                '  SELECT access_token FROM logins WHERE expires_time<=%s '
+                '  LIMIT %s FOR UPDATE SKIP LOCKED)', [now, BATCH_SIZE])
+            count = cursor.rowcount
+        connection.commit()
+        total += count
+        metrics.REAPED.labels('logins').inc(count)
+        if count < BATCH_SIZE:
+            return total
+        time.sleep(BATCH_PAUSE)
+
+
+def reap_guests(connection, now, protected=()):
+    """Deletes abandoned guest users.
+
+    Args:
+        connection: psycopg2 connection.
+        now: Integer current time.
+        protected: User IDs that are never deleted, e.g. system users.
+
+    Returns:
+        List of deleted user IDs.
+    """
+    cutoff = now - GUEST_RETENTION
+    deleted = []
+    while True:
+        try:
+            with connection.cursor() as cursor:
+                # FOR UPDATE blocks concurrent dataset inserts for these users
+                # until the batch commits; they then fail and the user, who
+                # has been idle for GUEST_RETENTION, starts over as a new guest.
+                cursor.execute(
+                    'SELECT user_id FROM users WHERE name IS NULL '
+                    'AND created_time<%s AND user_id<>ALL(%s::CHARACTER(32)[]) '
+                    'AND NOT EXISTS (SELECT 1 FROM datasets '
+                    '  WHERE datasets.user_id=users.user_id) '
+                    'AND NOT EXISTS (SELECT 1 FROM revisions '
+                    '  WHERE revisions.user_id=users.user_id) '
+                    'AND NOT EXISTS (SELECT 1 FROM logins '
+                    '  WHERE logins.user_id=users.user_id AND timestamp>=%s) '
+                    'LIMIT %s FOR UPDATE SKIP LOCKED',
+                    [cutoff, list(protected), cutoff, BATCH_SIZE])
+                user_ids = [row[0] for row in cursor]
+                if user_ids:
+                    cursor.execute('DELETE FROM logins WHERE user_id=ANY(%s)',
+                                   [user_ids])
+                    metrics.REAPED.labels('logins').inc(cursor.rowcount)
+                    cursor.execute('DELETE FROM users WHERE user_id=ANY(%s)',
+                                   [user_ids])
+            connection.commit()
+        except psycopg2.IntegrityError:
+            # A user in the batch saved a dataset after all; try again without.
+            connection.rollback()
+            continue
+        deleted.extend(user_ids)
+        metrics.REAPED.labels('users').inc(len(user_ids))
+        if len(user_ids) < BATCH_SIZE:
+            return deleted
+        time.sleep(BATCH_PAUSE)
+
+
+def reap_temp(connection, temp, now):
+    """Deletes temp directories of missing users and stale uploads.
+
+    Returns:
+        (number of directories, number of files) deleted.
+    """
+    try:
+        names = [
+            entry.name
+            for entry in os.scandir(temp)
+            if entry.is_dir() and USER_DIRECTORY.fullmatch(entry.name)
+        ]
+    except FileNotFoundError:
+        return 0, 0
+    num_directories = num_files = 0
+    for start in range(0, len(names), BATCH_SIZE):
+        batch = names[start:start + BATCH_SIZE]
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT user_id FROM users WHERE user_id=ANY(%s)',
+                           [batch])
+            existing = {row[0] for row in cursor}
+        connection.commit()
+        for name in batch:
+            path = os.path.join(temp, name)
+            if name not in existing:
+                shutil.rmtree(path, ignore_errors=True)
+                num_directories += 1
+                continue
+            for entry in os.scandir(path):
+                if (entry.name.startswith('upload_') and entry.is_file() and
+                        entry.stat().st_mtime < now - UPLOAD_RETENTION):
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        continue
+                    num_files += 1
+    metrics.REAPED.labels('temp_directories').inc(num_directories)
+    metrics.REAPED.labels('uploads').inc(num_files)
+    return num_directories, num_files
+
+
+def reap(connection, temp, protected=(), now=None):
+    """Runs every reaper unless another process is already doing so.
+
+    Args:
+        connection: psycopg2 connection.
+        temp: Directory containing per-user temp directories.
+        protected: User IDs that are never deleted.
+        now: Integer current time; defaults to time.time().
+
+    Returns:
+        Dict of counts by kind, or None if another process holds the lock.
+    """
+    now = int(time.time()) if now is None else now
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s)', [LOCK_KEY])
+        acquired = cursor.fetchone()[0]
+    connection.commit()
+    if not acquired:
+        return None
+    try:
+        counts = {'logins': reap_logins(connection, now)}
+        counts['users'] = reap_guests(connection, now, protected)
+        counts['temp_directories'], counts['uploads'] = reap_temp(
+            connection, temp, now)
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', [LOCK_KEY])
+        connection.commit()
+    return counts
+
+
+def _run_forever(connect, temp, protected, on_delete):
+    while True:
+        # Jitter spreads the runs of different processes apart.
+        time.sleep(INTERVAL * random.uniform(0.5, 1.5))
+        try:
+            connection = connect()
+            try:
+                counts = reap(connection, temp, protected)
+            finally:
+                connection.close()
+        except Exception:  # pylint: disable=broad-except
+            logging.exception('reaper failed')
+            continue
+        if counts is None:
+            continue
+        if counts['users']:
+            on_delete(counts['users'])
+        logging.info(
+            'reaped %d logins, %d users, %d temp directories, %d uploads',
+            counts['logins'], len(counts['users']), counts['temp_directories'],
+            counts['uploads'])
+
+
+def init_app(flask_app, connect, temp, protected=(), on_delete=None):
+    """Starts the background reaper in each process that serves requests.
+
+    The thread starts with the first request rather than at import, so that
+    each forked gunicorn worker gets its own.
+
+    Args:
+        flask_app: Flask app.
+        connect: Function returning a new psycopg2 connection.
+        temp: Directory containing per-user temp directories.
+        protected: User IDs that are never deleted.
+        on_delete: Optional function called with each list of deleted user IDs,
+            e.g. to drop cached sessions.
+    """
+    if INTERVAL <= 0:
+        return
+    on_delete = on_delete or (lambda user_ids: None)
+
+    def start():
+        global _thread_pid  # pylint: disable=global-statement
+        if _thread_pid == os.getpid():
+            return
+        with _thread_lock:
+            if _thread_pid == os.getpid():
+                return
+            threading.Thread(target=_run_forever,
+                             args=(connect, temp, protected, on_delete),
+                             name='reaper',
+                             daemon=True).start()
+            _thread_pid = os.getpid()
+
+    flask_app.before_request(start)
+
+
+FLAGS = flags.FLAGS
+
+
+def main(argv):
+    del argv  # Only used by app.run().
+    connection = psycopg2.connect(dbname='editor',
+                                  host=FLAGS.host,
+                                  port=FLAGS.port,
+                                  user=FLAGS.user,
+                                  password=os.getenv('POSTGRES_PASSWORD', ''))
+    try:
+        counts = reap(connection, FLAGS.temp, FLAGS.protected)
+    finally:
+        connection.close()
+    if counts is None:
+        print('another reaper is running')
+        return
+    print(f'reaped {counts["logins"]} logins, {len(counts["users"])} users, '
+          f'{counts["temp_directories"]} temp directories, '
+          f'{counts["uploads"]} uploads')
+
+
+if __name__ == '__main__':
+    # Flags are defined here because serve.py imports this module.
+    flags.DEFINE_string('host', os.getenv('POSTGRES_HOST', 'localhost'),
+                        'Postgres host.')
+    flags.DEFINE_integer('port', int(os.getenv('POSTGRES_PORT', '5432')),
+                         'Postgres port.')
+    flags.DEFINE_string('user', os.getenv('POSTGRES_USER', 'postgres'),
+                        'Postgres user.')
+    flags.DEFINE_string('temp', '/tmp/ord-editor',
+                        'Directory of per-user temp directories.')
+    flags.DEFINE_list('protected', [system_users.REVIEWER, system_users.TESTER],
+                      'User IDs that are never deleted (the system users).')
+    app.run(main)
@@ -0,0 +1,167 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for editor.py.reaper.
+
+The editor database must be reachable as in serve_test.py. Fixture users are
+created at time 1000 and reaped as of shortly after GUEST_RETENTION, so no
+other rows are old enough to be touched.
+"""
+
+import os
+import uuid
+
+from absl.testing import absltest
+import psycopg2
+
+import reaper  # pylint: disable=import-error
+import schema  # pylint: disable=import-error
+
+CREATED = 1000
+NOW = CREATED + reaper.GUEST_RETENTION + 1
+
+
+class ReaperTest(absltest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Connects to the editor database and applies the migrations."""
+        super().setUpClass()
+        cls.conn = psycopg2.connect(dbname='editor',
+                                    user=os.getenv('POSTGRES_USER', 'postgres'),
+                                    password=os.getenv('POSTGRES_PASSWORD', ''),
+                                    host=os.getenv('POSTGRES_HOST',
+                                                   'localhost'),
+                                    port=int(os.getenv('POSTGRES_PORT',
+                                                       '5432')))
+        schema.migrate(cls.conn)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Closes the database connection."""
+        cls.conn.close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.temp = self.create_tempdir().full_path
+        self.users = {
+            name: uuid.uuid4().hex for name in
+            ['abandoned', 'owner', 'recent', 'returning', 'named', 'protected']
+        }
+        with self.conn.cursor() as cursor:
+            for name, user_id in self.users.items():
+                cursor.execute('INSERT INTO users VALUES (%s, %s, %s)', [
+                    user_id, 'someone' if name == 'named' else None,
+                    NOW if name == 'recent' else CREATED
+                ])
+                os.mkdir(os.path.join(self.temp, user_id))
+            cursor.execute(
+                'INSERT INTO datasets (user_id, name, serialized) '
+                'VALUES (%s, %s, %s)', [self.users['owner'], 'dataset', b''])
+            cursor.execute(
+                'INSERT INTO logins VALUES (%s, %s, %s, %s)',
+                [uuid.uuid4().hex, self.users['abandoned'], CREATED, NOW + 1])
+            cursor.execute(
+                'INSERT INTO logins VALUES (%s, %s, %s, %s)',
+                [uuid.uuid4().hex, self.users['returning'], NOW - 1, NOW + 1])
+            self.expired = uuid.uuid4().hex
+            cursor.execute(
+                'INSERT INTO logins VALUES (%s, %s, %s, %s)',
+                [self.expired, self.users['named'], CREATED, CREATED + 1])
+        self.conn.commit()
+
+    def tearDown(self):
+        """Deletes the rows created by setUp()."""
+        self.conn.rollback()
+        user_ids = list(self.users.values())
+        with self.conn.cursor() as cursor:
+            cursor.execute('DELETE FROM datasets WHERE user_id=ANY(%s)',
+                           [user_ids])
+            cursor.execute('DELETE FROM logins WHERE user_id=ANY(%s)',
+                           [user_ids])
+            cursor.execute('DELETE FROM users WHERE user_id=ANY(%s)',
+                           [user_ids])
+        self.conn.commit()
+        super().tearDown()
+
+    def existing_users(self):
+        """Returns the IDs in self.users that still have users rows."""
+        with self.conn.cursor() as cursor:
+            cursor.execute('SELECT user_id FROM users WHERE user_id=ANY(%s)',
+                           [list(self.users.values())])
+            user_ids = {row[0] for row in cursor}
+        self.conn.commit()
+        return {
+            name for name, user_id in self.users.items() if user_id in user_ids
+        }
+
+    def test_reap(self):
+        upload = os.path.join(self.temp, self.users['owner'], 'upload_old')
+        with open(upload, 'wt') as f:
+            f.write('data')
+        os.utime(upload, (CREATED, CREATED))
+        lock = os.path.join(self.temp, self.users['owner'], 'dataset.lock')
+        with open(lock, 'wt'):
+            pass
+        os.utime(lock, (CREATED, CREATED))
+        counts = reaper.reap(self.conn,
+                             self.temp,
+                             protected=[self.users['protected']],
+                             now=NOW)
+        self.assertEqual(counts['users'], [self.users['abandoned']])
+        self.assertGreaterEqual(counts['logins'], 1)
+        self.assertEqual(counts['temp_directories'], 1)
+        self.assertEqual(counts['uploads'], 1)
+        self.assertEqual(self.existing_users(),
+                         {'owner', 'recent', 'returning', 'named', 'protected'})
+        with self.conn.cursor() as cursor:
+            cursor.execute('SELECT 1 FROM logins WHERE access_token=%s',
+                           [self.expired])
+            self.assertIsNone(cursor.fetchone())
+        self.conn.commit()
+        self.assertFalse(
+            os.path.exists(os.path.join(self.temp, self.users['abandoned'])))
+        self.assertTrue(
+            os.path.exists(os.path.join(self.temp, self.users['recent'])))
+        self.assertFalse(os.path.exists(upload))
+        self.assertTrue(os.path.exists(lock))
+
+    def test_batches(self):
+        with self.conn.cursor() as cursor:
+            for _ in range(5):
+                user_id = uuid.uuid4().hex
+                self.users[user_id] = user_id
+                cursor.execute('INSERT INTO users VALUES (%s, %s, %s)',
+                               [user_id, None, CREATED])
+        self.conn.commit()
+        with absltest.mock.patch.object(reaper, 'BATCH_SIZE', 2):
+            deleted = reaper.reap_guests(self.conn, NOW,
+                                         [self.users['protected']])
+        self.assertLen(deleted, 6)
+
+    def test_locked(self):
+        other = psycopg2.connect(self.conn.dsn,
+                                 password=os.getenv('POSTGRES_PASSWORD', ''))
+        try:
+            with other.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_lock(%s)', [reaper.LOCK_KEY])
+            other.commit()
+            self.assertIsNone(reaper.reap(self.conn, self.temp, now=NOW))
+            self.assertIn('abandoned', self.existing_users())
+        finally:
+            other.close()
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,106 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Precomputed triage summaries for datasets under review.
+
+/review/sync imports every dataset file in the open pull requests on ord-data,
+along with the file's version on the pull request's base branch if it has one.
+summarize() records what a reviewer looks at first: the reaction count,
+validation errors, and a structural diff against the base version (see
+dataset_diff.py). Error counts of reactions come from the reaction_stats
+table when the caller has them (see dataset_stats.py), so only reactions with
+errors are validated again, for their messages. reviews.store() keeps the
+summaries in the reviews table next to the datasets, so /review renders from a
+single query.
+"""
+
+from ord_schema import validations
+from ord_schema.proto import dataset_pb2
+
+import dataset_diff
+
+# Validation messages kept of each kind; the counts include the rest.
+MAX_MESSAGES = 20
+
+
+def _plural(count, noun):
+    return f'{count} {noun}' + ('' if count == 1 else 's')
+
+
+def describe(summary):
+    """Returns a one-line description of a summary."""
+    parts = [_plural(summary['num_reactions'], 'reaction')]
+    if summary['is_new']:
+        parts.append('new dataset')
+    else:
+        kinds = ('added', 'removed', 'modified', 'moved')
+        changes = [f'{summary[kind]} {kind}' for kind in kinds if summary[kind]]
+        if summary['dataset_changed']:
+            changes.append('dataset fields changed')
+        parts.append(', '.join(changes) or 'no changes')
+    parts.append(_plural(summary['num_errors'], 'error'))
+    return '; '.join(parts)
+
+
+def summarize(dataset, base=None, reaction_errors=None):
+    """Validates a Dataset under review and compares it to its base version.
+
+    Args:
+        dataset: Dataset from the pull request.
+        base: Dataset on the base branch, or None if the file is new.
+        reaction_errors: List of the number of validation errors of each
+            reaction, or None to validate every reaction.
+
+    Returns:
+        JSON-compatible dict with the reaction count, the error count and the
+        first MAX_MESSAGES error messages, the diff report from
+        dataset_diff.diff_datasets() with counts, and a text description.
+    """
+    options = validations.ValidationOptions(require_provenance=True)
+    output = validations.validate_message(dataset,
+                                          recurse=False,
+                                          raise_on_error=False,
+                                          options=options)
+    errors = list(output.errors)
+    num_errors = len(errors)
+    for index, reaction in enumerate(dataset.reactions):
+        if reaction_errors is not None:
+            num_errors += reaction_errors[index]
+            if not reaction_errors[index] or len(errors) >= MAX_MESSAGES:
+                continue
+        # The trace validate_message(dataset) would give.
+        trace = ('Dataset', f'reactions[{index}]')
+        output = validations.validate_message(reaction,
+                                              raise_on_error=False,
+                                              options=options,
+                                              trace=trace)
+        errors.extend(output.errors)
+        if reaction_errors is None:
+            num_errors += len(output.errors)
+    report = dataset_diff.diff_datasets(base or dataset_pb2.Dataset(), dataset)
+    summary = {
+        'name': dataset.name,
+        'num_reactions': len(dataset.reactions),
+        'num_errors': num_errors,
+        'errors': errors[:MAX_MESSAGES],
+        'is_new': base is None,
+        'unchanged': report['unchanged'],
+        'moved': len(report['moved']),
+        'added': len(report['added']),
+        'removed': len(report['removed']),
+        'modified': len(report['modified']),
+        'dataset_changed': bool(report['dataset']),
+        'diff': report,
+    }
+    summary['text'] = describe(summary)
+    return summary
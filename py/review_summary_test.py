@@ -0,0 +1,96 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for editor.py.review_summary."""
+
+import json
+from unittest import mock
+
+from absl.testing import absltest
+
+from ord_schema import validations
+from ord_schema.proto import dataset_pb2
+from ord_schema.proto import reaction_pb2
+
+import dataset_stats  # pylint: disable=import-error
+import review_summary  # pylint: disable=import-error
+
+
+def _reaction(smiles):
+    reaction = reaction_pb2.Reaction()
+    reaction.inputs['a'].components.add().identifiers.add(type='SMILES',
+                                                          value=smiles)
+    return reaction
+
+
+class ReviewSummaryTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.base = dataset_pb2.Dataset(
+            name='test', reactions=[_reaction('C'),
+                                    _reaction('CC')])
+
+    def test_new(self):
+        summary = review_summary.summarize(self.base)
+        self.assertTrue(summary['is_new'])
+        self.assertEqual(summary['num_reactions'], 2)
+        self.assertEqual(summary['added'], 2)
+        self.assertGreater(summary['num_errors'], 0)
+        self.assertLen(summary['errors'],
+                       min(summary['num_errors'], review_summary.MAX_MESSAGES))
+        self.assertIn('new dataset', summary['text'])
+        # Summaries are stored as JSON.
+        self.assertEqual(json.loads(json.dumps(summary)), summary)
+
+    def test_reaction_errors(self):
+        # As stored in the reaction_stats table.
+        errors = [
+            dataset_stats.summarize_reaction(reaction)[1]
+            for reaction in self.base.reactions
+        ]
+        self.assertEqual(review_summary.summarize(self.base, None, errors),
+                         review_summary.summarize(self.base))
+        # Reactions without errors are not validated again.
+        with mock.patch.object(validations,
+                               'validate_message',
+                               wraps=validations.validate_message) as validate:
+            summary = review_summary.summarize(self.base, None, [0, 5])
+        validated = [call[0][0] for call in validate.call_args_list]
+        self.assertNotIn(self.base.reactions[0], validated)
+        self.assertIn(self.base.reactions[1], validated)
+        self.assertEqual(summary['num_errors'], 5)
+        for error in summary['errors']:
+            self.assertStartsWith(error, 'Dataset.reactions[1]')
+
+    def test_changed(self):
+        dataset = dataset_pb2.Dataset()
+        dataset.CopyFrom(self.base)
+        dataset.reactions.add().CopyFrom(_reaction('CCC'))
+        summary = review_summary.summarize(dataset, self.base)
+        self.assertFalse(summary['is_new'])
+        self.assertEqual(summary['unchanged'], 2)
+        self.assertEqual(summary['added'], 1)
+        self.assertEqual(summary['diff']['added'], [{
+            'index': 2,
+            'reaction_id': ''
+        }])
+        self.assertTrue(summary['text'].startswith('3 reactions; 1 added;'))
+
+    def test_unchanged(self):
+        summary = review_summary.summarize(self.base, self.base)
+        self.assertIn('no changes', summary['text'])
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,172 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Datasets imported from open pull requests on ord-data for review.
+
+/review/sync replaces the review user's datasets with the dataset files of the
+open pull requests (see fetch() and store()). Pull request metadata is encoded
+into each dataset name, and a summary of each file (see review_summary.py) is
+stored in the reviews table for /review.
+"""
+
+import collections
+import json
+import os
+import re
+import urllib.parse
+
+import psycopg2.sql
+from google.protobuf import text_format
+
+from ord_schema.proto import dataset_pb2
+
+import dataset_diff
+import dataset_stats
+import dataset_store
+import lazy_import
+import review_summary
+import revisions
+import system_users
+
+github = lazy_import.Module('github')
+requests = lazy_import.Module('requests')
+
+# Pull requests on this repository are imported for review.
+REVIEW_REPO = 'Open-Reaction-Database/ord-data'
+GITHUB_RAW_URL = 'https://raw.githubusercontent.com'
+# Names of datasets imported for review.
+NAME_PATTERN = re.compile('^PR_([0-9]+) ___(.*)___ (.*)')
+
+
+def parse_file(filename, content):
+    """Parses the bytes of a .pb or .pbtxt file from a pull request."""
+    if filename.endswith('.pbtxt'):
+        dataset = dataset_pb2.Dataset()
+        text_format.Parse(content.decode(), dataset)
+        return dataset
+    return dataset_pb2.Dataset.FromString(content)
+
+
+def dataset_name(number, title, filename):
+    """Encodes pull request metadata into a review dataset name."""
+    prefix = os.path.splitext(filename)[0]
+    return f'PR_{number} ___{title}___ {prefix}'
+
+
+def base_url(ref, filename):
+    """Returns the URL of a file's raw contents on a branch of ord-data."""
+    path = urllib.parse.quote(filename)
+    return f'{GITHUB_RAW_URL}/{REVIEW_REPO}/{ref}/{path}'
+
+
+def fetch():
+    """Downloads the dataset files of all open pull requests.
+
+    Returns:
+        List of (PR number, PR title, filename, Dataset, base Dataset or None)
+        tuples; see store().
+    """
+    client = github.Github()
+    repo = client.get_repo(REVIEW_REPO)
+    submissions = []
+    for pr in repo.get_pulls():
+        for remote in pr.get_files():
+            if not remote.filename.endswith(('.pb', '.pbtxt')):
+                continue
+            response = requests.get(remote.raw_url)
+            dataset = parse_file(remote.filename, response.content)
+            base = None
+            if remote.status != 'added':
+                response = requests.get(base_url(pr.base.ref, remote.filename))
+                if response.ok:
+                    base = parse_file(remote.filename, response.content)
+            submissions.append(
+                (pr.number, pr.title, remote.filename, dataset, base))
+    return submissions
+
+
+def store(cursor, submissions):
+    """Replaces all the review user's datasets and their summaries.
+
+    Args:
+        cursor: psycopg2 cursor.
+        submissions: List of (PR number, PR title, filename, Dataset, base
+            Dataset or None) tuples.
+    """
+    reviewer = system_users.REVIEWER
+    # First reset all datasets under review.
+    query = psycopg2.sql.SQL('DELETE FROM datasets WHERE user_id=%s')
+    cursor.execute(query, [reviewer])
+    revisions.delete_history(cursor, reviewer)
+    dataset_stats.refresh_users(cursor, [reviewer])
+    # Then import all datasets from open PR's.
+    for number, title, filename, dataset, base in submissions:
+        name = dataset_name(number, title, filename)
+        dataset_store.insert_dataset(cursor, reviewer, name, dataset)
+        # insert_dataset() stored a summary of every reaction.
+        hashes = [
+            dataset_diff.reaction_hash(reaction)
+            for reaction in dataset.reactions
+        ]
+        stats = dataset_stats.lookup(cursor, hashes)
+        summary = review_summary.summarize(
+            dataset, base, [stats[value][1] for value in hashes])
+        query = psycopg2.sql.SQL(
+            'INSERT INTO reviews (user_id, name, number, title, filename, '
+            'summary) VALUES (%s, %s, %s, %s, %s, %s)')
+        cursor.execute(query, [
+            reviewer, name, number, title,
+            os.path.splitext(filename)[0],
+            json.dumps(summary)
+        ])
+
+
+def list_submissions(cursor):
+    """Returns the review user's datasets grouped by pull request.
+
+    Returns:
+        (dict mapping (PR number, PR title) to lists of (filename, dataset
+        name, summary without its diff, or None) tuples, sorted list of all
+        dataset names) tuple.
+    """
+    pull_requests = collections.defaultdict(list)
+    names = []
+    query = psycopg2.sql.SQL(
+        'SELECT datasets.name, reviews.number, reviews.title, '
+        'reviews.filename, reviews.summary '
+        'FROM datasets LEFT JOIN reviews USING (user_id, name) '
+        'WHERE datasets.user_id=%s ORDER BY reviews.number, datasets.name')
+    cursor.execute(query, [system_users.REVIEWER])
+    for name, number, title, filename, summary in cursor:
+        names.append(name)
+        if summary is None:
+            # Synced before summaries were stored.
+            match = NAME_PATTERN.match(name)
+            if match is None:
+                continue
+            number, title, filename = match.groups()
+        else:
+            summary = json.loads(summary)
+            del summary['diff']  # Only shown by /review/diff.
+        pull_requests[(int(number), title)].append((filename, name, summary))
+    return pull_requests, sorted(names)
+
+
+def load_summary(cursor, name):
+    """Returns the stored summary of a review dataset, or None."""
+    query = psycopg2.sql.SQL(
+        'SELECT summary FROM reviews WHERE user_id=%s AND name=%s')
+    cursor.execute(query, [system_users.REVIEWER, name])
+    if cursor.rowcount == 0:
+        return None
+    return json.loads(cursor.fetchone()[0])
@@ -0,0 +1,420 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Revision history for datasets.
+
+Every write through dataset_store.insert_dataset() records a revision. A
+revision is the Dataset's header (every field except reactions) plus the ordered
+list of its reactions' content hashes. Reaction payloads go in the reactions
+table, keyed by hash, so each distinct reaction is stored once however many
+revisions and copies refer to it. (The current Dataset is also stored whole in
+the datasets table; see dataset_store.py.)
+
+Every SNAPSHOT_INTERVAL revisions the full hash list is stored. In between,
+only splice operations against the previous revision are stored, so history
+grows with the size of each change rather than the size of the dataset. A
+revision is rebuilt from the nearest snapshot at or before it. A copy of a
+dataset starts as a snapshot that shares every reaction with its source.
+
+When a snapshot is written, revisions beyond the newest MAX_REVISIONS or older
+than MAX_AGE seconds are dropped. The oldest surviving revision is rewritten as
+a snapshot and reactions that no revision refers to are deleted. Deleting a
+dataset deletes its history (see delete_history()), so a new dataset with the
+same name starts over.
+
+The reactions table is reference counted: reactions.refs is the number of
+revisions rows whose hashes include the reaction. add_references() and
+remove_references() keep it in step with every insert, rewrite, and delete of
+a revisions row, so unreferenced reactions are found by key rather than by
+searching every revision. Rows are locked in hash order to keep concurrent
+writers sharing reactions from deadlocking.
+"""
+
+import collections
+import json
+import os
+import time
+
+import psycopg2.extras
+
+from ord_schema.proto import dataset_pb2
+
+import dataset_diff
+
+SNAPSHOT_INTERVAL = int(os.getenv('ORD_EDITOR_SNAPSHOT_INTERVAL', '20'))
+MAX_REVISIONS = int(os.getenv('ORD_EDITOR_MAX_REVISIONS', '100'))
+MAX_AGE = int(os.getenv('ORD_EDITOR_REVISION_MAX_AGE', str(90 * 24 * 3600)))
+
+
+def split_dataset(dataset):
+    """Separates a Dataset into its header and serialized reactions.
+
+    Returns:
+        (serialized header, list of (hash, serialized Reaction)) tuple.
+    """
+    header = dataset_pb2.Dataset()
+    for field, value in dataset.ListFields():
+        if field.name == 'reactions':
+            continue
+        if field.label == field.LABEL_REPEATED:
+            getattr(header, field.name).extend(value)
+        elif field.type == field.TYPE_MESSAGE:
+            getattr(header, field.name).CopyFrom(value)
+        else:
+            setattr(header, field.name, value)
+    payloads = []
+    for reaction in dataset.reactions:
+        serialized = reaction.SerializeToString(deterministic=True)
+        payloads.append((dataset_diff.content_hash(serialized), serialized))
+    return header.SerializeToString(deterministic=True), payloads
+
+
+def diff_hashes(old, new):
+    """Returns splice operations that turn one hash list into another.
+
+    The common prefix and suffix are trimmed; if what remains has the same
+    length on both sides it is replaced position by position, otherwise as a
+    single splice. This is linear and exact for the usual single edit, insert,
+    or delete.
+
+    Returns:
+        List of (start, end, hashes) tuples in increasing order of start,
+        where old[start:end] is replaced by hashes.
+    """
+    prefix = 0
+    limit = min(len(old), len(new))
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while (suffix < limit - prefix and
+           old[len(old) - suffix - 1] == new[len(new) - suffix - 1]):
+        suffix += 1
+    old_middle = old[prefix:len(old) - suffix]
+    new_middle = new[prefix:len(new) - suffix]
+    if len(old_middle) != len(new_middle):
+        return [(prefix, len(old) - suffix, new_middle)]
+    return [(prefix + i, prefix + i + 1, [b])
+            for i, (a, b) in enumerate(zip(old_middle, new_middle))
+            if a != b]
+
+
+def apply_delta(hashes, operations):
+    """Applies the output of diff_hashes() to a hash list in place."""
+    for start, end, replacement in reversed(operations):
+        hashes[start:end] = replacement
+
+
+def _encode_delta(operations):
+    """Returns (delta JSON, inserted hashes) for a revisions row."""
+    delta = json.dumps([
+        [start, end, len(replacement)] for start, end, replacement in operations
+    ])
+    inserted = [
+        value for _, _, replacement in operations for value in replacement
+    ]
+    return delta, inserted
+
+
+def _decode_delta(delta, inserted):
+    operations = []
+    offset = 0
+    for start, end, count in json.loads(delta):
+        operations.append((start, end, inserted[offset:offset + count]))
+        offset += count
+    return operations
+
+
+def latest_revision(cursor, user_id, name):
+    """Returns the newest revision number of a dataset, or None."""
+    cursor.execute(
+        'SELECT MAX(revision) FROM revisions WHERE user_id=%s AND name=%s',
+        [user_id, name])
+    return cursor.fetchone()[0]
+
+
+def load_hashes(cursor, user_id, name, revision):
+    """Rebuilds the reaction hash list of a revision.
+
+    Returns:
+        (list of hashes, serialized header) tuple, or None if the revision
+        does not exist.
+    """
+    cursor.execute(
+        'SELECT revision, snapshot, delta, hashes, header FROM revisions '
+        'WHERE user_id=%s AND name=%s AND revision<=%s AND revision>=('
+        '  SELECT MAX(revision) FROM revisions '
+        '  WHERE user_id=%s AND name=%s AND snapshot AND revision<=%s) '
+        'ORDER BY revision', [user_id, name, revision] * 2)
+    rows = cursor.fetchall()
+    if not rows or rows[-1][0] != revision:
+        return None
+    hashes = []
+    for _, snapshot, delta, stored, _ in rows:
+        stored = [bytes(value) for value in stored]
+        if snapshot:
+            hashes = stored
+        else:
+            apply_delta(hashes, _decode_delta(delta, stored))
+    return hashes, bytes(rows[-1][4])
+
+
+def load(cursor, user_id, name, revision):
+    """Rebuilds a Dataset as of a revision, or returns None if missing."""
+    loaded = load_hashes(cursor, user_id, name, revision)
+    if loaded is None:
+        return None
+    hashes, header = loaded
+    cursor.execute(
+        'SELECT hash, serialized FROM reactions WHERE hash=ANY(%s::BYTEA[])',
+        [sorted(set(hashes))])
+    payloads = {bytes(value): bytes(serialized) for value, serialized in cursor}
+    dataset = dataset_pb2.Dataset.FromString(header)
+    for value in hashes:
+        dataset.reactions.add().MergeFromString(payloads[value])
+    return dataset
+
+
+def _lock_reactions(cursor, hashes):
+    """Locks the stored reactions among sorted hashes, in order."""
+    cursor.execute(
+        'SELECT hash FROM reactions WHERE hash=ANY(%s::BYTEA[]) '
+        'ORDER BY hash FOR UPDATE', [hashes])
+    return {bytes(row[0]) for row in cursor.fetchall()}
+
+
+def add_references(cursor, hashes, payloads=None):
+    """Adds one reference to each distinct reaction, storing new ones.
+
+    Args:
+        cursor: psycopg2 cursor.
+        hashes: Iterable of reaction hashes; duplicates count once.
+        payloads: Optional dict mapping hashes to serialized Reactions, for
+            reactions that may not be stored yet.
+
+    Raises:
+        KeyError: A reaction is neither stored nor in payloads.
+    """
+    hashes = sorted(set(hashes))
+    if not hashes:
+        return
+    stored = _lock_reactions(cursor, hashes)
+    if stored:
+        cursor.execute(
+            'UPDATE reactions SET refs=refs+1 WHERE hash=ANY(%s::BYTEA[])',
+            [sorted(stored)])
+    missing = [value for value in hashes if value not in stored]
+    if missing:
+        payloads = payloads or {}
+        # Another writer may store the same reaction first.
+        psycopg2.extras.execute_values(
+            cursor, 'INSERT INTO reactions (hash, serialized, refs) VALUES %s '
+            'ON CONFLICT (hash) DO UPDATE SET refs=reactions.refs+1',
+            [(value, payloads[value]) for value in missing],
+            template='(%s, %s, 1)')
+
+
+def remove_references(cursor, counts):
+    """Removes references and deletes reactions that have none left.
+
+    Their summaries in the reaction_stats table go with them.
+
+    Args:
+        cursor: psycopg2 cursor.
+        counts: Dict mapping reaction hashes to the number of references to
+            remove.
+    """
+    hashes = sorted(value for value, count in counts.items() if count)
+    if not hashes:
+        return
+    _lock_reactions(cursor, hashes)
+    cursor.execute(
+        'UPDATE reactions SET refs=refs-removed.count FROM ('
+        '  SELECT UNNEST(%s::BYTEA[]) AS hash, UNNEST(%s::INTEGER[]) AS count'
+        ') AS removed WHERE reactions.hash=removed.hash',
+        [hashes, [counts[value] for value in hashes]])
+    cursor.execute(
+        'DELETE FROM reactions WHERE hash=ANY(%s::BYTEA[]) AND refs<=0 '
+        'RETURNING hash', [hashes])
+    deleted = [bytes(row[0]) for row in cursor.fetchall()]
+    if deleted:
+        cursor.execute('DELETE FROM reaction_stats WHERE hash=ANY(%s::BYTEA[])',
+                       [deleted])
+
+
+def record(cursor, user_id, name, dataset, split=None):
+    """Adds a revision for a Dataset that was just written.
+
+    Call this in the same transaction as the write.
+
+    Args:
+        cursor: psycopg2 cursor.
+        user_id: String owner of the dataset.
+        name: String dataset name.
+        dataset: Dataset; may be None if split is given.
+        split: Optional output of split_dataset(dataset), if already computed.
+
+    Returns:
+        The new revision number, or None if nothing changed since the previous
+        revision.
+    """
+    if split is None:
+        split = split_dataset(dataset)
+    header, payloads = split
+    hashes = [value for value, _ in payloads]
+    latest = latest_revision(cursor, user_id, name)
+    # (hashes, header) of the latest revision.
+    previous = ([], None) if latest is None else load_hashes(
+        cursor, user_id, name, latest)
+    operations = diff_hashes(previous[0], hashes)
+    if latest is not None and not operations and header == previous[1]:
+        return None
+    revision = 0 if latest is None else latest + 1
+    snapshot = revision % SNAPSHOT_INTERVAL == 0
+    if snapshot:
+        delta, stored = None, hashes
+    else:
+        delta, stored = _encode_delta(operations)
+    add_references(cursor, stored, dict(payloads))
+    cursor.execute(
+        'INSERT INTO revisions (user_id, name, revision, created_time, '
+        'snapshot, header, delta, hashes, num_reactions) '
+        'VALUES (%s, %s, %s, %s, %s, %s, %s, %s::BYTEA[], %s)', [
+            user_id, name, revision,
+            int(time.time()), snapshot, header, delta, stored,
+            len(hashes)
+        ])
+    if snapshot and revision > 0:
+        compact(cursor, user_id, name)
+    return revision
+
+
+def copy(cursor, user_id, name, target_user_id, target_name):
+    """Records the latest revision of one dataset as a snapshot of another.
+
+    Only the header and reaction hashes are written; the reactions themselves
+    are shared.
+
+    Returns:
+        The target's new revision number.
+
+    Raises:
+        KeyError: The source dataset has no revisions.
+    """
+    latest = latest_revision(cursor, user_id, name)
+    if latest is None:
+        raise KeyError(f'no revisions of {name}')
+    hashes, header = load_hashes(cursor, user_id, name, latest)
+    target_latest = latest_revision(cursor, target_user_id, target_name)
+    revision = 0 if target_latest is None else target_latest + 1
+    add_references(cursor, hashes)
+    cursor.execute(
+        'INSERT INTO revisions (user_id, name, revision, created_time, '
+        'snapshot, header, delta, hashes, num_reactions) '
+        'VALUES (%s, %s, %s, %s, TRUE, %s, NULL, %s::BYTEA[], %s)', [
+            target_user_id, target_name, revision,
+            int(time.time()), header, hashes,
+            len(hashes)
+        ])
+    return revision
+
+
+def list_revisions(cursor, user_id, name):
+    """Returns a list of dicts describing each revision, newest first."""
+    cursor.execute(
+        'SELECT revision, created_time, num_reactions, snapshot '
+        'FROM revisions WHERE user_id=%s AND name=%s ORDER BY revision DESC',
+        [user_id, name])
+    return [{
+        'revision': revision,
+        'created_time': created_time,
+        'num_reactions': num_reactions,
+        'snapshot': snapshot,
+    } for revision, created_time, num_reactions, snapshot in cursor]
+
+
+def compact(cursor, user_id, name, max_revisions=None, max_age=None):
+    """Applies the retention policy to one dataset's history.
+
+    Args:
+        cursor: psycopg2 cursor.
+        user_id: String owner of the dataset.
+        name: String dataset name.
+        max_revisions: Number of revisions to keep; defaults to MAX_REVISIONS.
+        max_age: Seconds to keep revisions; defaults to MAX_AGE. The newest
+            revision is always kept.
+
+    Returns:
+        The number of revisions deleted.
+    """
+    if max_revisions is None:
+        max_revisions = MAX_REVISIONS
+    if max_age is None:
+        max_age = MAX_AGE
+    cursor.execute(
+        'SELECT revision, created_time FROM revisions '
+        'WHERE user_id=%s AND name=%s ORDER BY revision DESC', [user_id, name])
+    rows = cursor.fetchall()
+    cutoff = time.time() - max_age
+    kept = 1
+    while (kept < min(len(rows), max_revisions) and rows[kept][1] >= cutoff):
+        kept += 1
+    if kept >= len(rows):
+        return 0
+    oldest = rows[kept - 1][0]
+    hashes, _ = load_hashes(cursor, user_id, name, oldest)
+    cursor.execute(
+        'SELECT hashes FROM revisions '
+        'WHERE user_id=%s AND name=%s AND revision=%s', [user_id, name, oldest])
+    previous = {bytes(value) for value in cursor.fetchone()[0]}
+    cursor.execute(
+        'UPDATE revisions SET snapshot=TRUE, delta=NULL, hashes=%s::BYTEA[] '
+        'WHERE user_id=%s AND name=%s AND revision=%s',
+        [hashes, user_id, name, oldest])
+    # The rewritten row refers to every reaction of its revision, and its
+    # delta only inserted some of them.
+    add_references(cursor, set(hashes) - previous)
+    removed = collections.Counter(previous - set(hashes))
+    cursor.execute(
+        'DELETE FROM revisions WHERE user_id=%s AND name=%s AND revision<%s '
+        'RETURNING hashes', [user_id, name, oldest])
+    for row in cursor.fetchall():
+        removed.update({bytes(value) for value in row[0]})
+    remove_references(cursor, removed)
+    return len(rows) - kept
+
+
+def delete_history(cursor, user_id, name=None):
+    """Deletes the history of a dataset, or of all of a user's datasets.
+
+    Call this in the same transaction as the delete of the datasets rows.
+
+    Args:
+        cursor: psycopg2 cursor.
+        user_id: String owner of the datasets.
+        name: Optional string dataset name; defaults to every dataset.
+
+    Returns:
+        The number of revisions deleted.
+    """
+    cursor.execute(
+        'DELETE FROM revisions WHERE user_id=%(user_id)s '
+        'AND (%(name)s IS NULL OR name=%(name)s) RETURNING hashes', {
+            'user_id': user_id,
+            'name': name
+        })
+    rows = cursor.fetchall()
+    removed = collections.Counter()
+    for row in rows:
+        removed.update({bytes(value) for value in row[0]})
+    remove_references(cursor, removed)
+    return len(rows)
@@ -0,0 +1,70 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for editor.py.revisions."""
+
+from absl.testing import absltest
+from absl.testing import parameterized
+
+from ord_schema.proto import dataset_pb2
+from ord_schema.proto import reaction_pb2
+
+import revisions  # pylint: disable=import-error
+
+
+class RevisionsTest(parameterized.TestCase, absltest.TestCase):
+
+    @parameterized.parameters(
+        ('abc', 'abc', 0),
+        ('abc', 'axc', 1),
+        ('abc', 'xbz', 2),
+        ('abc', 'ac', 1),
+        ('abc', 'abcd', 1),
+        ('', 'abc', 1),
+        ('abc', '', 1),
+        ('abcd', 'dcba', 4),
+    )
+    def test_diff_hashes(self, old, new, num_operations):
+        operations = revisions.diff_hashes(list(old), list(new))
+        self.assertLen(operations, num_operations)
+        hashes = list(old)
+        revisions.apply_delta(hashes, operations)
+        self.assertEqual(hashes, list(new))
+
+    def test_encode_delta(self):
+        operations = revisions.diff_hashes(list('abcde'), list('xbcy'))
+        delta, inserted = revisions._encode_delta(operations)  # pylint: disable=protected-access
+        self.assertEqual(
+            revisions._decode_delta(delta, inserted),  # pylint: disable=protected-access
+            operations)
+
+    def test_split_dataset(self):
+        dataset = dataset_pb2.Dataset(name='test',
+                                      description='split',
+                                      reaction_ids=['ord-1'])
+        dataset.reactions.add(reaction_id='ord-2')
+        dataset.reactions.add(reaction_id='ord-2')
+        header, payloads = revisions.split_dataset(dataset)
+        self.assertEqual(
+            dataset_pb2.Dataset.FromString(header),
+            dataset_pb2.Dataset(name='test',
+                                description='split',
+                                reaction_ids=['ord-1']))
+        self.assertLen(payloads, 2)
+        self.assertEqual(payloads[0], payloads[1])
+        self.assertEqual(reaction_pb2.Reaction.FromString(payloads[0][1]),
+                         dataset.reactions[0])
+
+
+if __name__ == '__main__':
+    absltest.main()
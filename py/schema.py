@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Creates or upgrades the editor database.
+
+Migrations are the numbered files in the schema/ directory. Each is applied at
+most once, in order, in its own transaction, and recorded in the
+schema_migrations table. SQL files are executed as written; Python files must
+define upgrade(cursor).
+
+To initialize or upgrade the editor database:
+
+    $ ./py/schema.py
+
+To drop everything and start from an empty database (e.g. for tests):
+
+    $ ./py/schema.py --reset
+"""
+
+import importlib.util
+import os
+import re
+import time
+
+from absl import app
+from absl import flags
+import psycopg2
+import psycopg2.extensions
+import psycopg2.sql
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string('host', os.getenv('POSTGRES_HOST', 'localhost'),
+                    'Postgres host.')
+flags.DEFINE_integer('port', int(os.getenv('POSTGRES_PORT', '5432')),
+                     'Postgres port.')
+flags.DEFINE_string('user', os.getenv('POSTGRES_USER', 'postgres'),
+                    'Postgres user.')
+flags.DEFINE_string('dbname', 'editor', 'Database to create or upgrade.')
+flags.DEFINE_boolean('reset', False,
+                     'If True, drop the database before migrating.')
+
+MIGRATIONS = os.path.join(os.path.dirname(__file__), '../schema')
+
+
+def list_migrations(directory=MIGRATIONS):
+    """Returns (version, path) tuples for each migration, in order."""
+    migrations = []
+    for filename in os.listdir(directory):
+        match = re.fullmatch(r'([0-9]+)_\w+\.(sql|py)', filename)
+        if match is None:
+            continue
+        migrations.append(
+            (int(match.group(1)), os.path.join(directory, filename)))
+    migrations.sort()
+    versions = [version for version, _ in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f'duplicate migration versions in {directory}')
+    return migrations
+
+
+def create_database(dbname, reset=False, **kwargs):
+    """Creates the database if it does not exist, optionally dropping it."""
+    conn = psycopg2.connect(dbname='postgres', **kwargs)
+    try:
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            if reset:
+                query = psycopg2.sql.SQL('DROP DATABASE IF EXISTS {}').format(
+                    psycopg2.sql.Identifier(dbname))
+                cursor.execute(query)
+            cursor.execute('SELECT 1 FROM pg_database WHERE datname=%s',
+                           [dbname])
+            if cursor.rowcount == 0:
+                query = psycopg2.sql.SQL('CREATE DATABASE {}').format(
+                    psycopg2.sql.Identifier(dbname))
+                cursor.execute(query)
+    finally:
+        conn.close()
+
+
+def apply_migration(cursor, path):
+    """Runs one migration file with the given cursor."""
+    if path.endswith('.sql'):
+        with open(path, 'rt') as f:
+            cursor.execute(f.read())
+    else:
+        spec = importlib.util.spec_from_file_location(
+            os.path.basename(path)[:-3], path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        module.upgrade(cursor)
+
+
+def migrate(conn, directory=MIGRATIONS):
+    """Applies all pending migrations.
+
+    Args:
+        conn: psycopg2 connection to the editor database.
+        directory: Directory containing the migration files.
+
+    Returns:
+        List of the versions that were applied.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute('CREATE TABLE IF NOT EXISTS schema_migrations ('
+                       'version INTEGER PRIMARY KEY, '
+                       'name TEXT NOT NULL, '
+                       'applied_time INTEGER NOT NULL)')
+        cursor.execute('SELECT version FROM schema_migrations')
+        applied = {row[0] for row in cursor}
+    conn.commit()
+    pending = []
+    for version, path in list_migrations(directory):
+        if version in applied:
+            continue
+        with conn.cursor() as cursor:
+            apply_migration(cursor, path)
+            cursor.execute(
+                'INSERT INTO schema_migrations VALUES (%s, %s, %s)',
+                [version, os.path.basename(path),
+                 int(time.time())])
+        conn.commit()
+        print(f'applied {os.path.basename(path)}')
+        pending.append(version)
+    return pending
+
+
+def main(argv):
+    del argv  # Only used by app.run().
+    kwargs = {
+        'host': FLAGS.host,
+        'port': FLAGS.port,
+        'user': FLAGS.user,
+        'password': os.getenv('POSTGRES_PASSWORD', ''),
+    }
+    create_database(FLAGS.dbname, reset=FLAGS.reset, **kwargs)
+    conn = psycopg2.connect(dbname=FLAGS.dbname, **kwargs)
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    app.run(main)
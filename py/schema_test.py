@@ -0,0 +1,109 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for editor.py.schema.
+
+The query plan tests EXPLAIN every literal query in serve.py against the
+editor database, which must be reachable as in serve_test.py. Sequential scans
+are disabled while planning, so a plan that still scans a whole table means no
+index can serve the query.
+"""
+
+import ast
+import os
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import psycopg2
+
+import schema  # pylint: disable=import-error
+
+SERVE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'serve.py')
+
+
+def extract_queries(path):
+    """Returns the literal strings passed to psycopg2.sql.SQL() in a file."""
+    with open(path, 'rt') as f:
+        tree = ast.parse(f.read())
+    queries = set()
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and
+                isinstance(node.func, ast.Attribute) and
+                node.func.attr == 'SQL' and node.args):
+            continue
+        try:
+            query = ast.literal_eval(node.args[0])
+        except ValueError:
+            continue  # Not a literal.
+        if isinstance(query, str):
+            queries.add(query)
+    return sorted(queries)
+
+
+class SchemaTest(absltest.TestCase):
+
+    def test_list_migrations(self):
+        versions = [version for version, _ in schema.list_migrations()]
+        self.assertEqual(versions, list(range(1, len(versions) + 1)))
+
+
+class QueryPlanTest(parameterized.TestCase, absltest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Connects to the editor database and applies the migrations."""
+        super().setUpClass()
+        cls.conn = psycopg2.connect(dbname='editor',
+                                    user=os.getenv('POSTGRES_USER', 'postgres'),
+                                    password=os.getenv('POSTGRES_PASSWORD', ''),
+                                    host=os.getenv('POSTGRES_HOST',
+                                                   'localhost'),
+                                    port=int(os.getenv('POSTGRES_PORT',
+                                                       '5432')))
+        schema.migrate(cls.conn)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+        super().tearDownClass()
+
+    def tearDown(self):
+        self.conn.rollback()
+        super().tearDown()
+
+    def explain(self, query):
+        """Returns the text of the plan for a query with dummy parameters."""
+        parts = query.split('%s')
+        prepared = parts[0]
+        for i, part in enumerate(parts[1:]):
+            prepared += f'${i + 1}{part}'
+        with self.conn.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+            cursor.execute(f'PREPARE explained AS {prepared}')
+            if len(parts) > 1:
+                # Untyped literals are coerced to each parameter's type.
+                values = ', '.join(["'0'"] * (len(parts) - 1))
+                cursor.execute(f'EXPLAIN EXECUTE explained({values})')
+            else:
+                cursor.execute('EXPLAIN EXECUTE explained')
+            return '\n'.join(row[0] for row in cursor)
+
+    @parameterized.parameters(extract_queries(SERVE))
+    def test_query_uses_index(self, query):
+        plan = self.explain(query)
+        if 'WHERE' in query:
+            self.assertNotIn('Seq Scan', plan, f'{query}\n{plan}')
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -14,38 +14,52 @@
 """A web editor for Open Reaction Database structures."""
 
 import base64
-import binascii
-import collections
+import concurrent.futures
 import contextlib
-import difflib
 import fcntl
 import io
 import json
 import os
-import pprint
 import re
-import time
+import tempfile
 import uuid
 
 import flask
-import github
 import google.protobuf.message
 from google.protobuf import text_format
 import psycopg2
 import psycopg2.sql
-import requests
 
-from ord_schema import templating
 from ord_schema import message_helpers
 from ord_schema import resolvers
-from ord_schema import validations
 from ord_schema.proto import dataset_pb2
 from ord_schema.proto import reaction_pb2
-from ord_schema.visualization import generate_text
-from ord_schema.visualization import drawing
 
-# pylint: disable=invalid-name,no-member,inconsistent-return-statements,assigning-non-slot
-app = flask.Flask(__name__, template_folder='../html')
+import admission
+import assets
+import compression
+import compute
+import dataset_diff
+import dataset_stats
+import dataset_store
+import lazy_import
+import metrics
+import profiling
+import reaction_index
+import reaction_operations
+import reaper
+import reviews
+import revisions
+import sessions
+import system_users
+
+# Only a few routes need these; see lazy_import.py and warm().
+requests = lazy_import.Module('requests')
+templating = lazy_import.Module('ord_schema.templating')
+export = lazy_import.Module('export')
+template_cache = lazy_import.Module('template_cache')
+LAZY_MODULES = (reviews.github, requests, templating, export, template_cache,
+                compute.generate_text, compute.drawing)
 
 # For dataset merges operations like byte-value uploads and enumeration.
 TEMP = '/tmp/ord-editor'
@@ -54,6 +68,25 @@ try:
 except FileExistsError:
     pass
 
+# Uploaded files larger than this many bytes are spooled to disk under TEMP.
+UPLOAD_SPOOL_SIZE = 1 << 20
+
+
+class Request(flask.Request):  # pylint: disable=too-many-ancestors
+    """Streams multipart file uploads into spooled temp files."""
+
+    def _get_file_stream(self, *args, **kwargs):  # pylint: disable=unused-argument
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE,
+                                             dir=TEMP)
+
+
+# pylint: disable=invalid-name,no-member,inconsistent-return-statements,assigning-non-slot
+app = flask.Flask(__name__, template_folder='../html')
+app.request_class = Request
+metrics.init_app(app)
+profiling.init_app(app)
+admission.init_app(app)  # Before init_user() opens a database connection.
+
 # Defaults for development, overridden in docker-compose.yml.
 POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'localhost')
 POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
@@ -63,10 +96,80 @@ POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD', '')
 GH_CLIENT_ID = os.getenv('GH_CLIENT_ID')
 GH_CLIENT_SECRET = os.getenv('GH_CLIENT_SECRET')
 
-# System user for immutable reactions imported from GitHub pull requests.
-REVIEWER = '8df09572f3c74dbcb6003e2eef8e48fc'
-# System user for automated testing.
-TESTER = '680b0d9fe649417cb092d790907bd5a5'
+# Number of rows rendered by preview_enumeration() by default and at most.
+PREVIEW_ROWS = 10
+MAX_PREVIEW_ROWS = 100
+
+# User IDs whose temp directories are known to exist.
+_user_paths = set()
+
+# Static assets are indexed at startup; see assets.py.
+ASSETS = {
+    kind:
+        assets.AssetTable(os.path.join(os.path.dirname(__file__), path),
+                          check_mtime=os.getenv('FLASK_ENV') == 'development')
+    for kind, path in [('css', '../css'), (
+        'img', '../img'), ('js', '../gen/js/ord'), ('ketcher',
+                                                    '../ketcher/dist')]
+}
+# Endpoints that serve ASSETS; these skip authentication and the database.
+STATIC_ENDPOINTS = frozenset(ASSETS)
+# Endpoints that need neither authentication nor the database.
+PUBLIC_ENDPOINTS = STATIC_ENDPOINTS | {'show_metrics'}
+
+# System users; see system_users.py.
+REVIEWER = system_users.REVIEWER
+TESTER = system_users.TESTER
+
+USER_ID_PATTERN = re.compile('^[0-9a-fA-F]{32}$')
+# See https://developer.mozilla.org/en-US/docs/Web/API/FileReader/readAsDataURL.
+DATA_URL_PATTERN = re.compile('data:.*?;base64,(.*)')
+
+# A small Reaction that exercises validation, rendering, and serialization.
+WARM_REACTION = """
+inputs {
+  key: "reactant"
+  value {
+    components {
+      identifiers { type: SMILES value: "CCO" }
+      amount { moles { value: 1.0 units: MILLIMOLE } }
+      reaction_role: REACTANT
+    }
+  }
+}
+outcomes {
+  products {
+    identifiers { type: SMILES value: "CC=O" }
+    measurements { type: YIELD percentage { value: 50 } }
+  }
+}
+provenance {
+  record_created {
+    time { value: "2020-01-01" }
+    person { username: "test" email: "test@example.com" }
+  }
+}
+"""
+
+
+def warm():
+    """Loads lazy modules and builds shared state ahead of requests.
+
+    gunicorn_config.py calls this in the master process when the app is
+    preloaded, so forked workers (and their compute pools) start with
+    everything imported and their memory pages are shared copy-on-write.
+    """
+    for module in LAZY_MODULES:
+        module.load()
+    reaction = text_format.Parse(WARM_REACTION, reaction_pb2.Reaction())
+    dataset = dataset_pb2.Dataset(name='warm', reactions=[reaction])
+    data = dataset.SerializeToString(deterministic=True)
+    reaction_index.split(data, reaction_index.scan(data))
+    text_format.MessageToString(dataset)
+    for message_name in ('Reaction', 'Dataset', 'Compound'):
+        message_helpers.create_message(message_name)
+    dataset_stats.summarize_reaction(reaction)
+    compute.render_reaction(reaction.SerializeToString())
 
 
 @app.route('/')
@@ -81,26 +184,61 @@ def health_check():
     return flask.make_response('', 200)
 
 
+@app.route('/metrics')
+def show_metrics():
+    """Exposes request, query, and codec timings for Prometheus."""
+    body, content_type = metrics.generate()
+    return flask.Response(body, content_type=content_type)
+
+
 @app.route('/datasets')
 def show_datasets():
     """Lists all the user's datasets in the datasets table."""
-    names = []
     with flask.g.db.cursor() as cursor:
-        query = psycopg2.sql.SQL('SELECT name FROM datasets WHERE user_id=%s')
-        cursor.execute(query, [flask.g.user_id])
-        for row in cursor:
-            names.append(row[0])
+        datasets = get_dataset_stats(cursor)
+        totals = dataset_stats.get_user(cursor, flask.g.user_id)
     if len(flask.g.user_name) == 32:
         client_id = GH_CLIENT_ID
     else:
         client_id = None
     return flask.render_template('datasets.html',
-                                 names=sorted(names),
+                                 datasets=datasets,
+                                 totals=totals,
+                                 yield_labels=dataset_stats.YIELD_LABELS,
                                  user_avatar=flask.g.user_avatar,
                                  user_name=flask.g.user_name,
                                  client_id=client_id)
 
 
+@app.route('/datasets/stats')
+def show_dataset_stats():
+    """Returns the user's dataset statistics and their totals as JSON.
+
+    Each yield_buckets list is labeled by yield_labels.
+    """
+    with flask.g.db.cursor() as cursor:
+        return flask.jsonify({
+            'datasets': get_dataset_stats(cursor),
+            'totals': dataset_stats.get_user(cursor, flask.g.user_id),
+            'yield_labels': dataset_stats.YIELD_LABELS,
+        })
+
+
+def get_dataset_stats(cursor):
+    """Returns a list of summary dicts for the user's datasets, by name."""
+    query = psycopg2.sql.SQL(
+        'SELECT name, num_reactions, size, num_compounds, num_errors, '
+        'yield_buckets, updated_time FROM datasets WHERE user_id=%s '
+        'ORDER BY name')
+    cursor.execute(query, [flask.g.user_id])
+    datasets = []
+    for row in cursor:
+        summary = dataset_stats.from_row(row[1:-1])
+        summary.update(name=row[0], updated_time=row[-1])
+        datasets.append(summary)
+    return datasets
+
+
 @app.route('/dataset/<name>')
 def show_dataset(name):
     """Lists all Reactions contained in the named dataset."""
@@ -140,6 +278,33 @@ def download_dataset(name, kind='pb'):
                            attachment_filename=f'{name}.{kind}')
 
 
+@app.route('/dataset/<name>/export/<kind>')
+def export_dataset(name, kind):
+    """Streams a Dataset flattened to one row per compound; see export.py.
+
+    Args:
+        name: The dataset to export.
+        kind: "csv" or "parquet".
+    """
+    if kind not in export.MIMETYPES:
+        flask.abort(flask.make_response(f'unsupported format: {kind}', 406))
+    if kind == 'parquet' and export.pyarrow is None:
+        flask.abort(flask.make_response('Parquet export is unavailable', 406))
+    dataset_name, reactions = get_serialized_reactions(name)
+    executor = None
+    if len(reactions) >= export.POOL_THRESHOLD:
+        executor = compute.Executor()
+    batches = export.flatten_serialized(dataset_name,
+                                        reactions,
+                                        executor=executor)
+    response = flask.Response(export.write(batches, kind),
+                              mimetype=export.MIMETYPES[kind])
+    response.headers.set('Content-Disposition',
+                         'attachment',
+                         filename=f'{name}.{kind}')
+    return response
+
+
 @app.route('/dataset/<name>/upload', methods=['POST'])
 def upload_dataset(name):
     """Writes the request body to the datasets table without validation."""
@@ -152,10 +317,8 @@ def upload_dataset(name):
         except (google.protobuf.message.DecodeError, TypeError):
             dataset = dataset_pb2.Dataset()
             text_format.Parse(flask.request.get_data(as_text=True), dataset)
-        user_id = flask.g.user_id
         with flask.g.db.cursor() as cursor:
-            query = psycopg2.sql.SQL('INSERT INTO datasets VALUES (%s, %s, %s)')
-            cursor.execute(query, [user_id, name, serialize_for_db(dataset)])
+            dataset_store.insert_dataset(cursor, flask.g.user_id, name, dataset)
             flask.g.db.commit()
         return 'ok'
     except Exception as error:  # pylint: disable=broad-except
@@ -169,25 +332,138 @@ def new_dataset(name):
         response = flask.make_response(f'dataset already exists: {name}', 409)
         flask.abort(response)
     with flask.g.db.cursor() as cursor:
-        query = psycopg2.sql.SQL('INSERT INTO datasets VALUES (%s, %s, %s)')
-        user_id = flask.g.user_id
-        cursor.execute(query, [user_id, name, ''])
+        dataset_store.insert_dataset(cursor, flask.g.user_id, name,
+                                     dataset_pb2.Dataset())
         flask.g.db.commit()
     return 'ok'
 
 
 @app.route('/dataset/<name>/delete')
 def delete_dataset(name):
-    """Removes a Dataset."""
+    """Removes a Dataset and its revision history."""
     with flask.g.db.cursor() as cursor:
         query = psycopg2.sql.SQL(
-            'DELETE FROM datasets WHERE user_id=%s AND name=%s')
+            'DELETE FROM datasets WHERE user_id=%s AND name=%s '
+            'RETURNING num_reactions, size, num_compounds, num_errors, '
+            'yield_buckets')
         user_id = flask.g.user_id
         cursor.execute(query, [user_id, name])
+        old = dataset_stats.from_row(cursor.fetchone())
+        if old is not None:
+            dataset_stats.update_user(cursor, user_id, old, None)
+        revisions.delete_history(cursor, user_id, name)
         flask.g.db.commit()
     return flask.redirect('/datasets')
 
 
+@app.route('/dataset/<name>/copy/<new_name>', methods=['POST'])
+def copy_dataset(name, new_name):
+    """Copies a dataset without duplicating its reactions.
+
+    The copy shares the reactions of the source's latest revision and stores
+    only their hashes; see revisions.copy(). It gets its own serialized proto
+    the first time it is written. The review user may pass a user_id query
+    parameter to copy into another user's space.
+    """
+    user_id = flask.request.args.get('user_id', flask.g.user_id)
+    if flask.g.user_id not in (user_id, REVIEWER):
+        flask.abort(403)
+    with flask.g.db.cursor() as cursor:
+        query = psycopg2.sql.SQL('SELECT 1 FROM users WHERE user_id=%s')
+        cursor.execute(query, [user_id])
+        if cursor.rowcount == 0:
+            flask.abort(flask.make_response(f'no such user: {user_id}', 404))
+        query = psycopg2.sql.SQL(
+            'SELECT 1 FROM datasets WHERE user_id=%s AND name=%s')
+        cursor.execute(query, [user_id, new_name])
+        if cursor.rowcount > 0:
+            flask.abort(
+                flask.make_response(f'dataset already exists: {new_name}', 409))
+        try:
+            dataset_store.copy_dataset(cursor, flask.g.user_id, name, user_id,
+                                       new_name)
+        except KeyError:
+            flask.abort(404)
+    flask.g.db.commit()
+    return 'ok'
+
+
+@app.route('/dataset/<name>/revisions')
+def list_revisions(name):
+    """Lists the saved revisions of a dataset, newest first, as JSON."""
+    with flask.g.db.cursor() as cursor:
+        return flask.jsonify(
+            revisions.list_revisions(cursor, flask.g.user_id, name))
+
+
+@app.route('/dataset/<name>/revision/<int:revision>')
+def read_revision(name, revision):
+    """Returns a past revision of a Dataset as a serialized protobuf."""
+    with flask.g.db.cursor() as cursor:
+        dataset = revisions.load(cursor, flask.g.user_id, name, revision)
+    if dataset is None:
+        flask.abort(404)
+    bites = dataset.SerializeToString(deterministic=True)
+    response = flask.make_response(bites)
+    response.headers.set('Content-Type', 'application/protobuf')
+    return response
+
+
+@app.route('/dataset/<name>/revision/<int:revision>/restore', methods=['POST'])
+def restore_revision(name, revision):
+    """Overwrites a dataset with one of its past revisions.
+
+    The restore is itself recorded as a new revision.
+    """
+    if flask.g.user_id == REVIEWER:
+        flask.abort(403)
+    with flask.g.db.cursor() as cursor:
+        dataset = revisions.load(cursor, flask.g.user_id, name, revision)
+    if dataset is None:
+        flask.abort(404)
+    put_dataset(name, dataset)
+    return flask.redirect(f'/dataset/{name}')
+
+
+def read_enumerate_request():
+    """Parses the body of an enumeration request.
+
+    The request is either multipart/form-data with a "spreadsheet" file and
+    a "template" file (or "template_string" field), or a json object; see
+    enumerate_dataset. Multipart uploads are streamed to a spooled temp file
+    (see Request) that is read in place.
+
+    Returns:
+        (basename of the spreadsheet, compiled template, DataFrame, dict of
+        the remaining request fields) tuple.
+    """
+    if flask.request.mimetype == 'multipart/form-data':
+        data = flask.request.form.to_dict()
+        spreadsheet = flask.request.files['spreadsheet']
+        basename, suffix = os.path.splitext(spreadsheet.filename)
+        if 'template' in flask.request.files:
+            template_string = flask.request.files['template'].read().decode()
+        else:
+            template_string = data['template_string']
+        dataframe = templating.read_spreadsheet(spreadsheet.stream,
+                                                suffix=suffix)
+        spreadsheet.close()
+    else:
+        data = flask.request.get_json(force=True)
+        basename, suffix = os.path.splitext(data['spreadsheet_name'])
+        if data['spreadsheet_data'].startswith('data:'):
+            # Remove the data URL prefix.
+            match = DATA_URL_PATTERN.fullmatch(data['spreadsheet_data'])
+            spreadsheet_data = match.group(1)
+        else:
+            spreadsheet_data = data['spreadsheet_data']
+        spreadsheet_data = io.BytesIO(base64.b64decode(spreadsheet_data))
+        dataframe = templating.read_spreadsheet(spreadsheet_data, suffix=suffix)
+        template_string = data['template_string']
+    compiled = template_cache.compile_template(template_string)
+    return basename, compiled, dataframe, data
+
+
 @app.route('/dataset/enumerate', methods=['POST'])
 def enumerate_dataset():
     """Creates a new dataset based on a template reaction and a spreadsheet.
@@ -198,40 +474,74 @@ def enumerate_dataset():
             spreadsheet.
         template_string: a string containing a text-formatted Reaction proto,
             i.e., the contents of a pbtxt file.
-    A new dataset is created from the template and spreadsheet using
-    ord_schema.templating.generate_dataset.
+    Alternatively, POST multipart/form-data with the spreadsheet as a
+    "spreadsheet" file and the template as a "template" file or a
+    "template_string" field. This avoids base64 and keeps a single copy of the
+    spreadsheet, on disk if it is large.
+    A new dataset is created from the template and spreadsheet; the result is
+    the same as ord_schema.templating.generate_dataset.
     """
     try:
-        data = flask.request.get_json(force=True)
-        basename, suffix = os.path.splitext(data['spreadsheet_name'])
-        if data['spreadsheet_data'].startswith('data:'):
-            # Remove the data URL prefix; see
-            # https://developer.mozilla.org/en-US/docs/Web/API/FileReader/readAsDataURL.
-            match = re.fullmatch('data:.*?;base64,(.*)',
-                                 data['spreadsheet_data'])
-            spreadsheet_data = match.group(1)
-        else:
-            spreadsheet_data = data['spreadsheet_data']
-        spreadsheet_data = io.BytesIO(base64.b64decode(spreadsheet_data))
-        dataframe = templating.read_spreadsheet(spreadsheet_data, suffix=suffix)
-        dataset = templating.generate_dataset(data['template_string'],
-                                              dataframe,
-                                              validate=False)
+        basename, compiled, dataframe, _ = read_enumerate_request()
+        dataset = compiled.generate(dataframe)
         put_dataset(f'{basename}_dataset', dataset)
         return 'ok'
     except Exception as error:  # pylint: disable=broad-except
         flask.abort(flask.make_response(str(error), 406))
 
 
+@app.route('/dataset/enumerate/preview', methods=['POST'])
+def preview_enumeration():
+    """Renders and validates the first rows of an enumeration.
+
+    Takes the same request as enumerate_dataset, plus an optional "rows"
+    (default PREVIEW_ROWS, at most MAX_PREVIEW_ROWS). Nothing is stored.
+    Returns json with the total number of rows, the placeholders, and for each
+    previewed row either the Reaction (pbtxt, HTML summary, validation errors
+    and warnings) or the error that prevented it from being generated.
+    """
+    try:
+        _, compiled, dataframe, data = read_enumerate_request()
+        columns = compiled.columns(dataframe)
+        num_rows = int(data.get('rows', PREVIEW_ROWS))
+    except Exception as error:  # pylint: disable=broad-except
+        flask.abort(flask.make_response(str(error), 406))
+    num_rows = max(0, min(num_rows, MAX_PREVIEW_ROWS))
+    rows = []
+    for _, row in dataframe[columns].head(num_rows).iterrows():
+        try:
+            reaction = compiled.fill(
+                dict(zip(compiled.placeholders, row.values)))
+        except ValueError as error:
+            rows.append({'error': str(error)})
+            continue
+        data = reaction.SerializeToString()
+        with metrics.VALIDATION_SECONDS.time():
+            errors, warnings = run_compute('validate', compute.validate,
+                                           'Reaction', data)
+        with metrics.RENDER_SECONDS.labels('reaction').time():
+            html = run_compute('render_reaction', compute.render_reaction, data)
+        rows.append({
+            'pbtxt': text_format.MessageToString(reaction),
+            'html': html,
+            'errors': list(map(_adjust_error, errors)),
+            'warnings': list(map(_adjust_error, warnings)),
+        })
+    return flask.jsonify({
+        'num_rows': len(dataframe),
+        'placeholders': compiled.placeholders,
+        'rows': rows,
+    })
+
+
 @app.route('/dataset/<name>/reaction/<index>')
 def show_reaction(name, index):
     """Render the page representing a single Reaction."""
-    dataset = get_dataset(name)
     try:
         index = int(index)
     except ValueError:
         flask.abort(404)
-    if len(dataset.reactions) <= index:
+    if count_reactions(name) <= index:
         flask.abort(404)
     # Reactions belonging to the "review" user are immutable.
     freeze = flask.g.user_id == REVIEWER
@@ -271,41 +581,33 @@ def download_reaction():
 @app.route('/dataset/<name>/new/reaction')
 def new_reaction(name):
     """Adds a new Reaction to the named Dataset and redirects to it."""
-    dataset = get_dataset(name)
-    reaction = dataset.reactions.add()
-    reaction.reaction_id = f'ord-{uuid.uuid4().hex}'
-    put_dataset(name, dataset)
+    reaction = reaction_pb2.Reaction(reaction_id=f'ord-{uuid.uuid4().hex}')
+    splice_reactions(name, None, None, [reaction])
     return flask.redirect(f'/dataset/{name}')
 
 
 @app.route('/dataset/<name>/clone/<index>')
 def clone_reaction(name, index):
     """Copies a specific Reaction to the Dataset and view the Reaction."""
-    dataset = get_dataset(name)
     try:
         index = int(index)
     except ValueError:
         flask.abort(404)
-    if len(dataset.reactions) <= index:
+    reaction = get_reaction(name, index)
+    if reaction is None:
         flask.abort(404)
-    dataset.reactions.add().CopyFrom(dataset.reactions[index])
-    index = len(dataset.reactions) - 1
-    put_dataset(name, dataset)
+    index = splice_reactions(name, None, None, [reaction])
     return flask.redirect(f'/dataset/{name}/reaction/{index}')
 
 
 @app.route('/dataset/<name>/delete/reaction/<index>')
 def delete_reaction(name, index):
     """Removes a specific Reaction from the Dataset and view the Dataset."""
-    dataset = get_dataset(name)
     try:
         index = int(index)
-    except ValueError:
+        splice_reactions(name, index, index + 1, [])
+    except (ValueError, IndexError):
         flask.abort(404)
-    if len(dataset.reactions) <= index:
-        flask.abort(404)
-    del dataset.reactions[index]
-    put_dataset(name, dataset)
     return flask.redirect(f'/dataset/{name}')
 
 
@@ -326,26 +628,82 @@ def delete_reaction_id_blank(name):
     return delete_reaction_id(name, '')
 
 
+@app.route('/dataset/<name>/reactions', methods=['POST'])
+def edit_reactions(name):
+    """Applies a batch of reaction operations to a Dataset in one write.
+
+    The request body is a JSON list of operations; see reaction_operations.py.
+    If any operation is invalid, nothing is written and the response is 400.
+
+    Returns:
+        JSON with "sources", the original index of each resulting reaction
+        (null for added reactions), and "mapping", the resulting index of each
+        original reaction (null if deleted; the first if cloned).
+    """
+    operations = flask.request.get_json(force=True)
+    with flask.g.db.cursor() as cursor:
+        # Hold the row until put_dataset() commits so that concurrent saves
+        # cannot interleave with this read-modify-write.
+        query = psycopg2.sql.SQL('SELECT 1 FROM datasets '
+                                 'WHERE user_id=%s AND name=%s FOR UPDATE')
+        cursor.execute(query, [flask.g.user_id, name])
+    dataset = get_dataset(name)
+    mapping = [None] * len(dataset.reactions)
+    try:
+        sources = reaction_operations.apply(dataset, operations)
+    except (AttributeError, KeyError, TypeError, ValueError) as error:
+        flask.g.db.rollback()
+        flask.abort(flask.make_response(f'invalid operation: {error!r}', 400))
+    put_dataset(name, dataset)
+    for index, source in reversed(list(enumerate(sources))):
+        if source is not None:
+            mapping[source] = index
+    return flask.jsonify({'sources': sources, 'mapping': mapping})
+
+
 @app.route('/dataset/proto/read/<name>')
 def read_dataset(name):
-    """Returns a Dataset as a serialized protobuf."""
+    """Returns a Dataset as a serialized protobuf, compressed if accepted."""
     dataset = get_dataset(name)
     bites = dataset.SerializeToString(deterministic=True)
-    response = flask.make_response(bites)
-    response.headers.set('Content-Type', 'application/protobuf')
-    return response
+    return compression.send_bytes(bites, 'application/protobuf')
 
 
 @app.route('/dataset/proto/write/<name>', methods=['POST'])
 def write_dataset(name):
-    """Inserts a protobuf including upload tokens into the datasets table."""
+    """Inserts a protobuf including upload tokens into the datasets table.
+
+    The body may have Content-Encoding gzip or deflate; see compression.py.
+    """
     dataset = dataset_pb2.Dataset()
-    dataset.ParseFromString(flask.request.get_data())
+    dataset.ParseFromString(compression.read_body())
     resolve_tokens(dataset)
     put_dataset(name, dataset)
     return 'ok'
 
 
+@app.route('/dataset/proto/read/<name>/reaction/<int:index>')
+def read_reaction(name, index):
+    """Returns one Reaction of a Dataset as a serialized protobuf."""
+    reaction = get_reaction(name, index)
+    if reaction is None:
+        flask.abort(404)
+    return compression.send_bytes(
+        reaction.SerializeToString(deterministic=True), 'application/protobuf')
+
+
+@app.route('/dataset/proto/write/<name>/reaction/<int:index>', methods=['POST'])
+def write_reaction(name, index):
+    """Replaces one Reaction of a Dataset, including upload tokens."""
+    reaction = reaction_pb2.Reaction.FromString(compression.read_body())
+    resolve_tokens(reaction)
+    try:
+        splice_reactions(name, index, index + 1, [reaction])
+    except IndexError:
+        flask.abort(404)
+    return 'ok'
+
+
 @app.route('/dataset/proto/upload/<name>/<token>', methods=['POST'])
 def write_upload(name, token):
     """Writes the POST body, names it <token>, and maybe updates the dataset.
@@ -409,20 +767,47 @@ def _adjust_error(error: str) -> str:
     return message.strip()
 
 
+def run_compute(task, function, *args, cached=False):
+    """Runs a compute.py task in the compute pool.
+
+    If cached is True, results are reused for identical arguments; see
+    compute.run_cached(). Aborts with 503 (and Retry-After) if the pool is
+    saturated, or 504 if the task does not finish in time.
+    """
+    try:
+        if cached:
+            return compute.run_cached(function, *args)
+        return compute.run(function, *args)
+    except compute.Busy as error:
+        metrics.COMPUTE_FAILURES.labels(task, 'busy').inc()
+        response = flask.make_response(str(error), 503)
+        response.headers['Retry-After'] = '1'
+        flask.abort(response)
+    except concurrent.futures.TimeoutError:
+        metrics.COMPUTE_FAILURES.labels(task, 'timeout').inc()
+        flask.abort(flask.make_response(f'{task} timed out', 504))
+    except compute.BrokenProcessPool:
+        metrics.COMPUTE_FAILURES.labels(task, 'crash').inc()
+        flask.abort(flask.make_response(f'{task} failed', 500))
+
+
 @app.route('/dataset/proto/validate/<message_name>', methods=['POST'])
 def validate_reaction(message_name):
     """Receives a serialized Reaction protobuf and runs validations."""
+    data = flask.request.get_data()
     message = message_helpers.create_message(message_name)
-    message.ParseFromString(flask.request.get_data())
+    message.ParseFromString(data)
     if message == type(message)():
         # Do not try to validate empty messages.
         return json.dumps({'errors': [], 'warnings': []})
-    options = validations.ValidationOptions(require_provenance=True)
-    output = validations.validate_message(message,
-                                          raise_on_error=False,
-                                          options=options)
-    errors = list(map(_adjust_error, output.errors))
-    warnings = list(map(_adjust_error, output.warnings))
+    with metrics.VALIDATION_SECONDS.time():
+        errors, warnings = run_compute('validate',
+                                       compute.validate,
+                                       message_name,
+                                       data,
+                                       cached=True)
+    errors = list(map(_adjust_error, errors))
+    warnings = list(map(_adjust_error, warnings))
     return json.dumps({'errors': errors, 'warnings': warnings})
 
 
@@ -457,7 +842,9 @@ def resolve_compound(identifier_type):
 @app.route('/canonicalize', methods=['POST'])
 def canonicalize_smiles():
     """Canonicalizes a SMILES string from a POST request."""
-    return flask.jsonify(_canonicalize_smiles(flask.request.get_data()))
+    return flask.jsonify(
+        run_compute('canonicalize', compute.canonicalize_smiles,
+                    flask.request.get_data()))
 
 
 def _canonicalize_smiles(smiles):
@@ -472,78 +859,79 @@ def _canonicalize_smiles(smiles):
 def render_reaction():
     """Receives a serialized Reaction message and returns a block of HTML
     that contains a visual summary of the reaction."""
-    reaction = reaction_pb2.Reaction()
-    reaction.ParseFromString(flask.request.get_data())
+    data = flask.request.get_data()
+    reaction = reaction_pb2.Reaction.FromString(data)
     if not (reaction.inputs or reaction.outcomes):
         return ''
-    try:
-        html = generate_text.generate_html(reaction)
-        return flask.jsonify(html)
-    except (ValueError, KeyError):
+    with metrics.RENDER_SECONDS.labels('reaction').time():
+        html = run_compute('render_reaction',
+                           compute.render_reaction,
+                           data,
+                           cached=True)
+    if html is None:
         return ''
+    return flask.jsonify(html)
 
 
 @app.route('/render/compound', methods=['POST'])
 def render_compound():
     """Returns an HTML-tagged SVG for the given Compound."""
-    compound = reaction_pb2.Compound()
-    compound.ParseFromString(flask.request.get_data())
-    try:
-        mol = message_helpers.mol_from_compound(compound)
-        return flask.jsonify(drawing.mol_to_svg(mol))
-    except ValueError:
+    with metrics.RENDER_SECONDS.labels('compound').time():
+        svg = run_compute('render_compound',
+                          compute.render_compound,
+                          flask.request.get_data(),
+                          cached=True)
+    if svg is None:
         return ''
+    return flask.jsonify(svg)
 
 
 @app.route('/dataset/proto/compare/<name>', methods=['POST'])
 def compare(name):
     """For testing, compares a POST body to an entry in the datasets table.
 
-    Returns HTTP status 200 if their pbtxt representations are equal as strings
-    and 409 if they are not. See "make test".
+    See "make test".
 
     Args:
         name: The dataset record to compare.
 
     Returns:
-        HTTP status 200 for a match and 409 if there is a difference.
+        HTTP status 200 for a match and 409 with a JSON diff report (see
+        dataset_diff.py) if there is a difference.
     """
     remote = dataset_pb2.Dataset()
     remote.ParseFromString(flask.request.get_data())
     local = get_dataset(name)
-    remote_ascii = text_format.MessageToString(remote)
-    local_ascii = text_format.MessageToString(local)
-    if remote_ascii != local_ascii:
-        diff = difflib.context_diff(local_ascii.splitlines(),
-                                    remote_ascii.splitlines(),
-                                    n=10)
-        print(f'Datasets differ:\n{pprint.pformat(list(diff))}')
-        return 'differs', 409  # "Conflict"
+    report = dataset_diff.diff_datasets(local, remote)
+    if not dataset_diff.is_empty(report):
+        print(f'Datasets differ:\n{json.dumps(report, indent=2)}')
+        return flask.jsonify(report), 409  # "Conflict"
     return 'equals'
 
 
+@app.route('/dataset/<name>/diff/<other>')
+def diff_datasets(name, other):
+    """Returns a JSON structural diff from one dataset to another."""
+    return flask.jsonify(
+        dataset_diff.diff_datasets(get_dataset(name), get_dataset(other)))
+
+
 @app.route('/js/<script>')
 def js(script):
     """Accesses any built JS file by name from the Closure output directory."""
-    path = flask.safe_join(
-        os.path.join(os.path.dirname(__file__), '../gen/js/ord'), script)
-    return flask.send_file(get_file(path), attachment_filename=script)
+    return assets.send(ASSETS['js'], script)
 
 
 @app.route('/css/<sheet>')
 def css(sheet):
     """Accesses any CSS file by name."""
-    path = flask.safe_join(os.path.join(os.path.dirname(__file__), '../css'),
-                           sheet)
-    return flask.send_file(get_file(path), attachment_filename=sheet)
+    return assets.send(ASSETS['css'], sheet)
 
 
 @app.route('/img/<image>')
 def img(image):
     """For static images, currently used only by the template editor."""
-    path = flask.safe_join(os.path.join(os.path.dirname(__file__), '../img'),
-                           image)
-    return flask.send_file(get_file(path), attachment_filename=image)
+    return assets.send(ASSETS['img'], image)
 
 
 @app.route('/ketcher/iframe')
@@ -561,9 +949,13 @@ def indigo():
 @app.route('/ketcher/<path:file>')
 def ketcher(file):
     """Accesses any built Ketcher file by name."""
-    path = flask.safe_join(
-        os.path.join(os.path.dirname(__file__), '../ketcher/dist'), file)
-    return flask.send_file(get_file(path), attachment_filename=file)
+    return assets.send(ASSETS['ketcher'], file)
+
+
+@app.template_global()
+def asset_url(kind, name):
+    """Returns a content-versioned URL for a static asset, for templates."""
+    return assets.url(ASSETS[kind], f'/{kind}', name)
 
 
 @app.route('/reaction/id/deps.js')
@@ -580,33 +972,59 @@ def deps(value=None):
 @app.route('/ketcher/molfile', methods=['POST'])
 def get_molfile():
     """Retrieves a POSTed Compound message string and returns a MolFile."""
-    compound = reaction_pb2.Compound()
-    compound.ParseFromString(flask.request.get_data())
-    try:
-        molblock = message_helpers.molblock_from_compound(compound)
-        return flask.jsonify(molblock)
-    except ValueError:
+    with metrics.RENDER_SECONDS.labels('molfile').time():
+        molblock = run_compute('molfile', compute.molfile,
+                               flask.request.get_data())
+    if molblock is None:
         return 'no existing structural identifier', 204
+    return flask.jsonify(molblock)
 
 
 @app.route('/review')
 def show_submissions():
-    """For the review user only, render datasets with GitHub metadata."""
+    """For the review user only, render datasets with GitHub metadata.
+
+    Each dataset is shown with the summary computed when it was synced; see
+    review_summary.py.
+    """
     if flask.g.user_id != REVIEWER:
         return flask.redirect('/')
-    pull_requests = collections.defaultdict(list)
     with flask.g.db.cursor() as cursor:
-        query = psycopg2.sql.SQL('SELECT name FROM datasets WHERE user_id=%s')
-        cursor.execute(query, [REVIEWER])
-        for row in cursor:
-            name = row[0]
-            match = re.match('^PR_([0-9]+) ___(.*)___ (.*)', name)
-            if match is None:
-                continue
-            number, title, short_name = match.groups()
-            pull_requests[(number, title)].append((short_name, name))
+        pull_requests, names = reviews.list_submissions(cursor)
     return flask.render_template('submissions.html',
-                                 pull_requests=pull_requests)
+                                 pull_requests=pull_requests,
+                                 names=names)
+
+
+@app.route('/review/diff')
+def show_review_diff():
+    """For the review user only, render the diff between two datasets.
+
+    Without an "old" dataset, shows the stored diff of "new" against its
+    version on the base branch.
+    """
+    if flask.g.user_id != REVIEWER:
+        return flask.redirect('/')
+    old = flask.request.args.get('old')
+    new = flask.request.args.get('new')
+    if not new:
+        return flask.redirect('/review')
+    if old:
+        report = dataset_diff.diff_datasets(get_dataset(old), get_dataset(new))
+        return flask.render_template('diff.html',
+                                     old=old,
+                                     new=new,
+                                     report=report,
+                                     link_old=True)
+    with flask.g.db.cursor() as cursor:
+        summary = reviews.load_summary(cursor, new)
+    if summary is None:
+        flask.abort(404)
+    return flask.render_template('diff.html',
+                                 old='base branch',
+                                 new=new,
+                                 report=summary['diff'],
+                                 link_old=False)
 
 
 @app.route('/review/sync')
@@ -615,71 +1033,163 @@ def sync_reviews():
 
     These datasets have two extra pieces of metadata: a GitHub PR number and
     the PR title text. These are encoded into the dataset name in Postgres
-    using delimiters."""
+    using delimiters. Each file's version on the base branch is fetched too,
+    for the summaries shown by /review; see reviews.py."""
     if flask.g.user_id != REVIEWER:
         return flask.redirect('/')
-    client = github.Github()
-    repo = client.get_repo('Open-Reaction-Database/ord-data')
-    user_id = flask.g.user_id
+    store_reviews(reviews.fetch())
+    return flask.redirect('/review')
+
+
+def store_reviews(submissions):
+    """Replaces all the review user's datasets; see reviews.store()."""
     with flask.g.db.cursor() as cursor:
-        # First reset all datasets under review.
-        query = psycopg2.sql.SQL('DELETE FROM datasets WHERE user_id=%s')
-        cursor.execute(query, [REVIEWER])
-        # Then import all datasets from open PR's.
-        for pr in repo.get_pulls():
-            for remote in pr.get_files():
-                response = requests.get(remote.raw_url)
-                if remote.filename.endswith('.pbtxt'):
-                    dataset = dataset_pb2.Dataset()
-                    text_format.Parse(response.text, dataset)
-                elif remote.filename.endswith('.pb'):
-                    dataset = dataset_pb2.Dataset.FromString(response.content)
-                else:
-                    continue
-                prefix = remote.filename[:-6]
-                name = f'PR_{pr.number} ___{pr.title}___ {prefix}'
-                query = psycopg2.sql.SQL(
-                    'INSERT INTO datasets VALUES (%s, %s, %s)')
-                cursor.execute(
-                    query,
-                    [user_id, name, serialize_for_db(dataset)])
+        reviews.store(cursor, submissions)
     flask.g.db.commit()
-    return flask.redirect('/review')
 
 
 @app.after_request
 def prevent_caching(response):
     """Prevents caching any of this app's resources on the client."""
+    # Make the user ID accessible for logging.
+    response.headers['User-Id'] = flask.g.get('user_id', 'unknown')
+    if flask.request.endpoint in STATIC_ENDPOINTS:
+        # Static assets carry their own validators and cache lifetimes.
+        return response
     response.headers['Cache-Control'] = 'no-cache,no-store,must-revalidate'
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '0'
     response.headers['Cache-Control'] = 'public, max-age=0'
-    # Make the user ID accessible for logging.
-    response.headers['User-Id'] = flask.g.get('user_id', 'unknown')
     return response
 
 
+@app.teardown_request
+def close_db(exception):
+    """Releases the request's database connection, if it opened one."""
+    del exception  # Unused.
+    db = flask.g.pop('db', None)
+    if db is not None:
+        db.close()
+
+
 def get_dataset(name):
-    """Reads a serialized proto from the datasets table and parses it."""
+    """Reads a dataset from the datasets table; see dataset_store.py."""
+    with flask.g.db.cursor() as cursor:
+        try:
+            return dataset_store.read_dataset(cursor, flask.g.user_id, name)
+        except KeyError:
+            flask.abort(404)
+
+
+def get_serialized_reactions(name):
+    """Reads a dataset's Reactions as bytes, without parsing them.
+
+    The Reactions are sliced out of the serialized proto with its offset index
+    (see reaction_index.py); only the rest of the Dataset is parsed. Copies
+    that have no serialized proto are read with get_dataset().
+
+    Returns:
+        (Dataset name, list of serialized Reactions) tuple.
+    """
+    with flask.g.db.cursor() as cursor:
+        try:
+            serialized, offsets = dataset_store.read_serialized(
+                cursor, flask.g.user_id, name)
+        except KeyError:
+            flask.abort(404)
+    if serialized is None:
+        dataset = get_dataset(name)
+        return dataset.name, [
+            reaction.SerializeToString() for reaction in dataset.reactions
+        ]
+    header = dataset_pb2.Dataset.FromString(
+        reaction_index.strip(serialized, offsets))
+    return header.name, [
+        serialized[offset:offset + length] for offset, length in offsets
+    ]
+
+
+def count_reactions(name):
+    """Returns the number of Reactions in a dataset without reading it."""
     with flask.g.db.cursor() as cursor:
         query = psycopg2.sql.SQL(
-            'SELECT serialized FROM datasets WHERE user_id=%s AND name=%s')
+            'SELECT num_reactions FROM datasets WHERE user_id=%s AND name=%s')
         cursor.execute(query, [flask.g.user_id, name])
         if cursor.rowcount == 0:
             flask.abort(404)
-        serialized = binascii.unhexlify(cursor.fetchone()[0].tobytes())
-        return dataset_pb2.Dataset.FromString(serialized)
+        return cursor.fetchone()[0]
+
+
+def get_reaction(name, index):
+    """Reads one Reaction of a dataset; see dataset_store.read_reaction().
+
+    Returns:
+        Reaction, or None if the index is out of range.
+    """
+    with flask.g.db.cursor() as cursor:
+        try:
+            return dataset_store.read_reaction(cursor, flask.g.user_id, name,
+                                               index)
+        except KeyError:
+            flask.abort(404)
+
+
+def splice_reactions(name, start, end, reactions):
+    """Replaces reactions[start:end] of a dataset and saves it.
+
+    The other Reactions are moved as bytes rather than parsed and serialized
+    again; see reaction_index.splice().
+
+    Args:
+        name: String dataset name.
+        start: Integer index of the first Reaction to replace, or None to
+            append.
+        end: Integer index after the last Reaction to replace, or None to
+            append.
+        reactions: List of Reactions to put in their place.
+
+    Returns:
+        The index of the first of the new Reactions.
+
+    Raises:
+        IndexError: The range is out of bounds.
+    """
+    with flask.g.db.cursor() as cursor:
+        try:
+            serialized, offsets = dataset_store.read_serialized(cursor,
+                                                                flask.g.user_id,
+                                                                name,
+                                                                for_update=True)
+        except KeyError:
+            flask.abort(404)
+        if serialized is None:
+            serialized = get_dataset(name).SerializeToString(deterministic=True)
+            offsets = reaction_index.scan(serialized)
+        if start is None:
+            start = end = len(offsets)
+        serialized, offsets = reaction_index.splice(
+            serialized, offsets, start, end, [
+                reaction.SerializeToString(deterministic=True)
+                for reaction in reactions
+            ])
+        dataset_store.insert_serialized(cursor,
+                                        flask.g.user_id,
+                                        name,
+                                        serialized,
+                                        offsets=offsets,
+                                        clobber=True)
+        flask.g.db.commit()
+    return start
 
 
 def put_dataset(name, dataset):
     """Write a dataset proto to the dataset table, clobbering if needed."""
     with flask.g.db.cursor() as cursor:
-        query = psycopg2.sql.SQL(
-            'INSERT INTO datasets VALUES (%s, %s, %s) '
-            'ON CONFLICT (user_id, name) DO UPDATE SET serialized=%s')
-        user_id = flask.g.user_id
-        serialized = serialize_for_db(dataset)
-        cursor.execute(query, [user_id, name, serialized, serialized])
+        dataset_store.insert_dataset(cursor,
+                                     flask.g.user_id,
+                                     name,
+                                     dataset,
+                                     clobber=True)
         flask.g.db.commit()
 
 
@@ -753,17 +1263,6 @@ def resolve_tokens(proto):
     return matched
 
 
-def get_file(path):
-    """Get file contents as a BytesIO object."""
-    if not os.path.exists(path):
-        flask.abort(404)
-    with open(path, 'rb') as f:
-        # NOTE(kearnes): Workaround for unclosed file warnings. See
-        # https://github.com/pallets/werkzeug/issues/1785.
-        data = io.BytesIO(f.read())
-    return data
-
-
 def get_user_path():
     """Returns the path of the current user's temp directory.
 
@@ -838,36 +1337,26 @@ def github_callback():
         'Authorization': f'token {access_token}',
     }
     user = requests.get('https://api.github.com/user', headers=headers).json()
-    login = user['login']
-    with flask.g.db.cursor() as cursor:
-        query = psycopg2.sql.SQL('SELECT user_id FROM users WHERE name=%s')
-        cursor.execute(query, [login])
-        access_token = flask.request.cookies.get('Access-Token')
-        if cursor.rowcount > 0:
-            # This GitHub username is already associated with an account.
-            # NOTE(kearnes): This will overwrite any data that the user created
-            # in their guest account before logging in. In the case where they
-            # are logging in to GitHub for the first time, the last branch will
-            # be taken instead and their guest data will be migrated.
-            user_id = cursor.fetchone()[0]
-        elif access_token is None:
-            # NOTE(kearnes): This branch should never be taken, since all users
-            # receive a guest ID when they first navigate to the editor page.
-            user_id = make_user()
-        else:
-            # Migrate the current user ID (from a guest account).
-            with flask.g.db.cursor() as cursor:
-                query = psycopg2.sql.SQL(
-                    'SELECT user_id FROM logins WHERE access_token=%s')
-                cursor.execute(query, [access_token])
-                user_id = cursor.fetchone()[0]
-            try:
-                migrate_user(login, user_id)
-            except ValueError as error:
-                flask.abort(flask.make_response(str(error)), 409)
+    try:
+        user_id = login_github_user(user['login'],
+                                    flask.request.cookies.get('Access-Token'))
+    except ValueError as error:
+        flask.abort(flask.make_response(str(error), 409))
     return issue_access_token(user_id)
 
 
+def login_github_user(login, access_token):
+    """Finds or creates the user ID for a GitHub username.
+
+    See sessions.github_user().
+    """
+    with flask.g.db.cursor() as cursor:
+        user_id = sessions.github_user(cursor, login, access_token)
+    flask.g.db.commit()
+    sessions.invalidate(user_id=user_id)
+    return user_id
+
+
 @app.route('/authenticate', methods=['GET', 'POST'])
 def authenticate():
     """Issue a new access token for a given user ID."""
@@ -875,75 +1364,73 @@ def authenticate():
     if flask.request.method == 'GET':
         return issue_access_token(TESTER)
     user_id = flask.request.form.get('user_id')
-    if user_id is None or re.match('^[0-9a-fA-F]{32}$', user_id) is None:
+    if user_id is None or USER_ID_PATTERN.match(user_id) is None:
         return flask.redirect('/login')
     return issue_access_token(user_id)
 
 
 def issue_access_token(user_id):
     """Login as the given user and set the access token in a response."""
+    access_token = create_login(user_id)
+    response = flask.redirect('/')
+    response.set_cookie('Access-Token',
+                        access_token,
+                        max_age=sessions.LOGIN_TTL)
+    return response
+
+
+def create_login(user_id):
+    """Writes a new access token for the given user ID and returns it."""
     with flask.g.db.cursor() as cursor:
-        query = psycopg2.sql.SQL('INSERT INTO logins VALUES (%s, %s, %s)')
-        access_token = uuid.uuid4().hex
-        timestamp = int(time.time())
-        cursor.execute(query, [access_token, user_id, timestamp])
-        flask.g.db.commit()
-        response = flask.redirect('/')
-        # Expires in a year.
-        response.set_cookie('Access-Token', access_token, max_age=31536000)
-        return response
+        access_token = sessions.create_login(cursor, user_id)
+    flask.g.db.commit()
+    return access_token
 
 
 def make_user():
-    """Writes a new user ID and returns it.
-
-    Returns:
-        The 32-character generated UUID of the user, currently used in the UI.
-    """
+    """Writes a new user ID and returns it."""
     with flask.g.db.cursor() as cursor:
-        query = psycopg2.sql.SQL('INSERT INTO users VALUES (%s, %s, %s)')
-        user_id = uuid.uuid4().hex
-        timestamp = int(time.time())
-        cursor.execute(query, [user_id, None, timestamp])
-        flask.g.db.commit()
+        user_id = sessions.make_user(cursor)
+    flask.g.db.commit()
     return user_id
 
 
-def migrate_user(name, user_id):
-    """Migrates a guest user to a named GitHub account.
+def connect():
+    """Opens a connection to the editor database."""
+    return psycopg2.connect(dbname='editor',
+                            user=POSTGRES_USER,
+                            password=POSTGRES_PASSWORD,
+                            host=POSTGRES_HOST,
+                            port=int(POSTGRES_PORT),
+                            cursor_factory=metrics.TimedCursor)
 
-    Args:
-        name: String GitHub username.
-        user_id: String 32-character UUID.
 
-    Raises:
-        ValueError: This user_id is already associated with a GitHub account.
-    """
-    with flask.g.db.cursor() as cursor:
-        query = psycopg2.sql.SQL('SELECT name from users WHERE user_id=%s')
-        cursor.execute(query, [user_id])
-        if cursor.fetchone()[0] is not None:
-            raise ValueError(
-                f'user_id {user_id} is already associated with a name')
-        query = psycopg2.sql.SQL('UPDATE users SET name=%s WHERE user_id=%s')
-        cursor.execute(query, [name, user_id])
-        flask.g.db.commit()
+def forget_users(user_ids):
+    """Drops cached state for users deleted by reaper.py."""
+    for user_id in user_ids:
+        sessions.invalidate(user_id=user_id)
+        _user_paths.discard(user_id)
+
+
+reaper.init_app(app,
+                connect,
+                TEMP,
+                protected=(REVIEWER, TESTER),
+                on_delete=forget_users)
 
 
 @app.before_request
 def init_user():
     """Connects to the DB and authenticates the user."""
-    flask.g.db = psycopg2.connect(dbname='editor',
-                                  user=POSTGRES_USER,
-                                  password=POSTGRES_PASSWORD,
-                                  host=POSTGRES_HOST,
-                                  port=int(POSTGRES_PORT))
+    if flask.request.endpoint in PUBLIC_ENDPOINTS:
+        return
+    flask.g.db = connect()
     if (flask.request.path
             in ('/login', '/authenticate', '/github-callback',
                 '/render/reaction', '/render/compound', '/healthcheck') or
             flask.request.path.startswith(
-                ('/reaction/id/', '/css/', '/js/', '/ketcher/',
-                 '/dataset/proto/validate/'))):
+                ('/reaction/id/', '/ketcher/', '/dataset/proto/validate/',
+                 '/resolve/'))):
         return
     if 'ord-editor-user' in flask.request.cookies:
         # Respect legacy user ID's in cookies.
@@ -961,18 +1448,12 @@ def init_user():
         # Automatically login as a new user.
         user_id = make_user()
         return issue_access_token(user_id)
-    with flask.g.db.cursor() as cursor:
-        query = psycopg2.sql.SQL(
-            'SELECT user_id FROM logins WHERE access_token=%s')
-        cursor.execute(query, [access_token])
-        if cursor.rowcount == 0:
-            # Automatically login as a new user.
-            user_id = make_user()
-            return issue_access_token(user_id)
-        user_id = cursor.fetchone()[0]
-        query = psycopg2.sql.SQL('SELECT name FROM users WHERE user_id=%s')
-        cursor.execute(query, [user_id])
-        name = cursor.fetchone()[0]
+    session = get_session(access_token)
+    if session is None:
+        # Automatically login as a new user.
+        user_id = make_user()
+        return issue_access_token(user_id)
+    user_id, name = session
     flask.g.user_id = user_id
     if name is not None:
         flask.g.user_name = name
@@ -981,19 +1462,29 @@ def init_user():
         flask.g.user_name = user_id
         flask.g.user_avatar = \
             'https://avatars2.githubusercontent.com/u/60754754?s=200&v=4'
-    temp = get_user_path()
-    if not os.path.isdir(temp):
-        os.mkdir(temp)
+    if user_id not in _user_paths:
+        os.makedirs(get_user_path(), exist_ok=True)
+        _user_paths.add(user_id)
+
+
+def get_session(access_token):
+    """Returns the (user_id, name) bound to an access token, or None.
+
+    See sessions.lookup().
+    """
+    with flask.g.db.cursor() as cursor:
+        return sessions.lookup(cursor, access_token)
 
 
 @app.route('/logout')
 def logout():
     """Clear the access token and redirect to /login."""
+    access_token = flask.request.cookies.get('Access-Token')
+    if access_token is not None:
+        with flask.g.db.cursor() as cursor:
+            sessions.delete_login(cursor, access_token)
+        flask.g.db.commit()
+        sessions.invalidate(access_token=access_token)
     response = flask.redirect('/login')
     response.set_cookie('Access-Token', '', expires=0)
     return response
-
-
-def serialize_for_db(dataset):
-    """Serializes a Dataset for input into postgres."""
-    return dataset.SerializeToString(deterministic=True).hex()
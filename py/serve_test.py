@@ -14,8 +14,11 @@
 """Tests for editor.py.serve."""
 
 import base64
+import gzip
+import io
 import json
 import os
+import re
 import urllib
 
 from absl.testing import absltest
@@ -70,6 +73,13 @@ class ServeTest(parameterized.TestCase, absltest.TestCase):
         # Start with an initial empty dataset called 'dataset'.
         self._create('dataset')
 
+    def _login(self):
+        """Returns a fresh access token for the test user."""
+        response = self.client.get('/authenticate')
+        match = re.search('Access-Token=([0-9a-f]{32})',
+                          response.headers['Set-Cookie'])
+        return match.group(1)
+
     def _get_dataset(self):
         """Returns a Dataset for testing."""
         dataset = dataset_pb2.Dataset()
@@ -88,6 +98,12 @@ class ServeTest(parameterized.TestCase, absltest.TestCase):
         self.assertEqual(response.status_code, 200)
         return dataset_pb2.Dataset.FromString(response.data)
 
+    def _write_dataset(self, dataset, name):
+        """Saves a Dataset the way the editor does."""
+        response = self.client.post(f'/dataset/proto/write/{name}',
+                                    data=dataset.SerializeToString())
+        self.assertEqual(response.status_code, 200)
+
     def _upload_dataset(self, dataset, name):
         """Uploads a Dataset for testing."""
         response = self.client.post(f'/dataset/{name}/upload',
@@ -99,6 +115,15 @@ class ServeTest(parameterized.TestCase, absltest.TestCase):
         response = self.client.get('/', follow_redirects=True)
         self.assertEqual(response.status_code, 200)
 
+    def test_metrics(self):
+        self.client.get('/datasets')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        text = response.data.decode()
+        self.assertIn('editor_request_seconds_count{endpoint="show_datasets"',
+                      text)
+        self.assertIn('editor_query_seconds', text)
+
     def test_show_datasets(self):
         response = self.client.get('/datasets', follow_redirects=True)
         self.assertEqual(response.status_code, 200)
@@ -152,6 +177,19 @@ class ServeTest(parameterized.TestCase, absltest.TestCase):
                 f.write(response.data)
             message_helpers.load_message(filename, dataset_pb2.Dataset)
 
+    @parameterized.parameters(['csv', 'parquet'])
+    def test_export_dataset(self, kind):
+        dataset = self._get_dataset()
+        self._upload_dataset(dataset, 'test')
+        response = self.client.get(f'/dataset/test/export/{kind}')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('test.' + kind, response.headers['Content-Disposition'])
+        self.assertNotEmpty(response.data)
+
+    def test_export_dataset_unsupported(self):
+        response = self.client.get('/dataset/dataset/export/xlsx')
+        self.assertEqual(response.status_code, 406)
+
     @parameterized.parameters([
         ('dataset', 409, True),
         ('dataset', 409, False),
@@ -206,6 +244,70 @@ class ServeTest(parameterized.TestCase, absltest.TestCase):
         dataset = dataset_pb2.Dataset.FromString(response.data)
         self.assertLen(dataset.reactions, 80)
 
+    @parameterized.parameters([True, False])
+    def test_enumerate_dataset_multipart(self, template_file):
+        with open(os.path.join(self.testdata, 'nielsen_fig1_template.pbtxt'),
+                  'rb') as f:
+            template = f.read()
+        with open(os.path.join(self.testdata, 'nielsen_fig1.csv'), 'rb') as f:
+            data = {'spreadsheet': (io.BytesIO(f.read()), 'test.csv')}
+        if template_file:
+            data['template'] = (io.BytesIO(template), 'template.pbtxt')
+        else:
+            data['template_string'] = template.decode()
+        response = self.client.post('/dataset/enumerate',
+                                    data=data,
+                                    content_type='multipart/form-data',
+                                    follow_redirects=True)
+        self.assertEqual(response.status_code, 200, response.data)
+        response = self.client.get('/dataset/test_dataset/download',
+                                   follow_redirects=True)
+        self.assertEqual(response.status_code, 200)
+        dataset = dataset_pb2.Dataset.FromString(response.data)
+        self.assertLen(dataset.reactions, 80)
+
+    @parameterized.parameters([
+        ({}, 10),
+        ({
+            'rows': 3
+        }, 3),
+        ({
+            'rows': 1000
+        }, 80),
+    ])
+    def test_preview_enumeration(self, extra, expected):
+        data = {'spreadsheet_name': 'test.csv'}
+        with open(os.path.join(self.testdata, 'nielsen_fig1.csv'), 'rb') as f:
+            data['spreadsheet_data'] = base64.b64encode(f.read()).decode()
+        with open(os.path.join(self.testdata, 'nielsen_fig1_template.pbtxt'),
+                  'rt') as f:
+            data['template_string'] = f.read()
+        data.update(extra)
+        response = self.client.post('/dataset/enumerate/preview',
+                                    json=data,
+                                    follow_redirects=True)
+        self.assertEqual(response.status_code, 200, response.data)
+        preview = json.loads(response.data)
+        self.assertEqual(preview['num_rows'], 80)
+        self.assertLen(preview['rows'], expected)
+        self.assertIn('$product_yield$', preview['placeholders'])
+        self.assertIn('c1ccccc1CCC(F)C', preview['rows'][0]['pbtxt'])
+        # Nothing is stored.
+        response = self.client.get('/dataset/test_dataset/download',
+                                   follow_redirects=True)
+        self.assertEqual(response.status_code, 404)
+
+    def test_preview_enumeration_missing_column(self):
+        data = {
+            'spreadsheet_name': 'test.csv',
+            'spreadsheet_data': base64.b64encode(b'a,b\n1,2\n').decode(),
+            'template_string': 'identifiers { type: SMILES value: "$c$" }',
+        }
+        response = self.client.post('/dataset/enumerate/preview',
+                                    json=data,
+                                    follow_redirects=True)
+        self.assertEqual(response.status_code, 406)
+
     @parameterized.parameters([
         (0, 200),
         (3, 200),
@@ -259,6 +361,120 @@ class ServeTest(parameterized.TestCase, absltest.TestCase):
         self.assertLen(downloaded_dataset.reactions, 79)
         self.assertEqual(dataset.reactions[1], downloaded_dataset.reactions[0])
 
+    def test_read_write_reaction(self):
+        dataset = self._get_dataset()
+        self._write_dataset(dataset, 'test')
+        response = self.client.get('/dataset/proto/read/test/reaction/3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(reaction_pb2.Reaction.FromString(response.data),
+                         dataset.reactions[3])
+        response = self.client.get('/dataset/proto/read/test/reaction/80')
+        self.assertEqual(response.status_code, 404)
+        reaction = reaction_pb2.Reaction(reaction_id='ord-replaced')
+        response = self.client.post('/dataset/proto/write/test/reaction/3',
+                                    data=reaction.SerializeToString())
+        self.assertEqual(response.status_code, 200)
+        del dataset.reactions[3]
+        dataset.reactions.insert(3, reaction)
+        self.assertEqual(self._download_dataset('test'), dataset)
+        response = self.client.post('/dataset/proto/write/test/reaction/80',
+                                    data=reaction.SerializeToString())
+        self.assertEqual(response.status_code, 404)
+
+    def test_read_reaction_from_copy(self):
+        dataset = self._get_dataset()
+        self._write_dataset(dataset, 'test')
+        response = self.client.post('/dataset/test/copy/other')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/dataset/proto/read/other/reaction/1')
+        self.assertEqual(reaction_pb2.Reaction.FromString(response.data),
+                         dataset.reactions[1])
+
+    def test_edit_reactions(self):
+        dataset = self._get_dataset()
+        dataset.reaction_ids.extend(['ord-a', 'ord-b'])
+        self._write_dataset(dataset, 'test')
+        num_reactions = len(dataset.reactions)
+        response = self.client.post(
+            '/dataset/test/reactions',
+            json=[
+                {
+                    'op': 'delete',
+                    'indices': [0, 2]
+                },
+                {
+                    'op': 'clone',
+                    'indices': [0],
+                    'count': 2
+                },
+                {
+                    'op': 'add'
+                },
+                {
+                    'op': 'remove_reaction_ids',
+                    'reaction_ids': ['ord-a']
+                },
+                {
+                    'op': 'reorder',
+                    'order': list(range(num_reactions, -1, -1))
+                },
+            ])
+        self.assertEqual(response.status_code, 200)
+        sources = ([None, 1, 1] + list(range(num_reactions - 1, 2, -1)) + [1])
+        self.assertEqual(response.json['sources'], sources)
+        self.assertEqual(response.json['mapping'][:3], [None, 1, None])
+        edited = self._download_dataset('test')
+        self.assertEqual(list(edited.reaction_ids), ['ord-b'])
+        self.assertLen(edited.reactions, len(sources))
+        self.assertStartsWith(edited.reactions[0].reaction_id, 'ord-')
+        for reaction, source in zip(edited.reactions[1:], sources[1:]):
+            self.assertEqual(reaction, dataset.reactions[source])
+
+    @parameterized.parameters([
+        [{
+            'op': 'delete',
+            'indices': [100000]
+        }],
+        [{
+            'op': 'reorder',
+            'order': [0]
+        }],
+        [{
+            'op': 'remove_reaction_ids',
+            'reaction_ids': ['missing']
+        }],
+        [{
+            'op': 'explode'
+        }],
+        [{
+            'op': 'delete',
+            'indices': [True]
+        }],
+        [{
+            'op': 'add',
+            'count': 10**9
+        }],
+        [{
+            'op': 'add',
+            'count': -1
+        }],
+        [{
+            'op': 'add',
+            'count': True
+        }],
+        [{
+            'op': 'clone',
+            'indices': [0],
+            'count': 10**9
+        }],
+    ])
+    def test_edit_reactions_invalid(self, operation):
+        dataset = self._get_dataset()
+        self._write_dataset(dataset, 'test')
+        response = self.client.post('/dataset/test/reactions', json=[operation])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._download_dataset('test'), dataset)
+
     def test_delete_reaction_id(self):
         name = 'test'
         dataset = dataset_pb2.Dataset()
@@ -303,6 +519,129 @@ class ServeTest(parameterized.TestCase, absltest.TestCase):
         downloaded_dataset = self._download_dataset(name)
         self.assertEqual(downloaded_dataset, dataset)
 
+    def test_write_dataset_compressed(self):
+        dataset = self._get_dataset()
+        response = self.client.post('/dataset/proto/write/test',
+                                    data=gzip.compress(
+                                        dataset.SerializeToString()),
+                                    headers={'Content-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._download_dataset('test'), dataset)
+        response = self.client.post('/dataset/proto/write/test',
+                                    data=b'not gzip',
+                                    headers={'Content-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/dataset/proto/write/test',
+                                    data=dataset.SerializeToString(),
+                                    headers={'Content-Encoding': 'br'})
+        self.assertEqual(response.status_code, 415)
+
+    def test_read_dataset_compressed(self):
+        dataset = self._get_dataset()
+        self._write_dataset(dataset, 'test')
+        response = self.client.get('/dataset/proto/read/test',
+                                   headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(
+            dataset_pb2.Dataset.FromString(gzip.decompress(response.data)),
+            dataset)
+
+    def test_revisions(self):
+        name = 'test'
+        dataset = self._get_dataset()
+        self._write_dataset(dataset, name)
+        first = self.client.get(f'/dataset/{name}/revisions').json[0]
+        self.assertEqual(first['num_reactions'], len(dataset.reactions))
+        changed = dataset_pb2.Dataset()
+        changed.CopyFrom(dataset)
+        changed.reactions[0].notes.procedure_details = 'changed'
+        del changed.reactions[1]
+        self._write_dataset(changed, name)
+        listed = self.client.get(f'/dataset/{name}/revisions').json
+        self.assertEqual(listed[0]['revision'], first['revision'] + 1)
+        response = self.client.get(
+            f'/dataset/{name}/revision/{first["revision"]}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(dataset_pb2.Dataset.FromString(response.data), dataset)
+        response = self.client.post(
+            f'/dataset/{name}/revision/{first["revision"]}/restore')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self._download_dataset(name), dataset)
+        response = self.client.get(f'/dataset/{name}/revision/100000')
+        self.assertEqual(response.status_code, 404)
+
+    def test_delete_dataset_history(self):
+        dataset = self._get_dataset()
+        self._write_dataset(dataset, 'test')
+        self._destroy('test')
+        # A new dataset with the same name starts a new history.
+        self._write_dataset(dataset, 'test')
+        listed = self.client.get('/dataset/test/revisions').json
+        self.assertEqual([row['revision'] for row in listed], [0])
+
+    def test_copy_dataset(self):
+        dataset = self._get_dataset()
+        self._write_dataset(dataset, 'test')
+        response = self.client.post('/dataset/test/copy/other')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._download_dataset('other'), dataset)
+        response = self.client.post('/dataset/test/copy/other')
+        self.assertEqual(response.status_code, 409)
+        # Writing the copy leaves the source alone.
+        changed = dataset_pb2.Dataset()
+        changed.CopyFrom(dataset)
+        del changed.reactions[0]
+        self._write_dataset(changed, 'other')
+        self.assertEqual(self._download_dataset('other'), changed)
+        self.assertEqual(self._download_dataset('test'), dataset)
+
+    def test_copy_dataset_to_other_user(self):
+        response = self.client.post('/dataset/dataset/copy/other?user_id=' +
+                                    32 * '0')
+        self.assertEqual(response.status_code, 403)
+
+    def _get_stats(self):
+        response = self.client.get('/datasets/stats')
+        self.assertEqual(response.status_code, 200)
+        stats = json.loads(response.data)
+        return {row['name']: row for row in stats['datasets']}, stats['totals']
+
+    def test_dataset_stats(self):
+        _, before = self._get_stats()
+        dataset = self._get_dataset()
+        self._write_dataset(dataset, 'test')
+        datasets, totals = self._get_stats()
+        self.assertEqual(datasets['test']['num_reactions'],
+                         len(dataset.reactions))
+        self.assertEqual(datasets['test']['size'], dataset.ByteSize())
+        self.assertEqual(sum(datasets['test']['yield_buckets']),
+                         len(dataset.reactions))
+        self.assertEqual(totals['num_datasets'], before['num_datasets'] + 1)
+        self.assertEqual(totals['num_reactions'],
+                         before['num_reactions'] + len(dataset.reactions))
+        # Edits and copies adjust the totals.
+        del dataset.reactions[0]
+        self._write_dataset(dataset, 'test')
+        response = self.client.post('/dataset/test/copy/other')
+        self.assertEqual(response.status_code, 200)
+        datasets, totals = self._get_stats()
+        self.assertEqual(
+            datasets['other'], {
+                **datasets['test'], 'name': 'other',
+                'updated_time': datasets['other']['updated_time']
+            })
+        self.assertEqual(totals['num_reactions'],
+                         before['num_reactions'] + 2 * len(dataset.reactions))
+        self._destroy('other')
+        self._destroy('test')
+        _, totals = self._get_stats()
+        self.assertEqual(totals['num_datasets'], before['num_datasets'])
+        self.assertEqual(totals['num_compounds'], before['num_compounds'])
+        response = self.client.get('/datasets')
+        self.assertIn(b'dataset_stats', response.data)
+
     def test_write_upload(self):
         name = 'test'
         data = b'test data'
@@ -390,6 +729,25 @@ class ServeTest(parameterized.TestCase, absltest.TestCase):
                                     data=dataset.SerializeToString(),
                                     follow_redirects=True)
         self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json['unchanged'], len(dataset.reactions) - 1)
+
+    def test_diff_datasets(self):
+        dataset = self._get_dataset()
+        self._upload_dataset(dataset, 'test')
+        dataset.reactions[0].notes.procedure_details = 'changed'
+        del dataset.reactions[1]
+        self._upload_dataset(dataset, 'other')
+        response = self.client.get('/dataset/test/diff/other')
+        self.assertEqual(response.status_code, 200)
+        report = response.json
+        self.assertEqual(report['unchanged'], len(dataset.reactions) - 1)
+        self.assertEqual([reaction['index'] for reaction in report['removed']],
+                         [1])
+        self.assertEmpty(report['added'])
+        self.assertLen(report['modified'], 1)
+        [change] = report['modified'][0]['changes']
+        self.assertEqual(change['path'], 'notes.procedure_details')
+        self.assertEqual(change['new'], 'changed')
 
     def test_js(self):
         pass  # Requires the editor to be built.
@@ -402,6 +760,19 @@ class ServeTest(parameterized.TestCase, absltest.TestCase):
         response = self.client.get(f'/css/{sheet}', follow_redirects=True)
         self.assertEqual(response.status_code, expected)
 
+    def test_css_caching(self):
+        headers = {'Accept-Encoding': 'gzip'}
+        response = self.client.get('/css/reaction.css', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['Cache-Control'], 'public, no-cache')
+        headers['If-None-Match'] = response.headers['ETag']
+        response = self.client.get('/css/reaction.css', headers=headers)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(serve.asset_url('css', 'reaction.css'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+
     def test_ketcher_iframe(self):
         response = self.client.get('/ketcher/iframe', follow_redirects=True)
         self.assertEqual(response.status_code, 200)
@@ -433,6 +804,17 @@ class ServeTest(parameterized.TestCase, absltest.TestCase):
         self.assertEqual(json.loads(response.data),
                          Chem.MolToMolBlock(Chem.MolFromSmiles(smiles)))
 
+    def test_logout(self):
+        client = serve.app.test_client(use_cookies=False)
+        headers = {'Cookie': f'Access-Token={self._login()}'}
+        response = client.get('/datasets', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        response = client.get('/logout', headers=headers)
+        self.assertEqual(response.status_code, 302)
+        # The revoked token now redirects to a new guest login.
+        response = client.get('/datasets', headers=headers)
+        self.assertEqual(response.status_code, 302)
+
     def test_get_molfile_no_structure(self):
         compound = reaction_pb2.Compound()
         compound.identifiers.add(value='benzene', type='NAME')
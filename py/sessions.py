@@ -0,0 +1,172 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Users, access tokens, and the per-process session cache.
+
+Every request carries an Access-Token cookie bound to a user by a logins row.
+lookup() caches the binding in this process for SESSION_TTL seconds so that
+most requests need no queries to authenticate; invalidate() drops entries when
+a token is revoked or a user is renamed or deleted.
+
+Functions that take a cursor write in the caller's transaction.
+"""
+
+import os
+import time
+import uuid
+
+import psycopg2.sql
+
+# Seconds an access token lookup is trusted before Postgres is consulted again.
+# Set to zero to disable the session cache.
+SESSION_TTL = int(os.getenv('ORD_EDITOR_SESSION_TTL', '60'))
+# Upper bound on the number of cached sessions per worker process.
+SESSION_CACHE_SIZE = 10000
+
+# Seconds that an access token (and its cookie) remains valid. Expired tokens
+# are deleted by reaper.py.
+LOGIN_TTL = 31536000
+
+# Maps access tokens to (expiration time, user ID, user name) tuples.
+_sessions = {}
+
+
+def make_user(cursor):
+    """Writes a new user ID and returns it.
+
+    Returns:
+        The 32-character generated UUID of the user, currently used in the UI.
+    """
+    query = psycopg2.sql.SQL('INSERT INTO users VALUES (%s, %s, %s)')
+    user_id = uuid.uuid4().hex
+    timestamp = int(time.time())
+    cursor.execute(query, [user_id, None, timestamp])
+    return user_id
+
+
+def create_login(cursor, user_id):
+    """Writes a new access token for the given user ID and returns it."""
+    query = psycopg2.sql.SQL(
+        'INSERT INTO logins (access_token, user_id, timestamp, '
+        'expires_time) VALUES (%s, %s, %s, %s)')
+    access_token = uuid.uuid4().hex
+    timestamp = int(time.time())
+    cursor.execute(query,
+                   [access_token, user_id, timestamp, timestamp + LOGIN_TTL])
+    return access_token
+
+
+def delete_login(cursor, access_token):
+    """Revokes an access token.
+
+    Call invalidate(access_token=...) once the transaction commits.
+    """
+    query = psycopg2.sql.SQL('DELETE FROM logins WHERE access_token=%s')
+    cursor.execute(query, [access_token])
+
+
+def github_user(cursor, login, access_token):
+    """Finds or creates the user ID for a GitHub username.
+
+    Call invalidate(user_id=...) with the result once the transaction commits.
+
+    Args:
+        cursor: psycopg2 cursor.
+        login: String GitHub username.
+        access_token: String access token of the current (guest) session, or
+            None.
+
+    Returns:
+        The 32-character user ID to log in as.
+
+    Raises:
+        ValueError: The guest account is already associated with a name.
+    """
+    query = psycopg2.sql.SQL('SELECT user_id FROM users WHERE name=%s')
+    cursor.execute(query, [login])
+    if cursor.rowcount > 0:
+        # This GitHub username is already associated with an account.
+        # NOTE(kearnes): This will overwrite any data that the user created
+        # in their guest account before logging in. In the case where they
+        # are logging in to GitHub for the first time, the last branch will
+        # be taken instead and their guest data will be migrated.
+        return cursor.fetchone()[0]
+    if access_token is None:
+        # NOTE(kearnes): This branch should never be taken, since all users
+        # receive a guest ID when they first navigate to the editor page.
+        return make_user(cursor)
+    # Migrate the current user ID (from a guest account).
+    query = psycopg2.sql.SQL('SELECT user_id FROM logins WHERE access_token=%s')
+    cursor.execute(query, [access_token])
+    user_id = cursor.fetchone()[0]
+    query = psycopg2.sql.SQL('SELECT name from users WHERE user_id=%s')
+    cursor.execute(query, [user_id])
+    if cursor.fetchone()[0] is not None:
+        raise ValueError(f'user_id {user_id} is already associated with a name')
+    query = psycopg2.sql.SQL('UPDATE users SET name=%s WHERE user_id=%s')
+    cursor.execute(query, [login, user_id])
+    return user_id
+
+
+def lookup(cursor, access_token):
+    """Looks up the user bound to an access token.
+
+    Cached lookups do not use the cursor.
+
+    Args:
+        cursor: psycopg2 cursor.
+        access_token: String access token from the request cookie.
+
+    Returns:
+        A (user_id, name) tuple, or None if the token is not recognized.
+    """
+    now = time.time()
+    session = _sessions.get(access_token)
+    if session is not None and session[0] > now:
+        return session[1:]
+    query = psycopg2.sql.SQL('SELECT user_id, name, expires_time '
+                             'FROM logins JOIN users USING (user_id) '
+                             'WHERE access_token=%s AND expires_time>%s')
+    cursor.execute(query, [access_token, int(now)])
+    if cursor.rowcount == 0:
+        _sessions.pop(access_token, None)
+        return None
+    user_id, name, expires_time = cursor.fetchone()
+    if SESSION_TTL > 0:
+        if len(_sessions) >= SESSION_CACHE_SIZE:
+            for key, value in list(_sessions.items()):
+                if value[0] <= now:
+                    del _sessions[key]
+            if len(_sessions) >= SESSION_CACHE_SIZE:
+                _sessions.clear()
+        _sessions[access_token] = (min(now + SESSION_TTL,
+                                       expires_time), user_id, name)
+    return user_id, name
+
+
+def invalidate(access_token=None, user_id=None):
+    """Drops cached sessions for an access token and/or a user ID.
+
+    Only the cache in the current process is affected; other workers expire
+    their entries after at most SESSION_TTL seconds.
+
+    Args:
+        access_token: String access token to forget.
+        user_id: String user ID whose tokens should all be forgotten.
+    """
+    if access_token is not None:
+        _sessions.pop(access_token, None)
+    if user_id is not None:
+        for key, value in list(_sessions.items()):
+            if value[1] == user_id:
+                del _sessions[key]
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Startup time benchmark for editor workers.
+
+Each run starts a fresh interpreter and times:
+
+    import: importing serve, which every worker pays without preload;
+    warm: serve.warm(), which the gunicorn master pays once with preload;
+    lazy: the part of warm spent loading lazy modules (see lazy_import.py),
+        which a worker without preload pays on first use of the routes that
+        need them.
+
+The first run is also made with -X importtime, and the modules with the most
+import time of their own are listed. Results are compared against a stored
+baseline like benchmark.py:
+
+    $ PYTHONPATH=py python py/startup_benchmark.py --save_baseline
+    ... change something ...
+    $ PYTHONPATH=py python py/startup_benchmark.py
+
+The process exits with status 1 if the median import or warm time regressed.
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from absl import app
+from absl import flags
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('runs', 5, 'Fresh interpreters to time.')
+flags.DEFINE_integer('top', 20, 'Modules listed from the import profile.')
+flags.DEFINE_string(
+    'baseline', os.path.join(os.path.dirname(__file__),
+                             'startup_baseline.json'),
+    'JSON file of baseline results.')
+flags.DEFINE_boolean('save_baseline', False,
+                     'If True, overwrite the baseline with these results.')
+flags.DEFINE_float(
+    'tolerance', 0.2,
+    'Allowed fractional slowdown before reporting a regression.')
+
+# Runs in each fresh interpreter and prints its timings as JSON.
+_PROBE = """
+import json
+import time
+
+start = time.perf_counter()
+import serve
+imported = time.perf_counter()
+serve.warm()
+warmed = time.perf_counter()
+modules = serve.lazy_import.load_seconds
+print(json.dumps({
+    'import': imported - start,
+    'lazy': sum(modules.values()),
+    'warm': warmed - imported,
+    'modules': modules,
+}))
+"""
+
+
+def run_probe(importtime=False):
+    """Returns (timings dict, stderr) from a fresh interpreter."""
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += ['-c', _PROBE]
+    process = subprocess.run(command,
+                             capture_output=True,
+                             check=True,
+                             text=True)
+    return json.loads(process.stdout.splitlines()[-1]), process.stderr
+
+
+def parse_importtime(stderr):
+    """Returns [(self seconds, cumulative seconds, module)] from importtime."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            own, cumulative = int(fields[0]), int(fields[1])
+        except ValueError:
+            continue  # The header line.
+        modules.append((own / 1e6, cumulative / 1e6, fields[2].strip()))
+    return modules
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of regression messages relative to the baseline."""
+    regressions = []
+    for key in ('import', 'warm'):
+        if key in baseline and results[key] > baseline[key] * (1 + tolerance):
+            regressions.append(f'{key}: {1e3 * results[key]:.0f}ms vs '
+                               f'{1e3 * baseline[key]:.0f}ms')
+    return regressions
+
+
+def main(argv):
+    del argv  # Only used by app.run().
+    _, stderr = run_probe(importtime=True)
+    modules = parse_importtime(stderr)
+    print(f'{"self":>9} {"cumulative":>11}  module')
+    for own, cumulative, name in sorted(modules, reverse=True)[:FLAGS.top]:
+        print(f'{1e3 * own:>7.1f}ms {1e3 * cumulative:>9.1f}ms  {name}')
+    print()
+    runs = [run_probe()[0] for _ in range(FLAGS.runs)]
+    results = {
+        key: statistics.median(run[key] for run in runs)
+        for key in ('import', 'lazy', 'warm')
+    }
+    for key, value in results.items():
+        print(f'{key:<8} {1e3 * value:>7.0f}ms (median of {FLAGS.runs})')
+    for name, seconds in sorted(runs[0]['modules'].items(),
+                                key=lambda item: -item[1]):
+        print(f'  lazy {name:<40} {1e3 * seconds:>7.0f}ms')
+    if FLAGS.save_baseline:
+        with open(FLAGS.baseline, 'wt') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        return
+    if not os.path.exists(FLAGS.baseline):
+        print(f'no baseline at {FLAGS.baseline}; rerun with --save_baseline')
+        return
+    with open(FLAGS.baseline, 'rt') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, FLAGS.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -0,0 +1,23 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""User IDs of the system users created by schema/0001_initial.sql.
+
+serve.py and the reaper.py command line both need them, and reaper.py cannot
+import serve.py, which imports it.
+"""
+
+# System user for immutable reactions imported from GitHub pull requests.
+REVIEWER = '8df09572f3c74dbcb6003e2eef8e48fc'
+# System user for automated testing.
+TESTER = '680b0d9fe649417cb092d790907bd5a5'
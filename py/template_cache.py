@@ -0,0 +1,305 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compiled Reaction templates for dataset enumeration.
+
+ord_schema.templating.generate_dataset() scans the template for "$name$"
+placeholders and, for every spreadsheet row, substitutes values into the text
+and parses it again. compile_template() does the scan once per distinct
+template (keyed by a hash of its text) and keeps the result in a small LRU
+cache, since users tend to enumerate or preview the same template repeatedly.
+
+If the template parses as a Reaction once placeholders used as bare values
+(e.g. "value: $yield$") are swapped for numbers, the compiled template also
+keeps the parsed Reaction and the paths of the fields that hold placeholders.
+Rows are then filled by copying the Reaction and setting those fields, with no
+text parsing. Rows whose values would not survive the round trip through pbtxt
+unchanged, and templates that only parse after substitution, go through
+templating's own substitution, so the result is always the same as
+generate_dataset().
+"""
+
+import collections
+import hashlib
+import os
+import re
+import threading
+
+import pandas as pd
+from google.protobuf import descriptor
+from google.protobuf import text_encoding
+from google.protobuf import text_format
+
+from ord_schema import templating
+from ord_schema.proto import dataset_pb2
+from ord_schema.proto import reaction_pb2
+
+# Number of compiled templates kept per process.
+CACHE_SIZE = int(os.getenv('ORD_EDITOR_TEMPLATE_CACHE_SIZE', '32'))
+
+PLACEHOLDER = re.compile(r'\$\w+\$')
+# A placeholder used directly as a field value, e.g. "value: $yield$".
+_BARE = re.compile(r'(:\s*)(\$\w+\$)(?![\w$])')
+# Escapes that could run on into substituted text, e.g. "\1$x$" with x=2.
+_OPEN_ESCAPE = re.compile(r'\\(?:[0-7]{1,2}|x[0-9a-fA-F]?)\$\w+\$')
+# Bare placeholders are replaced by these numbers to parse the template.
+_SENTINEL = 7_340_033
+
+_INTEGER = re.compile(r'-?\d+')
+_FLOAT = re.compile(r'-?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?')
+_INTEGER_TYPES = frozenset([
+    descriptor.FieldDescriptor.CPPTYPE_INT32,
+    descriptor.FieldDescriptor.CPPTYPE_INT64,
+    descriptor.FieldDescriptor.CPPTYPE_UINT32,
+    descriptor.FieldDescriptor.CPPTYPE_UINT64,
+])
+_FLOAT_TYPES = frozenset([
+    descriptor.FieldDescriptor.CPPTYPE_FLOAT,
+    descriptor.FieldDescriptor.CPPTYPE_DOUBLE,
+])
+
+_cache = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def _find_fields(message, sentinels, path=()):
+    """Yields (path, cpp_type, value) for fields that hold placeholders.
+
+    String fields are reported if they contain a placeholder and numeric fields
+    if their value is one of sentinels. Each path element is (field name,
+    index or map key or None).
+
+    Raises:
+        ValueError: A map key contains a placeholder.
+    """
+    for field, value in message.ListFields():
+        repeated = field.label == field.LABEL_REPEATED
+        if field.message_type is not None:
+            yield from _find_submessage_fields(field, value, sentinels, path)
+            continue
+        for index, item in enumerate(value if repeated else [value]):
+            key = (field.name, index if repeated else None)
+            if field.cpp_type == field.CPPTYPE_STRING:
+                if (field.type == field.TYPE_STRING and
+                        PLACEHOLDER.search(item)):
+                    yield path + (key,), field.cpp_type, item
+            elif (field.cpp_type in _INTEGER_TYPES | _FLOAT_TYPES and
+                  item in sentinels):
+                yield path + (key,), field.cpp_type, sentinels[item]
+
+
+def _find_submessage_fields(field, value, sentinels, path):
+    """Like _find_fields(), for the value of a message or map field."""
+    if field.message_type.GetOptions().map_entry:
+        for key in value:
+            if PLACEHOLDER.search(str(key)):
+                raise ValueError('placeholder in a map key')
+            if (field.message_type.fields_by_name['value'].message_type
+                    is not None):
+                yield from _find_fields(value[key], sentinels,
+                                        path + ((field.name, key),))
+    elif field.label == field.LABEL_REPEATED:
+        for index, item in enumerate(value):
+            yield from _find_fields(item, sentinels,
+                                    path + ((field.name, index),))
+    else:
+        yield from _find_fields(value, sentinels, path + ((field.name, None),))
+
+
+def _set_field(message, path, value):
+    for name, key in path[:-1]:
+        message = getattr(message, name)
+        if key is not None:
+            message = message[key]
+    name, key = path[-1]
+    if key is None:
+        setattr(message, name, value)
+    else:
+        getattr(message, name)[key] = value
+
+
+def _string(text):
+    """Returns the value of '"text"' in pbtxt, or None if not certain."""
+    if not text.isascii() or not text.isprintable() or '"' in text:
+        return None
+    try:
+        return text_encoding.CUnescape(text).decode('utf-8')
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _number(text, cpp_type):
+    """Returns the value of a numeric field set to text, or None."""
+    if cpp_type in _INTEGER_TYPES:
+        return int(text) if _INTEGER.fullmatch(text) else None
+    return float(text) if _FLOAT.fullmatch(text) else None
+
+
+def _remove_null_inputs(reaction):
+    """Mirrors the cleanup in templating._fill_template() for empty cells."""
+    is_null = templating._is_null  # pylint: disable=protected-access
+    for message in reaction.inputs.values():
+        for component in message.components:
+            for identifier in list(component.identifiers):
+                if is_null(identifier.value):
+                    component.identifiers.remove(identifier)
+        for component in list(message.components):
+            kind = component.amount.WhichOneof('kind')
+            if (is_null(getattr(component.amount, kind).value) or
+                    not component.identifiers):
+                message.components.remove(component)
+    for key in list(reaction.inputs.keys()):
+        if not reaction.inputs[key].components:
+            del reaction.inputs[key]
+
+
+class Template:
+    """A Reaction template, scanned and (if possible) parsed once.
+
+    Attributes:
+        template_string: The template text.
+        placeholders: Sorted list of "$name$" placeholder strings.
+        reaction: Reaction parsed from the template text, or None if rows must
+            be filled by substituting text.
+        fields: List of (path, cpp_type, template value) for the fields of
+            reaction that hold placeholders. The template value of a numeric
+            field is the placeholder itself.
+    """
+
+    def __init__(self, template_string):
+        self.template_string = template_string
+        self.placeholders = sorted(set(PLACEHOLDER.findall(template_string)))
+        self.reaction = None
+        self.fields = []
+        if _OPEN_ESCAPE.search(template_string):
+            return
+        sentinels = {}
+
+        def replace(match):
+            sentinel = _SENTINEL + len(sentinels)
+            sentinels[sentinel] = match.group(2)
+            return f'{match.group(1)}{sentinel}'
+
+        try:
+            reaction = text_format.Parse(_BARE.sub(replace, template_string),
+                                         reaction_pb2.Reaction())
+            fields = list(_find_fields(reaction, sentinels))
+        except (text_format.ParseError, ValueError):
+            return
+        found = sum(len(PLACEHOLDER.findall(value)) for _, _, value in fields)
+        if found == sum(
+                template_string.count(placeholder)
+                for placeholder in self.placeholders):
+            self.reaction = reaction
+            self.fields = fields
+
+    def columns(self, dataframe):
+        """Matches placeholders to spreadsheet columns.
+
+        Like generate_dataset(), "$name$" may match a column "$name$" or
+        "name".
+
+        Returns:
+            List of column names, parallel to placeholders.
+
+        Raises:
+            ValueError: A placeholder has no matching column.
+        """
+        columns = []
+        for placeholder in self.placeholders:
+            if placeholder in dataframe.columns:
+                columns.append(placeholder)
+            elif placeholder[1:-1] in dataframe.columns:
+                columns.append(placeholder[1:-1])
+            else:
+                raise ValueError(f'Placeholder {placeholder} not found as a '
+                                 'column in dataset spreadsheet')
+        return columns
+
+    def _fast_fill(self, texts):
+        """Fills the parsed template, or returns None if that is unsafe."""
+        strings = {}
+        for placeholder, text in texts.items():
+            if '$' in text:
+                return None
+            strings[placeholder] = _string(text)
+        reaction = reaction_pb2.Reaction()
+        reaction.CopyFrom(self.reaction)
+        for path, cpp_type, value in self.fields:
+            if cpp_type == descriptor.FieldDescriptor.CPPTYPE_STRING:
+                for placeholder in PLACEHOLDER.findall(value):
+                    if strings[placeholder] is None:
+                        return None
+                    value = value.replace(placeholder, strings[placeholder])
+            else:
+                value = _number(texts[value], cpp_type)
+                if value is None:
+                    return None
+            _set_field(reaction, path, value)
+        return reaction
+
+    def fill(self, substitutions):
+        """Returns the Reaction for one row.
+
+        Args:
+            substitutions: Mapping from placeholders to spreadsheet values.
+
+        Raises:
+            ValueError: The substituted template cannot be parsed.
+        """
+        reaction = None
+        if self.reaction is not None:
+            reaction = self._fast_fill({
+                placeholder: repr(value).strip("'")
+                for placeholder, value in substitutions.items()
+            })
+        if reaction is None:
+            return templating._fill_template(  # pylint: disable=protected-access
+                self.template_string, substitutions)
+        if any(pd.isnull(value) for value in substitutions.values()):
+            _remove_null_inputs(reaction)
+        return reaction
+
+    def rows(self, dataframe, limit=None):
+        """Yields the Reaction for each row, or the first limit rows.
+
+        Raises:
+            ValueError: A placeholder has no matching column, or a row cannot
+                be parsed after substitution.
+        """
+        columns = self.columns(dataframe)
+        if limit is not None:
+            dataframe = dataframe.head(limit)
+        # Rows are read as in generate_dataset(), so values print the same.
+        for _, row in dataframe[columns].iterrows():
+            yield self.fill(dict(zip(self.placeholders, row.values)))
+
+    def generate(self, dataframe):
+        """Like templating.generate_dataset() with validate=False."""
+        return dataset_pb2.Dataset(reactions=list(self.rows(dataframe)))
+
+
+def compile_template(template_string):
+    """Returns the cached Template for a template string."""
+    key = hashlib.blake2b(template_string.encode(), digest_size=16).digest()
+    with _lock:
+        template = _cache.get(key)
+        if template is not None:
+            _cache.move_to_end(key)
+            return template
+    template = Template(template_string)
+    with _lock:
+        _cache[key] = template
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return template
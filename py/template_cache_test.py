@@ -0,0 +1,129 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for editor.py.template_cache."""
+
+import os
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+import pandas as pd
+
+from ord_schema import templating
+
+import template_cache  # pylint: disable=import-error
+
+TEMPLATE = """
+inputs {
+  key: "test"
+  value {
+    components {
+      identifiers { type: SMILES value: "$smiles$" }
+      identifiers { type: NAME value: "compound $name$" }
+      amount { mass { value: $mass$ units: GRAM } }
+    }
+  }
+}
+outcomes {
+  products {
+    identifiers { type: SMILES value: "$product$" }
+    measurements {
+      type: YIELD
+      percentage { value: $yield$ }
+    }
+  }
+}
+"""
+
+
+class TemplateCacheTest(parameterized.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        testdata = os.path.join(os.path.dirname(__file__), 'testdata')
+        with open(os.path.join(testdata, 'nielsen_fig1_template.pbtxt')) as f:
+            self.template_string = f.read()
+        self.dataframe = pd.read_csv(os.path.join(testdata, 'nielsen_fig1.csv'))
+
+    def test_compile(self):
+        template = template_cache.compile_template(self.template_string)
+        self.assertIs(template_cache.compile_template(self.template_string),
+                      template)
+        self.assertIsNotNone(template.reaction)
+        self.assertLen(template.fields, 5)
+        self.assertIn('$product_yield$', template.placeholders)
+
+    def test_generate(self):
+        template = template_cache.compile_template(self.template_string)
+        expected = templating.generate_dataset(self.template_string,
+                                               self.dataframe.copy(),
+                                               validate=False)
+        self.assertEqual(template.generate(self.dataframe), expected)
+
+    @parameterized.parameters([
+        ('CCO', 'ethanol', 1.5, 'CC=O', 40),
+        ('C\\C=C\\C', "it's", 2, 'CC', 12.5),
+        ('CCO', 'a "quoted" $name$', 1e-3, 'C#N', -1),
+        ('CCO', 'café', 'nan', 'CC', 'abc'),
+        ('CCO', 'tab\there', float('nan'), np.nan, 3),
+        (np.nan, np.nan, 1, 'CC', 5),
+    ])
+    def test_fill(self, smiles, name, mass, product, value):
+        dataframe = pd.DataFrame({
+            'smiles': [smiles],
+            'name': [name],
+            'mass': [mass],
+            'product': [product],
+            'yield': [value],
+        })
+        template = template_cache.compile_template(TEMPLATE)
+        try:
+            expected = templating.generate_dataset(TEMPLATE,
+                                                   dataframe.copy(),
+                                                   validate=False)
+        except ValueError:
+            with self.assertRaises(ValueError):
+                template.generate(dataframe)
+        else:
+            self.assertEqual(template.generate(dataframe), expected)
+
+    def test_unparsed_template(self):
+        template_string = self.template_string.replace('type: SMILES',
+                                                       'type: $kind$', 1)
+        dataframe = self.dataframe.assign(kind='SMILES')
+        template = template_cache.compile_template(template_string)
+        self.assertIsNone(template.reaction)
+        self.assertEqual(
+            template.generate(dataframe),
+            templating.generate_dataset(self.template_string,
+                                        self.dataframe.copy(),
+                                        validate=False))
+
+    def test_rows_limit(self):
+        template = template_cache.compile_template(self.template_string)
+        self.assertLen(list(template.rows(self.dataframe, limit=3)), 3)
+
+    def test_missing_column(self):
+        template = template_cache.compile_template(self.template_string)
+        with self.assertRaisesRegex(ValueError, 'not found'):
+            template.generate(self.dataframe.drop(columns=['base_smiles']))
+
+    def test_eviction(self):
+        for i in range(template_cache.CACHE_SIZE + 1):
+            template_cache.compile_template(f'# {i}\n')
+        self.assertLen(template_cache._cache, template_cache.CACHE_SIZE)  # pylint: disable=protected-access
+
+
+if __name__ == '__main__':
+    absltest.main()
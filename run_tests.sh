@@ -54,7 +54,7 @@ done
 
 # Initialize the database with schema and contents.
 set -e
-psql -p 5432 -h localhost -U postgres -f schema.sql
+./py/schema.py --reset
 ./py/migrate.py
 set +e
 
@@ -67,6 +67,44 @@ node js/test.js
 # Python tests run Flask in the container.
 docker exec "$(docker ps -q --filter name=web)" python py/serve_test.py
 [ $? -eq 0 ] || status=1
+docker exec "$(docker ps -q --filter name=web)" python py/schema_test.py
+[ $? -eq 0 ] || status=1
+docker exec "$(docker ps -q --filter name=web)" python py/migrate_test.py
+[ $? -eq 0 ] || status=1
+docker exec "$(docker ps -q --filter name=web)" python py/profiling_test.py
+[ $? -eq 0 ] || status=1
+docker exec "$(docker ps -q --filter name=web)" python py/async_serve_test.py
+[ $? -eq 0 ] || status=1
+docker exec "$(docker ps -q --filter name=web)" python py/dataset_diff_test.py
+[ $? -eq 0 ] || status=1
+docker exec "$(docker ps -q --filter name=web)" python py/revisions_test.py
+[ $? -eq 0 ] || status=1
+docker exec "$(docker ps -q --filter name=web)" python py/reaction_operations_test.py
+[ $? -eq 0 ] || status=1
+docker exec "$(docker ps -q --filter name=web)" python py/export_test.py
+[ $? -eq 0 ] || status=1
+docker exec "$(docker ps -q --filter name=web)" python py/dataset_stats_test.py
+[ $? -eq 0 ] || status=1
+docker exec "$(docker ps -q --filter name=web)" python py/review_summary_test.py
+[ $? -eq 0 ] || status=1
+docker exec "$(docker ps -q --filter name=web)" python py/reaction_index_test.py
+[ $? -eq 0 ] || status=1
+docker exec "$(docker ps -q --filter name=web)" python py/template_cache_test.py
+[ $? -eq 0 ] || status=1
+docker exec "$(docker ps -q --filter name=web)" python py/lazy_import_test.py
+[ $? -eq 0 ] || status=1
+docker exec "$(docker ps -q --filter name=web)" python py/compute_test.py
+[ $? -eq 0 ] || status=1
+docker exec "$(docker ps -q --filter name=web)" python py/admission_test.py
+[ $? -eq 0 ] || status=1
+docker exec "$(docker ps -q --filter name=web)" python py/reaper_test.py
+[ $? -eq 0 ] || status=1
+docker exec "$(docker ps -q --filter name=web)" python py/compression_test.py
+[ $? -eq 0 ] || status=1
+docker exec "$(docker ps -q --filter name=web)" python py/incremental_validation_test.py
+[ $? -eq 0 ] || status=1
+docker exec "$(docker ps -q --filter name=web)" python py/dedup_report_test.py
+[ $? -eq 0 ] || status=1
 
 # Report pass/fail.
 red='\033[0;31m'
@@ -12,35 +12,22 @@
 -- See the License for the specific language governing permissions and
 -- limitations under the License.
 
--- To initialize the editor database on a fresh Postgres volume:
---
---   $ psql -p 5432 -h localhost -U postgres -f schema.sql
---
--- To populate the editor database from the db/ directory:
---
---   $ ./py/migrate.py
-
-DROP DATABASE IF EXISTS editor;
-
-\c postgres;
-
-CREATE DATABASE editor;
-
-\c editor;
+-- The original editor schema. Tables are created only if missing so that
+-- databases initialized from the old schema.sql adopt migrations in place.
 
-CREATE TABLE users (
+CREATE TABLE IF NOT EXISTS users (
   user_id CHARACTER(32) PRIMARY KEY,
   name TEXT,
   created_time INTEGER NOT NULL
 );
 
-CREATE TABLE logins (
+CREATE TABLE IF NOT EXISTS logins (
   access_token TEXT PRIMARY KEY,
   user_id CHARACTER(32) REFERENCES users,
   timestamp INTEGER NOT NULL
 );
 
-CREATE TABLE datasets (
+CREATE TABLE IF NOT EXISTS datasets (
   user_id CHARACTER(32) REFERENCES users,
   name TEXT NOT NULL,
   serialized BYTEA NOT NULL,
@@ -50,8 +37,9 @@ CREATE TABLE datasets (
 -- System users:
 --   "review" owns read-only datasets imported from GitHub pull requests.
 --   "test" owns datasets imported from db/ and used only in tests.
-INSERT INTO users VALUES 
+INSERT INTO users VALUES
   -- review:
   ('8df09572f3c74dbcb6003e2eef8e48fc', NULL, EXTRACT(EPOCH FROM NOW())),
   -- test:
-  ('680b0d9fe649417cb092d790907bd5a5', NULL, EXTRACT(EPOCH FROM NOW()));
+  ('680b0d9fe649417cb092d790907bd5a5', NULL, EXTRACT(EPOCH FROM NOW()))
+ON CONFLICT DO NOTHING;
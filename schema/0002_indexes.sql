@@ -0,0 +1,22 @@
+-- Copyright 2020 Open Reaction Database Project Authors
+--
+-- Licensed under the Apache License, Version 2.0 (the "License");
+-- you may not use this file except in compliance with the License.
+-- You may obtain a copy of the License at
+--
+--      http://www.apache.org/licenses/LICENSE-2.0
+--
+-- Unless required by applicable law or agreed to in writing, software
+-- distributed under the License is distributed on an "AS IS" BASIS,
+-- WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+-- See the License for the specific language governing permissions and
+-- limitations under the License.
+
+-- Secondary indexes for lookups in serve.py that are not covered by a primary
+-- key.
+
+-- github_callback: SELECT user_id FROM users WHERE name=%s
+CREATE INDEX IF NOT EXISTS users_name ON users (name);
+
+-- Revoking or migrating all the logins of one user.
+CREATE INDEX IF NOT EXISTS logins_user_id ON logins (user_id);
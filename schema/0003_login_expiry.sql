@@ -0,0 +1,22 @@
+-- Copyright 2020 Open Reaction Database Project Authors
+--
+-- Licensed under the Apache License, Version 2.0 (the "License");
+-- you may not use this file except in compliance with the License.
+-- You may obtain a copy of the License at
+--
+--      http://www.apache.org/licenses/LICENSE-2.0
+--
+-- Unless required by applicable law or agreed to in writing, software
+-- distributed under the License is distributed on an "AS IS" BASIS,
+-- WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+-- See the License for the specific language governing permissions and
+-- limitations under the License.
+
+-- Access tokens expire with their cookies, one year after they are issued.
+-- Expired rows are purged periodically by reap_logins() in py/reaper.py.
+
+ALTER TABLE logins ADD COLUMN expires_time INTEGER;
+UPDATE logins SET expires_time = timestamp + 31536000;
+ALTER TABLE logins ALTER COLUMN expires_time SET NOT NULL;
+
+CREATE INDEX logins_expires_time ON logins (expires_time);
@@ -0,0 +1,26 @@
+-- Copyright 2020 Open Reaction Database Project Authors
+--
+-- Licensed under the Apache License, Version 2.0 (the "License");
+-- you may not use this file except in compliance with the License.
+-- You may obtain a copy of the License at
+--
+--      http://www.apache.org/licenses/LICENSE-2.0
+--
+-- Unless required by applicable law or agreed to in writing, software
+-- distributed under the License is distributed on an "AS IS" BASIS,
+-- WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+-- See the License for the specific language governing permissions and
+-- limitations under the License.
+
+-- Summary columns maintained by serve.put_dataset() so that listings do not
+-- need to parse the serialized Dataset. Sizes count bytes of the binary proto;
+-- the serialized column holds its hex encoding.
+
+ALTER TABLE datasets
+  ADD COLUMN size INTEGER NOT NULL DEFAULT 0,
+  ADD COLUMN num_reactions INTEGER,
+  ADD COLUMN updated_time INTEGER NOT NULL DEFAULT 0;
+
+UPDATE datasets SET
+  size = OCTET_LENGTH(serialized) / 2,
+  updated_time = EXTRACT(EPOCH FROM NOW());
@@ -0,0 +1,38 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Fills in datasets.num_reactions for rows that predate the column."""
+
+import binascii
+
+from ord_schema.proto import dataset_pb2
+
+
+def upgrade(cursor):
+    """Parses each uncounted dataset once and records its reaction count."""
+    cursor.execute(
+        'SELECT user_id, name FROM datasets WHERE num_reactions IS NULL')
+    keys = cursor.fetchall()
+    for user_id, name in keys:
+        cursor.execute(
+            'SELECT serialized FROM datasets WHERE user_id=%s AND name=%s',
+            [user_id, name])
+        serialized = binascii.unhexlify(cursor.fetchone()[0].tobytes())
+        dataset = dataset_pb2.Dataset.FromString(serialized)
+        cursor.execute(
+            'UPDATE datasets SET num_reactions=%s '
+            'WHERE user_id=%s AND name=%s',
+            [len(dataset.reactions), user_id, name])
+    cursor.execute('ALTER TABLE datasets '
+                   'ALTER COLUMN num_reactions SET DEFAULT 0, '
+                   'ALTER COLUMN num_reactions SET NOT NULL')
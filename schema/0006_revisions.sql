@@ -0,0 +1,41 @@
+-- Copyright 2020 Open Reaction Database Project Authors
+--
+-- Licensed under the Apache License, Version 2.0 (the "License");
+-- you may not use this file except in compliance with the License.
+-- You may obtain a copy of the License at
+--
+--      http://www.apache.org/licenses/LICENSE-2.0
+--
+-- Unless required by applicable law or agreed to in writing, software
+-- distributed under the License is distributed on an "AS IS" BASIS,
+-- WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+-- See the License for the specific language governing permissions and
+-- limitations under the License.
+
+-- Dataset revision history; see py/revisions.py.
+
+-- Serialized Reactions keyed by a hash of their content. Each distinct
+-- reaction is stored once no matter how many revisions contain it.
+CREATE TABLE reactions (
+  hash BYTEA PRIMARY KEY,
+  serialized BYTEA NOT NULL
+);
+
+-- Snapshots list every reaction hash in order. Other revisions store splice
+-- operations against the previous revision in delta and only the inserted
+-- hashes in hashes.
+CREATE TABLE revisions (
+  user_id CHARACTER(32) REFERENCES users,
+  name TEXT NOT NULL,
+  revision INTEGER NOT NULL,
+  created_time INTEGER NOT NULL,
+  snapshot BOOLEAN NOT NULL,
+  header BYTEA NOT NULL,
+  delta TEXT,
+  hashes BYTEA[] NOT NULL,
+  num_reactions INTEGER NOT NULL,
+  PRIMARY KEY (user_id, name, revision)
+);
+
+-- Finds the revisions that still refer to a reaction during compaction.
+CREATE INDEX revisions_hashes ON revisions USING GIN (hashes);
@@ -0,0 +1,42 @@
+-- Copyright 2020 Open Reaction Database Project Authors
+--
+-- Licensed under the Apache License, Version 2.0 (the "License");
+-- you may not use this file except in compliance with the License.
+-- You may obtain a copy of the License at
+--
+--      http://www.apache.org/licenses/LICENSE-2.0
+--
+-- Unless required by applicable law or agreed to in writing, software
+-- distributed under the License is distributed on an "AS IS" BASIS,
+-- WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+-- See the License for the specific language governing permissions and
+-- limitations under the License.
+
+-- Dataset and user statistics maintained by serve.insert_dataset(); see
+-- py/dataset_stats.py. Bucket 0 of yield_buckets counts reactions without a
+-- yield; the rest count yields in steps of 20%.
+
+ALTER TABLE datasets
+  ADD COLUMN num_compounds INTEGER NOT NULL DEFAULT 0,
+  ADD COLUMN num_errors INTEGER NOT NULL DEFAULT 0,
+  ADD COLUMN yield_buckets INTEGER[] NOT NULL DEFAULT '{0,0,0,0,0,0}';
+
+-- Summaries of distinct reactions, keyed like the reactions table.
+CREATE TABLE reaction_stats (
+  hash BYTEA PRIMARY KEY,
+  num_compounds INTEGER NOT NULL,
+  num_errors INTEGER NOT NULL,
+  yield_bucket SMALLINT NOT NULL
+);
+
+-- Totals over each user's datasets.
+CREATE TABLE user_stats (
+  user_id CHARACTER(32) PRIMARY KEY REFERENCES users ON DELETE CASCADE,
+  num_datasets INTEGER NOT NULL,
+  num_reactions BIGINT NOT NULL,
+  size BIGINT NOT NULL,
+  num_compounds BIGINT NOT NULL,
+  num_errors BIGINT NOT NULL,
+  yield_buckets BIGINT[] NOT NULL,
+  updated_time INTEGER NOT NULL
+);
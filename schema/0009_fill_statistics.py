@@ -0,0 +1,166 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Fills in dataset and user statistics for rows that predate them.
+
+The summary logic of py/dataset_stats.py and the revision loading of
+py/revisions.py are copied here as they were when the statistics were added,
+so later changes to the application cannot change what this migration does.
+"""
+
+import binascii
+import bisect
+import hashlib
+import json
+
+from ord_schema import validations
+from ord_schema.proto import dataset_pb2
+from ord_schema.proto import reaction_pb2
+
+_YIELD_BOUNDS = (20, 40, 60, 80)
+_NUM_BUCKETS = len(_YIELD_BOUNDS) + 2
+
+
+def _load_latest(cursor, user_id, name):
+    """Rebuilds the newest revision of a copy that has no serialized proto."""
+    cursor.execute(
+        'SELECT snapshot, delta, hashes, header FROM revisions '
+        'WHERE user_id=%s AND name=%s AND revision>=('
+        '  SELECT MAX(revision) FROM revisions '
+        '  WHERE user_id=%s AND name=%s AND snapshot) '
+        'ORDER BY revision', [user_id, name] * 2)
+    rows = cursor.fetchall()
+    hashes = []
+    for snapshot, delta, stored, _ in rows:
+        stored = [bytes(value) for value in stored]
+        if snapshot:
+            hashes = stored
+            continue
+        operations = []
+        offset = 0
+        for start, end, count in json.loads(delta):
+            operations.append((start, end, stored[offset:offset + count]))
+            offset += count
+        for start, end, replacement in reversed(operations):
+            hashes[start:end] = replacement
+    cursor.execute(
+        'SELECT hash, serialized FROM reactions WHERE hash=ANY(%s::BYTEA[])',
+        [sorted(set(hashes))])
+    payloads = {bytes(value): bytes(serialized) for value, serialized in cursor}
+    dataset = dataset_pb2.Dataset.FromString(bytes(rows[-1][3]))
+    for value in hashes:
+        dataset.reactions.add().MergeFromString(payloads[value])
+    return dataset
+
+
+def _summarize_reaction(reaction):
+    """Returns (num_compounds, num_errors, yield bucket) for a Reaction."""
+    num_compounds = sum(
+        len(reaction_input.components)
+        for reaction_input in reaction.inputs.values())
+    num_compounds += sum(len(outcome.products) for outcome in reaction.outcomes)
+    output = validations.validate_message(
+        reaction,
+        raise_on_error=False,
+        options=validations.ValidationOptions(require_provenance=True))
+    best = None
+    for outcome in reaction.outcomes:
+        for product in outcome.products:
+            for measurement in product.measurements:
+                if (measurement.type == reaction_pb2.ProductMeasurement.YIELD
+                        and measurement.WhichOneof('value') == 'percentage'):
+                    value = measurement.percentage.value
+                    if best is None or value > best:
+                        best = value
+    bucket = 0 if best is None else 1 + bisect.bisect_right(_YIELD_BOUNDS, best)
+    return num_compounds, len(output.errors), bucket
+
+
+def _summarize(cursor, dataset):
+    """Returns (num_compounds, num_errors, yield_buckets) for a Dataset.
+
+    Each distinct reaction is summarized once and stored in reaction_stats.
+    """
+    payloads = []
+    for reaction in dataset.reactions:
+        serialized = reaction.SerializeToString(deterministic=True)
+        value = hashlib.blake2b(serialized, digest_size=16).digest()
+        payloads.append((value, reaction))
+    known = {}
+    if payloads:
+        cursor.execute(
+            'SELECT hash, num_compounds, num_errors, yield_bucket '
+            'FROM reaction_stats WHERE hash=ANY(%s::BYTEA[])',
+            [sorted({value for value, _ in payloads})])
+        known = {bytes(row[0]): tuple(row[1:]) for row in cursor}
+    num_compounds = num_errors = 0
+    yield_buckets = [0] * _NUM_BUCKETS
+    for value, reaction in payloads:
+        if value not in known:
+            known[value] = _summarize_reaction(reaction)
+            cursor.execute(
+                'INSERT INTO reaction_stats (hash, num_compounds, num_errors, '
+                'yield_bucket) VALUES (%s, %s, %s, %s)', [value, *known[value]])
+        reaction_compounds, reaction_errors, bucket = known[value]
+        num_compounds += reaction_compounds
+        num_errors += reaction_errors
+        yield_buckets[bucket] += 1
+    return num_compounds, num_errors, yield_buckets
+
+
+def upgrade(cursor):
+    """Parses each dataset once and records its summary."""
+    cursor.execute('SELECT user_id, name FROM datasets')
+    keys = cursor.fetchall()
+    for user_id, name in keys:
+        cursor.execute(
+            'SELECT serialized FROM datasets WHERE user_id=%s AND name=%s',
+            [user_id, name])
+        serialized = cursor.fetchone()[0]
+        if serialized is None:
+            dataset = _load_latest(cursor, user_id, name)
+        else:
+            dataset = dataset_pb2.Dataset.FromString(
+                binascii.unhexlify(serialized.tobytes()))
+        cursor.execute(
+            'UPDATE datasets SET num_compounds=%s, num_errors=%s, '
+            'yield_buckets=%s WHERE user_id=%s AND name=%s',
+            [*_summarize(cursor, dataset), user_id, name])
+    cursor.execute('SELECT user_id FROM users')
+    for (user_id,) in cursor.fetchall():
+        cursor.execute(
+            'SELECT num_reactions, size, num_compounds, num_errors, '
+            'yield_buckets, updated_time FROM datasets WHERE user_id=%s',
+            [user_id])
+        totals = [0, 0, 0, 0, [0] * _NUM_BUCKETS]
+        num_datasets = 0
+        updated_time = 0
+        for row in cursor:
+            num_datasets += 1
+            for i in range(4):
+                totals[i] += row[i]
+            for i, count in enumerate(row[4]):
+                totals[4][i] += count
+            updated_time = max(updated_time, row[5])
+        cursor.execute(
+            'INSERT INTO user_stats (user_id, num_datasets, num_reactions, '
+            'size, num_compounds, num_errors, yield_buckets, updated_time) '
+            'VALUES (%s, %s, %s, %s, %s, %s, %s, %s) '
+            'ON CONFLICT (user_id) DO UPDATE SET '
+            'num_datasets=EXCLUDED.num_datasets, '
+            'num_reactions=EXCLUDED.num_reactions, size=EXCLUDED.size, '
+            'num_compounds=EXCLUDED.num_compounds, '
+            'num_errors=EXCLUDED.num_errors, '
+            'yield_buckets=EXCLUDED.yield_buckets, '
+            'updated_time=EXCLUDED.updated_time',
+            [user_id, num_datasets, *totals, updated_time])
@@ -0,0 +1,26 @@
+-- Copyright 2020 Open Reaction Database Project Authors
+--
+-- Licensed under the Apache License, Version 2.0 (the "License");
+-- you may not use this file except in compliance with the License.
+-- You may obtain a copy of the License at
+--
+--      http://www.apache.org/licenses/LICENSE-2.0
+--
+-- Unless required by applicable law or agreed to in writing, software
+-- distributed under the License is distributed on an "AS IS" BASIS,
+-- WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+-- See the License for the specific language governing permissions and
+-- limitations under the License.
+
+-- Triage summaries of the review user's datasets, written by
+-- serve.store_reviews(); see py/review_summary.py. Rows go away with their datasets.
+CREATE TABLE reviews (
+  user_id CHARACTER(32) NOT NULL,
+  name TEXT NOT NULL,
+  number INTEGER NOT NULL,
+  title TEXT NOT NULL,
+  filename TEXT NOT NULL,
+  summary TEXT NOT NULL,  -- JSON.
+  PRIMARY KEY (user_id, name),
+  FOREIGN KEY (user_id, name) REFERENCES datasets ON DELETE CASCADE
+);
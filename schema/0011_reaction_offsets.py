@@ -0,0 +1,87 @@
+# Copyright 2020 Open Reaction Database Project Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Adds datasets.reaction_offsets and indexes the existing datasets.
+
+Each entry is the little-endian (offset, length) of one reactions field payload
+in the serialized Dataset; see py/reaction_index.py. The scanner is copied here
+so later changes to the application cannot change what this migration does.
+Copies without a serialized proto are left NULL.
+"""
+
+import binascii
+import struct
+
+# Dataset.reactions and the wire types a Dataset can contain.
+_REACTIONS = 3
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+_FIXED32 = 5
+
+
+def _read_varint(data, position):
+    """Returns (value, position after the varint)."""
+    value = 0
+    shift = 0
+    while True:
+        if position >= len(data):
+            raise ValueError('truncated varint')
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+def _scan(data):
+    """Returns the packed (offset, length) of every reactions field payload."""
+    entries = []
+    position = 0
+    while position < len(data):
+        tag, position = _read_varint(data, position)
+        number, wire_type = tag >> 3, tag & 7
+        if wire_type == _VARINT:
+            payload = position
+            _, position = _read_varint(data, position)
+        elif wire_type == _FIXED64:
+            payload, position = position, position + 8
+        elif wire_type == _LENGTH_DELIMITED:
+            length, payload = _read_varint(data, position)
+            position = payload + length
+        elif wire_type == _FIXED32:
+            payload, position = position, position + 4
+        else:
+            raise ValueError(f'unsupported wire type: {wire_type}')
+        if position > len(data):
+            raise ValueError('truncated field')
+        if number == _REACTIONS:
+            entries.append(struct.pack('<II', payload, position - payload))
+    return b''.join(entries)
+
+
+def upgrade(cursor):
+    """Scans each stored dataset once; no protos are parsed."""
+    cursor.execute('ALTER TABLE datasets ADD COLUMN reaction_offsets BYTEA')
+    cursor.execute(
+        'SELECT user_id, name FROM datasets WHERE serialized IS NOT NULL')
+    keys = cursor.fetchall()
+    for user_id, name in keys:
+        cursor.execute(
+            'SELECT serialized FROM datasets WHERE user_id=%s AND name=%s',
+            [user_id, name])
+        serialized = binascii.unhexlify(cursor.fetchone()[0].tobytes())
+        cursor.execute(
+            'UPDATE datasets SET reaction_offsets=%s '
+            'WHERE user_id=%s AND name=%s', [_scan(serialized), user_id, name])
@@ -0,0 +1,28 @@
+-- Copyright 2020 Open Reaction Database Project Authors
+--
+-- Licensed under the Apache License, Version 2.0 (the "License");
+-- you may not use this file except in compliance with the License.
+-- You may obtain a copy of the License at
+--
+--      http://www.apache.org/licenses/LICENSE-2.0
+--
+-- Unless required by applicable law or agreed to in writing, software
+-- distributed under the License is distributed on an "AS IS" BASIS,
+-- WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+-- See the License for the specific language governing permissions and
+-- limitations under the License.
+
+-- Reference counts for the reactions table; see py/revisions.py. refs is the
+-- number of revisions rows whose hashes include the reaction.
+
+ALTER TABLE reactions ADD COLUMN refs INTEGER NOT NULL DEFAULT 0;
+
+UPDATE reactions SET refs=(
+  SELECT COUNT(*) FROM revisions WHERE hashes @> ARRAY[reactions.hash]);
+
+DELETE FROM reaction_stats WHERE hash IN (
+  SELECT hash FROM reactions WHERE refs=0);
+DELETE FROM reactions WHERE refs=0;
+
+-- Unreferenced reactions are now found by their counts.
+DROP INDEX revisions_hashes;
@@ -0,0 +1,36 @@
+-- Copyright 2020 Open Reaction Database Project Authors
+--
+-- Licensed under the Apache License, Version 2.0 (the "License");
+-- you may not use this file except in compliance with the License.
+-- You may obtain a copy of the License at
+--
+--      http://www.apache.org/licenses/LICENSE-2.0
+--
+-- Unless required by applicable law or agreed to in writing, software
+-- distributed under the License is distributed on an "AS IS" BASIS,
+-- WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+-- See the License for the specific language governing permissions and
+-- limitations under the License.
+
+-- Deletes the histories of datasets that no longer exist. Deleting a dataset
+-- now deletes its history too; see revisions.delete_history() in py/.
+
+CREATE TEMPORARY TABLE removed ON COMMIT DROP AS
+  SELECT hash, COUNT(*) AS count
+  FROM revisions,
+    LATERAL (SELECT DISTINCT UNNEST(hashes) AS hash) AS row_hashes
+  WHERE NOT EXISTS (
+    SELECT 1 FROM datasets
+    WHERE datasets.user_id=revisions.user_id AND datasets.name=revisions.name)
+  GROUP BY hash;
+
+DELETE FROM revisions WHERE NOT EXISTS (
+  SELECT 1 FROM datasets
+  WHERE datasets.user_id=revisions.user_id AND datasets.name=revisions.name);
+
+UPDATE reactions SET refs=refs-removed.count
+  FROM removed WHERE reactions.hash=removed.hash;
+
+DELETE FROM reaction_stats WHERE hash IN (
+  SELECT hash FROM reactions WHERE refs<=0);
+DELETE FROM reactions WHERE refs<=0;